@@ -0,0 +1,441 @@
+r'''Benchmarks for the nddata hot paths.
+
+Run all the benchmarks with::
+
+    python benchmarks/nddata_benchmarks.py
+
+This writes ``benchmark_results.json`` (change with ``--output``), which
+records the best and mean wall time and the peak memory for each
+benchmark, along with the versions of python, numpy and pyspecdata.
+Passing ``--compare old_results.json`` prints the ratio of each time to
+the one stored in ``old_results.json``, so that regressions stand out.
+``--only`` takes a regular expression that selects the benchmarks to run.
+
+Everything runs offline: the datasets are synthetic, and are sized like
+real ones (a 64k-point FID, a 512 x 8k 2D series, and a 3D ELDOR
+dataset), and the Bruker NMR, Bruker Xepr, and ACERT CW files are
+generated on the fly in a temporary directory.
+``import_pyspecdata`` times the import of pyspecdata in a new interpreter,
+and fails if any of the modules that should only be imported on first use
+(sympy, tables, h5py, *etc.*) is imported eagerly.
+Each benchmark runs in its own python process, so that the peak memory
+(taken from :func:`resource.getrusage`, where available) belongs to that
+benchmark alone.
+'''
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from timeit import default_timer
+try:
+    import resource
+except ImportError:
+    resource = None # windows
+
+_benchmarks = []
+def benchmark(number = 5):
+    r'''Register a benchmark.
+
+    The decorated function is called (untimed) with a scratch directory,
+    and returns either the function that is timed, or a tuple of the
+    function that is timed and a function that is called (untimed)
+    before each timed call.
+    '''
+    def decorator(setup_function):
+        _benchmarks.append((setup_function.__name__,setup_function,number))
+        return setup_function
+    return decorator
+#{{{ synthetic datasets
+def fid_1d(n = 65536):
+    from pyspecdata import nddata
+    from numpy import r_, exp, pi, random
+    t2 = r_[0:n]*1e-5
+    retval = nddata(exp(1j*2*pi*100*t2-t2/0.1)
+            + 0.01*random.randn(n) + 0.01j*random.randn(n),
+            [-1],['t2']).labels('t2',t2)
+    retval.set_units('t2','s')
+    return retval
+def series_2d(n_indirect = 512,n = 8192):
+    from pyspecdata import nddata
+    from numpy import r_, exp, pi, random
+    t2 = r_[0:n]*1e-5
+    vd = r_[0:n_indirect]*1e-3
+    data = (exp(1j*2*pi*100*t2-t2/0.1).reshape(1,-1)
+            *(1-2*exp(-vd/0.05)).reshape(-1,1))
+    data = data + 0.01*random.randn(*data.shape)
+    retval = nddata(data,[n_indirect,n],['vd','t2'])
+    retval.labels(['vd','t2'],[vd,t2])
+    retval.set_units('t2','s')
+    return retval
+def eldor_3d(n_phcyc = 16,n_t1 = 128,n = 1024):
+    from pyspecdata import nddata
+    from numpy import r_, random
+    retval = nddata(random.randn(n_phcyc,n_t1,n)+1j*random.randn(n_phcyc,n_t1,n),
+            [n_phcyc,n_t1,n],['phcyc','t1','t2'])
+    retval.labels(['phcyc','t1','t2'],
+            [r_[0:n_phcyc],r_[0:n_t1]*1e-9,r_[0:n]*1e-9])
+    return retval
+#}}}
+#{{{ synthetic files
+def write_bruker_series(directory,td1 = 512,td2 = 16384):
+    "write a Bruker ser file with td1 x td2/2 complex points into expno 1 of `directory`"
+    from numpy import random, int32
+    expno_dir = os.path.join(directory,'1')
+    os.makedirs(expno_dir)
+    for fname,td in [('acqus',td2),('acqu2s',td1)]:
+        with open(os.path.join(expno_dir,fname),'w') as fp:
+            fp.write('##TITLE= synthetic\n')
+            fp.write('##$BYTORDA= 0\n')
+            fp.write('##$DIGMOD= 0\n')
+            fp.write('##$RG= 1\n')
+            fp.write('##$SW_h= 5000\n')
+            fp.write('##$TD= %d\n'%td)
+            fp.write('##END=\n')
+    with open(os.path.join(expno_dir,'pulseprogram'),'w') as fp:
+        fp.write(';synthetic pulse program\n')
+    td2_zf = int(-(-td2//256)*256)
+    with open(os.path.join(expno_dir,'ser'),'wb') as fp:
+        fp.write(random.randint(-2**20,2**20,size = td1*td2_zf).astype('<i4').tostring())
+    return directory
+def write_xepr(directory,n = 4096):
+    "write a pair of Bruker Xepr (DSC/DTA) files for a field sweep"
+    from numpy import random
+    basename = os.path.join(directory,'synthetic')
+    with open(basename+'.DSC','w') as fp:
+        fp.write('#DESC\t1.2 * DESCRIPTOR INFORMATION ***********************\n')
+        fp.write('XPTS\t%d\n'%n)
+        fp.write('XMIN\t3400.0\n')
+        fp.write('XWID\t100.0\n')
+        fp.write("XUNI\t'G'\n")
+        fp.write('#SPL\t1.2 * STANDARD PARAMETER LAYER\n')
+        fp.write('Enable1stHarm\ttrue\n')
+        fp.write('Gain\t60 dB\n')
+    with open(basename+'.DTA','wb') as fp:
+        fp.write(random.randn(n).astype('>f8').tostring())
+    return basename+'.DSC'
+def write_acert_cw(directory,n_repeats = 16,n = 8192):
+    "write an ACERT CW HDF5 file"
+    import h5py
+    from numpy import random, linspace
+    filename = os.path.join(directory,'synthetic_cw.h5')
+    with h5py.File(filename,'w') as h5:
+        experiment = h5.create_group('experiment')
+        experiment.create_dataset('data.r',data = random.randn(n_repeats,n))
+        experiment.create_dataset('data.i',data = random.randn(n_repeats,n))
+        experiment.create_dataset('fields',data = linspace(3.3,3.4,n))
+        experiment.attrs['run_number'] = 1
+        experiment.create_group('execution').attrs['operator'] = 'synthetic'
+        experiment.create_group('description').attrs['class'] = 'CW'
+    return filename
+#}}}
+#{{{ the benchmarks
+@benchmark()
+def aligndata_1d_2d(workdir):
+    d1 = fid_1d(8192)
+    d2 = series_2d()
+    return lambda: d1.aligndata(d2)
+@benchmark()
+def multiply_broadcast_1d_2d(workdir):
+    d1 = fid_1d(8192)
+    d2 = series_2d()
+    return lambda: d2 * d1
+@benchmark()
+def multiply_transposed_3d(workdir):
+    r'''multiply a 3D dataset by a 2D one whose dimensions come in the
+    opposite order, so that aligndata has to transpose the argument'''
+    d3 = eldor_3d(n = 256)
+    d2 = eldor_3d(n_phcyc = 1,n = 256)['phcyc',0].reorder('t2')
+    return lambda: d3 * d2
+@benchmark(number = 20)
+def getitem_index_2d(workdir):
+    d = series_2d()
+    return lambda: d['vd',5]
+@benchmark(number = 20)
+def getitem_slice_2d(workdir):
+    d = series_2d()
+    return lambda: d['t2',0:4096]
+@benchmark(number = 20)
+def getitem_range_2d(workdir):
+    d = series_2d()
+    return lambda: d['t2':(0.01,0.05)]
+@benchmark(number = 10)
+def getitem_index_3d(workdir):
+    d = eldor_3d()
+    return lambda: d['phcyc',3]
+@benchmark()
+def ft_ift_1d(workdir):
+    d = fid_1d()
+    def run():
+        d.ft('t2',shift = True)
+        d.ift('t2')
+    return run
+@benchmark()
+def ft_ift_2d(workdir):
+    d = series_2d()
+    def run():
+        d.ft('t2',shift = True)
+        d.ift('t2')
+    return run
+@benchmark()
+def ft_ift_3d(workdir):
+    d = eldor_3d()
+    def run():
+        d.ft('t2',shift = True)
+        d.ift('t2')
+    return run
+@benchmark()
+def copy_2d(workdir):
+    d = series_2d()
+    return lambda: d.copy()
+@benchmark()
+def copy_3d(workdir):
+    d = eldor_3d()
+    return lambda: d.copy()
+@benchmark()
+def concat_scans(workdir):
+    r'''concatenate 2048 real single-scan datasets into a 2D series'''
+    from pyspecdata import concat
+    d = fid_1d(2048)
+    d.data = d.data.real.copy()
+    scans = [d.copy() for j in range(2048)]
+    return lambda: concat(scans,'scan')
+@benchmark()
+def buffer_append_scans(workdir):
+    r'''append 2048 single scans to an nddata_buffer, taking the running
+    average after each one, as for a live display'''
+    from pyspecdata import nddata_buffer
+    d = fid_1d(2048)
+    def run():
+        buf = nddata_buffer('scan')
+        for j in range(2048):
+            buf.append(d)
+            buf.mean()
+        return buf.result()
+    return run
+@benchmark()
+def running_stats_scans(workdir):
+    r'''accumulate the mean, variance, and covariance along t2 of 1024
+    single scans of a phase-cycled echo, one scan at a time'''
+    from pyspecdata import running_stats
+    d = eldor_3d(n_phcyc = 16, n_t1 = 1, n = 256)['t1',0]
+    def run():
+        stats = running_stats('scan',covariance = 't2')
+        for j in range(1024):
+            stats.add(d)
+        return stats.mean(),stats.covariance()
+    return run
+@benchmark()
+def contiguous_2d(workdir):
+    r'''find the blocks above a threshold along t2, for all 512 slices of
+    a 2D series at once'''
+    d = abs(series_2d())
+    def run():
+        return d.contiguous(lambda x,axis: x > 0.5*x.data.mean(),'t2')
+    return run
+@benchmark()
+def find_peaks_2d(workdir):
+    r'''smooth all 512 slices of a 2D series along t2, and find the
+    maxima and minima above (below) the threshold, as esr_saturation does'''
+    d = series_2d().real
+    def run():
+        return (d.find_peaks('t2',smoothing = 1e-4),
+                d.find_peaks('t2',smoothing = 1e-4,find = 'min'))
+    return run
+@benchmark()
+def shape_lookups(workdir):
+    r'''look up the dimensions and shape of a small 3D dataset 10,000
+    times each, as the arithmetic and slicing methods do'''
+    from pyspecdata import ndshape
+    d = eldor_3d(n_phcyc = 4,n_t1 = 4,n = 16)
+    def run():
+        for j in range(10000):
+            d.axn('t2')
+            d.axlen('t1')
+            ndshape(d)['phcyc']
+    return run
+@benchmark()
+def smoosh_chunk_3d(workdir):
+    r'''smoosh and chunk a labeled 3D dataset -- with logging at the
+    default (WARNING) level, this measures the cost of the debug messages
+    that aren't logged'''
+    d = eldor_3d(n = 64)
+    def run():
+        d.copy().smoosh(['phcyc','t1'],'indirect').chunk('indirect',['phcyc','t1'],[16,128])
+    return run
+@benchmark(number = 3)
+def load_and_process(workdir):
+    r'''a typical script: load a Bruker series, then FT and average it'''
+    from pyspecdata.load_files import load_indiv_file
+    filename = write_bruker_series(os.path.join(workdir,'bruker_series'),td1 = 64,td2 = 4096)
+    def run():
+        d = load_indiv_file(filename,expno = 1)
+        d.ft('t2',shift = True)
+        d.mean(d.dimlabels[0])
+    return run
+@benchmark(number = 3)
+def hdf5_write_2d(workdir):
+    d = series_2d(128)
+    d.name('series')
+    def reset():
+        if os.path.exists(os.path.join(workdir,'bench.h5')):
+            os.remove(os.path.join(workdir,'bench.h5'))
+    return (lambda: d.hdf5_write('bench.h5',directory = workdir)),reset
+@benchmark(number = 3)
+def hdf5_read_2d(workdir):
+    from pyspecdata import nddata_hdf5
+    d = series_2d(128)
+    d.name('series')
+    d.hdf5_write('bench.h5',directory = workdir)
+    return lambda: nddata_hdf5('bench.h5/series',directory = workdir)
+@benchmark(number = 3)
+def load_bruker_series(workdir):
+    from pyspecdata.load_files import load_indiv_file
+    dirname = write_bruker_series(os.path.join(workdir,'bruker_series'))
+    return lambda: load_indiv_file(dirname,expno = 1)
+@benchmark(number = 5)
+def load_xepr(workdir):
+    from pyspecdata.load_files import load_indiv_file
+    filename = write_xepr(workdir)
+    return lambda: load_indiv_file(filename)
+@benchmark(number = 5)
+def load_acert_cw(workdir):
+    from pyspecdata.load_files import load_indiv_file
+    filename = write_acert_cw(workdir)
+    return lambda: load_indiv_file(filename)
+@benchmark(number = 3)
+def fitdata_fit(workdir):
+    import sympy
+    from pyspecdata import fitdata, nddata
+    from numpy import r_, exp, random
+    class exponential_decay(fitdata):
+        def __init__(self,*args,**kwargs):
+            fitdata.__init__(self,*args,**kwargs)
+            self.symbol_list = ['M_0','R']
+            self.starting_guesses = [r_[1.,1.],r_[1.,10.]]
+            self.gen_symbolic(r'M(t)')
+        def fitfunc_raw(self,p,x):
+            return p[0]*exp(-x*p[1])
+        def fitfunc_raw_symb(self,p,x):
+            return p[0]*sympy.exp(-x*p[1])
+    t = r_[0:1:256j]
+    d = nddata(2*exp(-5*t)+0.01*random.randn(len(t)),[-1],['t']).labels('t',t)
+    d.set_error(0.01)
+    def run():
+        exponential_decay(d.copy()).fit(silent = True)
+    return run
+#}}}
+#{{{ import time
+#    these shouldn't be imported by ``import pyspecdata`` -- they're deferred
+#    until they're first used
+#    (mpl_toolkits.mplot3d is imported eagerly, since importing it is what
+#    registers the '3d' projection)
+_deferred_modules = ['sympy','tables','h5py','scipy.signal','scipy.optimize',
+        'scipy.interpolate']
+@benchmark(number = 5)
+def import_pyspecdata(workdir):
+    r'''time ``import pyspecdata`` in a new interpreter -- this fails if
+    any of the deferred modules is imported eagerly'''
+    command = [sys.executable,'-c','import pyspecdata']
+    check = subprocess.Popen([sys.executable,'-c',
+        'import sys, pyspecdata; print(" ".join(j for j in %r if j in sys.modules))'%_deferred_modules],
+        stdout = subprocess.PIPE)
+    output,_ = check.communicate()
+    eagerly_imported = output.decode('ascii').split()
+    if check.returncode != 0 or len(eagerly_imported) > 0:
+        raise RuntimeError("import pyspecdata imports "+' '.join(eagerly_imported)
+                +", which should be deferred until first use")
+    return lambda: subprocess.check_call(command)
+#}}}
+def _peak_memory():
+    "peak resident memory of this process, in kB (or None if it can't be determined)"
+    if resource is None:
+        return None
+    retval = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        retval /= 1024 # reported in bytes
+    return retval
+def run_one(name):
+    "run the benchmark called `name` in this process, and return its results as a dictionary"
+    setup_function,number = [(f,n) for thisname,f,n in _benchmarks if thisname == name][0]
+    workdir = tempfile.mkdtemp(prefix = 'pyspecdata_benchmark_')
+    try:
+        retval = setup_function(workdir)
+        if type(retval) is tuple:
+            run,reset = retval
+        else:
+            run,reset = retval,None
+        setup_memory = _peak_memory()
+        times = []
+        for j in range(number):
+            if reset is not None: reset()
+            start = default_timer()
+            run()
+            times.append(default_timer()-start)
+        return {'number':number,
+                'best':min(times),
+                'mean':sum(times)/len(times),
+                'times':times,
+                'setup_peak_memory_kb':setup_memory,
+                'peak_memory_kb':_peak_memory()}
+    finally:
+        shutil.rmtree(workdir,ignore_errors = True)
+def _environment():
+    import numpy
+    retval = {'python':platform.python_version(),
+            'numpy':numpy.__version__,
+            'platform':platform.platform(),
+            'machine':platform.machine(),
+            'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S')}
+    try:
+        from pyspecdata.version import __version__
+        retval['pyspecdata'] = __version__
+    except ImportError:
+        retval['pyspecdata'] = None
+    return retval
+def main():
+    parser = argparse.ArgumentParser(description = 'Run the pyspecdata benchmarks.')
+    parser.add_argument('--output',default = 'benchmark_results.json',
+            help = 'where to write the JSON results')
+    parser.add_argument('--only',default = None,
+            help = 'regular expression selecting the benchmarks to run')
+    parser.add_argument('--compare',default = None,
+            help = 'JSON results of a previous run to compare against')
+    parser.add_argument('--single',default = None,
+            help = argparse.SUPPRESS) # used internally to run one benchmark per process
+    args = parser.parse_args()
+    if args.single is not None:
+        json.dump(run_one(args.single),sys.stdout)
+        return
+    names = [name for name,_,_ in _benchmarks
+            if args.only is None or re.search(args.only,name)]
+    results = {}
+    for name in names:
+        proc = subprocess.Popen([sys.executable,os.path.abspath(__file__),'--single',name],
+                stdout = subprocess.PIPE)
+        output,_ = proc.communicate()
+        if proc.returncode != 0:
+            print "%-30s FAILED"%name
+            results[name] = {'failed':True}
+            continue
+        results[name] = json.loads(output.decode('ascii').splitlines()[-1])
+        print "%-30s best %10.4f s  mean %10.4f s  peak memory %s kB"%(name,
+                results[name]['best'],results[name]['mean'],
+                results[name]['peak_memory_kb'])
+    with open(args.output,'w') as fp:
+        json.dump({'environment':_environment(),'results':results},fp,
+                indent = 2,sort_keys = True)
+    if args.compare is not None:
+        with open(args.compare) as fp:
+            old_results = json.load(fp)['results']
+        print "\ncompared to",args.compare,"(best time, new/old):"
+        for name in names:
+            if name in old_results and 'best' in old_results[name] and 'best' in results[name]:
+                print "%-30s %6.2f"%(name,results[name]['best']/old_results[name]['best'])
+if __name__ == '__main__':
+    main()
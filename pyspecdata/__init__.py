@@ -2,6 +2,8 @@ from .general_functions import *
 from .core import *
 from .load_files import *
 from .figlist import *
+from .profiling import profile_nddata,_profile_from_environment
+_profile_from_environment()
 
 #import numpy
 
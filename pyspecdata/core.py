@@ -35,6 +35,7 @@ if myparams['figlist_type'] == 'figlistl':
     environ['ETS_TOOLKIT'] = 'qt4'
     import matplotlib; matplotlib.use('Agg')
 from .general_functions import inside_sphinx
+from .general_functions import _lazy_module,_lazy_function,_module_imported
 if not inside_sphinx():
     from pylab import *
 else:
@@ -45,28 +46,32 @@ import matplotlib
 import matplotlib.transforms as mtransforms
 from distutils.version import LooseVersion
 from numpy import sqrt as np_sqrt
+import numpy.random as np_random
 from numpy.lib.recfunctions import rename_fields,drop_fields
-from mpl_toolkits.mplot3d import axes3d
-from matplotlib.collections import PolyCollection
+from mpl_toolkits.mplot3d import axes3d # also registers the '3d' projection, so it's not deferred
+from matplotlib.collections import PolyCollection,LineCollection
 from matplotlib.colors import LightSource
 from matplotlib.lines import Line2D
-from scipy.interpolate import griddata as scipy_griddata
-import tables
+scipy_griddata = _lazy_function('scipy.interpolate','griddata')
+tables = _lazy_module('tables')
 import warnings
 from inspect import ismethod
 from numpy.core import rec
 from matplotlib.pyplot import cm
-import tables
 from copy import deepcopy 
 import traceback
-import sympy
-from scipy.optimize import leastsq
-from scipy.signal import fftconvolve
-import scipy.sparse as sparse
+#{{{ these are imported on first use (see the import benchmark in
+#    benchmarks/), since most scripts don't need them, and they're slow to
+#    import
+sympy = _lazy_module('sympy')
+leastsq = _lazy_function('scipy.optimize','leastsq')
+fftconvolve = _lazy_function('scipy.signal','fftconvolve')
+sparse = _lazy_module('scipy.sparse')
+interp1d = _lazy_function('scipy.interpolate','interp1d')
+UnivariateSpline = _lazy_function('scipy.interpolate','UnivariateSpline')
+#}}}
 import numpy.lib.recfunctions as recf
 from inspect import getargspec
-from scipy.interpolate import interp1d
-from scipy.interpolate import UnivariateSpline
 from .datadir import getDATADIR
 from . import fourier as this_fourier
 from . import axis_manipulation
@@ -113,6 +118,8 @@ nextfigure({'lplotproperty':value})
 
 def issympy(x):
     'tests if something is sympy (based on the module name)'
+    if not _module_imported('sympy'):
+        return False # don't import sympy just to check
     return isinstance(x,sympy.Expr)
 
 #{{{ function trickery
@@ -1000,11 +1007,11 @@ def h5table(bottomnode,tablename,tabledata):
     #}}}
 def h5nodebypath(h5path,verbose = False,force = False,only_lowest = False,check_only = False,directory='.'):
     r'''return the node based on an absolute path, including the filename'''
-    logger.debug(strm("DEBUG: called h5nodebypath on",h5path))
+    logger.debug(lazy_strm("DEBUG: called h5nodebypath on",h5path))
     h5path = h5path.split('/')
     #{{{ open the file / check if it exists
     if verbose: print lsafen('h5path=',h5path)
-    logger.info(strm('the h5path is',h5path))
+    logger.info(lazy_strm('the h5path is',h5path))
     try:
         if h5path[0] in listdir(directory):
             if verbose: print 'DEBUG: file exists\n\n'
@@ -1013,13 +1020,13 @@ def h5nodebypath(h5path,verbose = False,force = False,only_lowest = False,check_
             if verbose: print 'DEBUG: file does not exist\n\n'
         mode = 'a'
         #if check_only: mode = 'r'
-        logger.info(strm('so I look for the file',h5path[0],'in directory',directory))
+        logger.info(lazy_strm('so I look for the file',h5path[0],'in directory',directory))
         h5file = tables.open_file(os.path.join(directory,h5path[0]),mode = mode,title = 'test file')
     except IOError as e:
         raise IOError('I think the HDF5 file has not been created yet, and there is a bug pytables that makes it freak out, but you can just run again.'+explain_error(e))
     #}}}
     currentnode = h5file.get_node('/') # open the root node
-    logger.debug(strm("I have grabbe node",currentnode,"of file",h5file,'ready to step down search path'))
+    logger.debug(lazy_strm("I have grabbe node",currentnode,"of file",h5file,'ready to step down search path'))
     for pathlevel in range(1,len(h5path)):#{{{ step down the path
             clear = False
             create = True
@@ -1038,10 +1045,10 @@ def h5nodebypath(h5path,verbose = False,force = False,only_lowest = False,check_
                         create = create,
                         clear = clear)
                 if verbose: print lsafen("searching for node path: descended to node",currentnode)
-                logger.info(strm("searching for node path: descended to node",currentnode))
+                logger.info(lazy_strm("searching for node path: descended to node",currentnode))
             except BaseException as e:
                 if verbose: print lsafen("searching for node path: got caught searching for node",h5path[pathlevel])
-                logger.info(strm("searching for node path: got caught searching for node",h5path[pathlevel]))
+                logger.info(lazy_strm("searching for node path: got caught searching for node",h5path[pathlevel]))
                 h5file.close()
                 #print lsafen("DEBUG: Yes, I closed the file")
                 raise IndexError(strm('Problem trying to load node ',h5path,explain_error(e)))
@@ -1078,9 +1085,9 @@ def h5attachattributes(node,listofattributes,myvalues):
             # {{{ pytables hates <U24 which is created from unicode
             if type(thisval) in [list,tuple]:
                 if any(map(lambda x: isinstance(x,unicode),thisval)):
-                    logger.info(strm("going to convert",thisval,"to strings"))
+                    logger.info(lazy_strm("going to convert",thisval,"to strings"))
                     thisval = [str(x) if isinstance(x,unicode) else x for x in thisval]
-                    logger.info(strm("now it looks like this:",thisval))
+                    logger.info(lazy_strm("now it looks like this:",thisval))
             thisval = make_ndarray(thisval,name_forprint = thisattr)
             # }}}
         if thisval is not None:
@@ -1331,18 +1338,57 @@ global OLDplot
 OLDplot = plot
 global myplotfunc
 myplotfunc = OLDplot
+def contiguous_runs(mask,axis = -1):
+    r"""Find the runs of True along `axis` of the boolean array `mask`,
+    for all the other indices at once.
+
+    The mask is padded with False at either end of `axis`, so that the
+    runs of every slice are separated, and then the starts and stops are
+    simply where the (flattened) difference is +1 and -1.
+
+    Parameters
+    ----------
+    mask : ndarray
+        The condition (anything that's nonzero counts as True).
+    axis : int
+        The axis along which to find the runs.
+
+    Returns
+    -------
+    index : tuple of ndarray
+        For each run, the indices along the other dimensions of `mask`
+        (in order, with `axis` left out) -- so ``index`` is empty for 1D
+        data, and otherwise ``index[0]`` gives the slice along the first
+        remaining dimension, *etc.*
+        The runs are ordered by slice (in C order), and then by start.
+    start : ndarray
+        The index along `axis` where each run starts.
+    stop : ndarray
+        The index along `axis` just past the end of each run (*i.e.*
+        ``start:stop`` is a slice of the run).
+    """
+    mask = asarray(mask) != 0
+    mask = rollaxis(mask,axis,mask.ndim)
+    othershape = mask.shape[:-1]
+    n = mask.shape[-1]
+    padded = zeros(othershape+(n+2,),dtype = int8)
+    padded[...,1:-1] = mask
+    edges = diff(padded.ravel())
+    start = flatnonzero(edges == 1)
+    stop = flatnonzero(edges == -1)
+    # the padding means that a run never crosses into the next slice, and
+    # each slice occupies n+2 elements of edges
+    retval_index = unravel_index(start // (n+2),othershape) if len(othershape) > 0 else ()
+    return retval_index,start % (n+2),stop % (n+2)
 def whereblocks(a):
     """returns contiguous chunks where the condition is true
-    but, see the "contiguous" method, which is more OO"""
-    parselist = where(a)[0]
-    jumps_at = where(diff(parselist)>1)[0]+1
-    retlist = []
-    lastjump = 0
-    for jump in jumps_at:
-        retlist += [parselist[lastjump:jump]]
-        lastjump = jump
-    retlist += [parselist[lastjump:]]
-    return retlist
+    (as a list of arrays of indices) for 1D `a`,
+    but, see the "contiguous" method, which is more OO,
+    and :func:`contiguous_runs`, which works for N-D data"""
+    _,start,stop = contiguous_runs(a)
+    if len(start) == 0:
+        return [where(a)[0]]
+    return [r_[j:k] for j,k in zip(start,stop)]
 def autolegend(*args,**kwargs):
     #lg = legend(legendstr,'best'),loc = 2, borderaxespad = 0.)
     match_colors = False
@@ -1373,84 +1419,86 @@ def autolegend(*args,**kwargs):
                     txt.set_color(line.get_color())  
                     txt.set_alpha(line.get_alpha())  
     return lg
-def autopad_figure(pad = 0.2,centered = False,figname = 'unknown'):
+def autopad_figure(pad = 0.2,centered = False,figname = 'unknown',fig = None):
+    r'''Adjust the subplot parameters so that the axis labels fit inside the
+    figure.
+
+    This is done in a single layout pass: the extents of the labels are
+    measured with the renderer of the canvas, and the subplot parameters
+    are set once, rather than redrawing the figure repeatedly until they
+    converge.
+    The next draw (typically ``savefig``) picks up the new layout.
+
+    Parameters
+    ----------
+    pad : double
+        padding (as a fraction of the figure) added to the label extents
+    centered : bool
+        if True, make the left and right margins equal
+    figname : str
+        only used for the warnings
+    fig : Figure
+        the figure to adjust -- defaults to the current figure
+    '''
     #{{{ solve the axis issue --> this does just the left
-    fig = gcf()
-    ax = gca()
+    if fig is None:
+        fig = gcf()
+    ax = fig.gca()
     labelsets = [] 
-    #labelsets.append(('left',ax.get_yticklabels()))
-    #labelsets.append(('left',ax.get_yticklines()))
-    #labelsets.append(('right',ax.get_yticklines()))
-    labelsets.append(('left',[ylabel(ax.get_ylabel())]))
-    #labelsets.append(('bottom',ax.get_xticklabels()))
-    #labelsets.append(('bottom',ax.get_xticklines()))
+    labelsets.append(('left',[ax.yaxis.label]))
     if len(ax.get_xlabel()) > 0:
-        labelsets.append(('bottom',[xlabel(ax.get_xlabel())]))
-    #labelsets.append(('top',ax.get_xticklines()))
-    if len(ax.get_title()) > 0:
-        pass #labelsets.append(('top',[title(ax.get_title())]))
-    compto = {}
-    def on_draw(event):
-        # find the sum of the widths of all things labeled with a 'y'
-        spkwargs = {}
-        compto['bottom'] = fig.subplotpars.bottom
-        compto['left'] = fig.subplotpars.left
-        compto['right'] = fig.subplotpars.right
-        compto['top'] = fig.subplotpars.top
-        for axisn in ['left','bottom','top','right']:
-            bboxes = []
-            labellist = [x[1] for x in labelsets if x[0] is axisn]
-            for labels in labellist:
-                for label in labels:
-                    if type(label) is Line2D:
-                        pass # just rely on the pad
-                        #if any(map(lambda x: x == label.get_transform(),[ax.transData,ax.transAxes,fig.transFigure,None])):
-                        #    print 'found it'
-                        #else:
-                        #    print 'didn not find it'
-                        #bbox = label.get_window_extent(fig.canvas).inverse_transformed(ax.transData).inverse_transformed(fig.transFigure)
-                    else:
-                        try:
-                            bbox = label.get_window_extent()
-                        except Exception,e:
-                            warnings.warn("I wasn't able to run autopad on figure"+figname+"\nGetting window extent throws error"+str(e))
-                    # the figure transform goes from relative coords->pixels and we
-                    # want the inverse of that
-                    bboxes.append(bbox)
-                # this is the bbox that bounds all the bboxes, again in relative
-                # figure coords
-            l = 0 
-            if len(labellist):
-                bbox = mtransforms.Bbox.union(bboxes)
-                bboxi = bbox.inverse_transformed(fig.transFigure)
-                if axisn in ['left','right']:
-                    l = bboxi.width
-                if axisn in ['top','bottom']:
-                    l = bboxi.height
-            l += pad
-            if axisn in ['top','right']:
-                l = 1-l
-                if compto[axisn] > l:
-                    spkwargs.update({axisn:l})
-            else:
-                if compto[axisn] < l:
-                    spkwargs.update({axisn:l})
-        if len(spkwargs) > 0:
-            if centered and 'left' in spkwargs.keys() and 'right' in spkwargs.keys():
-                big = max(r_[spkwargs['left'],1-spkwargs['right']])
-                spkwargs.update({'left':big,'right':1-big})
-            try:
-                fig.subplots_adjust(**spkwargs) # pad a little
-            except:
-                raise RuntimeError('failed to adjust subplots spwargs = ',spkwargs)
-            #print "adjusted to",spkwargs
-            fig.canvas.draw()# recurse
-        return False
-    fig.canvas.mpl_connect('draw_event', on_draw)
+        labelsets.append(('bottom',[ax.xaxis.label]))
+    #{{{ the extents of the labels don't depend on the subplot parameters,
+    #    so a renderer is all we need to measure them
+    if hasattr(fig.canvas,'get_renderer'):
+        renderer = fig.canvas.get_renderer()
+    else:
+        fig.canvas.draw()# it needs this to generate the 'renderers'
+        renderer = None
+    #}}}
     fig.subplots_adjust(left = 0, right = 1, top = 1, bottom =0)
-    fig.canvas.draw()# it needs this to generate the 'renderers'
-    fig.canvas.mpl_connect('draw_event', on_draw)
-    fig.canvas.draw()
+    compto = {}
+    compto['bottom'] = fig.subplotpars.bottom
+    compto['left'] = fig.subplotpars.left
+    compto['right'] = fig.subplotpars.right
+    compto['top'] = fig.subplotpars.top
+    spkwargs = {}
+    for axisn in ['left','bottom','top','right']:
+        bboxes = []
+        labellist = [x[1] for x in labelsets if x[0] is axisn]
+        for labels in labellist:
+            for label in labels:
+                try:
+                    bboxes.append(label.get_window_extent(renderer))
+                except Exception,e:
+                    warnings.warn("I wasn't able to run autopad on figure"+figname+"\nGetting window extent throws error"+str(e))
+        l = 0 
+        if len(bboxes):
+            # the bbox that bounds all the bboxes, in relative figure
+            # coords -- the figure transform goes from relative
+            # coords->pixels and we want the inverse of that
+            bbox = mtransforms.Bbox.union(bboxes)
+            bboxi = bbox.inverse_transformed(fig.transFigure)
+            if axisn in ['left','right']:
+                l = bboxi.width
+            if axisn in ['top','bottom']:
+                l = bboxi.height
+        l += pad
+        if axisn in ['top','right']:
+            l = 1-l
+            if compto[axisn] > l:
+                spkwargs.update({axisn:l})
+        else:
+            if compto[axisn] < l:
+                spkwargs.update({axisn:l})
+    if len(spkwargs) > 0:
+        if centered and 'left' in spkwargs.keys() and 'right' in spkwargs.keys():
+            big = max(r_[spkwargs['left'],1-spkwargs['right']])
+            spkwargs.update({'left':big,'right':1-big})
+        try:
+            fig.subplots_adjust(**spkwargs) # pad a little
+        except:
+            raise RuntimeError('failed to adjust subplots spwargs = ',spkwargs)
     return
     #}}}
 def expand_x(*args):
@@ -1816,18 +1864,18 @@ class figlist(object):
             self.figdict = {} # the dictionary of the various figures
         if not hasattr(self,'propdict'):
             self.propdict = {} # the properties belonging to those same figures
-        logger.debug(strm("for plot",input_name,"basename is",self.basename))
+        logger.debug(lazy_strm("for plot",input_name,"basename is",self.basename))
         if (self.basename is not None #basename for groups of figures
                 # I need to check that the basename hasn't already been added
                 and not input_name.startswith(self.basename)):
             name = self.basename + ' ' + input_name
         else:
-            logger.debug(strm("not using a basename",self.basename is not None))
+            logger.debug(lazy_strm("not using a basename",self.basename is not None))
             name = input_name
         # }}}
         if name.find('/') > 0:
             raise ValueError("don't include slashes in the figure name, that's just too confusing")
-        logger.debug(strm('called with',name))
+        logger.debug(lazy_strm('called with',name))
         if name in self.figurelist:# figure already exists
             if hasattr(self,'mlab'):
                 # with this commit, I removed the kwargs and bgcolor, not sure why
@@ -1835,11 +1883,11 @@ class figlist(object):
                 fig.scene.render_window.aa_frames = 20
                 fig.scene.anti_aliasing_frames = 20
             else:
-                logging.debug(strm("I'm changing to figure",self.get_fig_number(name),"for",name))
+                logging.debug(lazy_strm("I'm changing to figure",self.get_fig_number(name),"for",name))
                 fig = self.figdict[name]
                 figure(self.figdict[name].number)
             self.current = name
-            logging.debug(strm('in',self.figurelist,'at figure',self.get_fig_number(name),'switched figures'))
+            logging.debug(lazy_strm('in',self.figurelist,'at figure',self.get_fig_number(name),'switched figures'))
             if boundaries is not None:
                 if 'boundaries' not in self.propdict[self.current].keys() or self.propdict[self.current]['boundaries'] != boundaries:
                     raise ValueError("You're giving conflicting values for boundaries")
@@ -1876,7 +1924,7 @@ class figlist(object):
                     fig = figure(num_figs_before_add+1,**kwargs)
                 if twinx is not None:
                     fig.add_subplot(111)
-            logger.debug(strm('added figure',len(self.figurelist)+1,'because not in figurelist',self.figurelist))
+            logger.debug(lazy_strm('added figure',len(self.figurelist)+1,'because not in figurelist',self.figurelist))
             self.figurelist.append(name)
             self.figdict.update({self.current:fig})
             if boundaries == False:
@@ -2036,8 +2084,8 @@ class figlist(object):
                     if v == 'outside':
                         kwargs.update(dict(bbox_to_anchor=(1.05,1),loc = 2,borderaxespad=0.))
                 self.next(k)
-                logger.debug(strm("I am about to assign a legend for ",k,". Is it in the figurelist?:",k in self.figurelist))
-                logger.debug(strm("print out the legend object:",gca().legend()))
+                logger.debug(lazy_strm("I am about to assign a legend for ",k,". Is it in the figurelist?:",k in self.figurelist))
+                logger.debug(lazy_strm("print out the legend object:",gca().legend()))
                 try:
                     autolegend(**kwargs)
                 except:
@@ -2054,13 +2102,13 @@ class figlist(object):
         if 'line_spacing' in kwargs.keys(): kwargs.pop('line_spacing')# for latex only
         if len(kwargs) > 0:
             raise ValueError("didn't understand kwargs "+repr(kwargs))
-        logger.debug(strm("before show_prep, figlist is",self.figurelist))
-        logger.debug(strm("before show_prep, autolegend list is",self.autolegend_list))
+        logger.debug(lazy_strm("before show_prep, figlist is",self.figurelist))
+        logger.debug(lazy_strm("before show_prep, autolegend list is",self.autolegend_list))
         self.show_prep()
         #{{{ just copy from fornnotebook to get the print string functionality
         kwargs = {}
         for figname in self.figurelist:
-            logger.debug(strm("showing figure"+lsafen(figname)))
+            logger.debug(lazy_strm("showing figure"+lsafen(figname)))
             if type(figname) is dict:
                 kwargs.update(figname)
                 if 'print_string' in kwargs:
@@ -2309,19 +2357,163 @@ def text_on_plot(x,y,thistext,coord = 'axes',**kwargs):
         kwargs.pop('match_data')
     newkwargs.update(kwargs)
     return text(x,y,thistext,**newkwargs)
+#{{{ plot many traces as a single collection
+_linecollection_threshold = 16 # use a LineCollection automatically above this many traces
+_linecollection_kwargs = {'linestyle':'linestyles',
+        'ls':'linestyles',
+        'linewidth':'linewidths',
+        'lw':'linewidths',
+        'alpha':'alpha',
+        'label':'label',
+        'zorder':'zorder',
+        'color':None, # like the individual lines, the collection is colored by trace
+        }
+def _plot_linecollection(ax,myx,myy,kwargs,xscale = 'linear',yscale = 'linear'):
+    r'''Plot each column of `myy` *vs.* `myx` as a single
+    :class:`~matplotlib.collections.LineCollection` colored like the
+    traces drawn by :func:`plot` (*i.e.* with ``cm.hsv``), so that
+    the time needed to draw does not scale with the number of traces.
+
+    If `kwargs` contains ``yerr`` (and/or ``xerr``), the error bars are
+    drawn as a second (third) collection.
+
+    Returns
+    -------
+    list
+        The collections that were added to `ax`.
+    '''
+    kwargs = kwargs.copy()
+    yerr = kwargs.pop('yerr',None)
+    xerr = kwargs.pop('xerr',None)
+    lc_kwargs = {}
+    for k,v in kwargs.iteritems():
+        if _linecollection_kwargs[k] is not None:
+            lc_kwargs[_linecollection_kwargs[k]] = v
+    n_traces = myy.shape[1]
+    colors = cm.hsv(r_[0:n_traces]/double(n_traces))
+    segments = empty((n_traces,myy.shape[0],2))
+    segments[:,:,0] = myx
+    segments[:,:,1] = real(myy).T
+    segments[isinf(segments)] = NaN # prevent an overflow error
+    retval = [LineCollection(segments,colors = colors,**lc_kwargs)]
+    lc_kwargs.pop('label',None)
+    lc_kwargs.pop('linestyles',None)
+    for thiserr,thisdim in [(yerr,1),(xerr,0)]:
+        if thiserr is None:
+            continue
+        thiserr = real(thiserr)
+        if thiserr.ndim == 1 and len(thiserr) == myy.shape[0]:
+            thiserr = thiserr.reshape(-1,1) # one error per point, shared by the traces
+        thiserr = thiserr * ones(myy.shape) # broadcast
+        #{{{ one path per trace, where the bars are separated by NaN
+        errsegments = empty((n_traces,myy.shape[0],3,2))
+        errsegments[:,:,:,:] = segments[:,:,newaxis,:]
+        errsegments[:,:,0,thisdim] -= thiserr.T
+        errsegments[:,:,1,thisdim] += thiserr.T
+        errsegments[:,:,2,:] = NaN
+        #}}}
+        retval.append(LineCollection(errsegments.reshape(n_traces,-1,2),
+            colors = colors,**lc_kwargs))
+    if xscale != 'linear': ax.set_xscale(xscale)
+    if yscale != 'linear': ax.set_yscale(yscale)
+    for j in retval:
+        ax.add_collection(j)
+    ax.autoscale_view()
+    return retval
+#}}}
+#{{{ min/max decimation of long 1D traces
+plot_decimation = True # set to False to always hand the full data to matplotlib (e.g. for publication output)
+_decimation_oversampling = 4 # only decimate if there are this many points per pixel
+_noninteractive_backends = ['agg','cairo','pdf','pgf','ps','svg','template']
+def _minmax_decimate(x,y,n_bins,log_x = False):
+    r'''Divide the range of the (monotonic) `x` into `n_bins` equal bins
+    (one per pixel), and keep only the minimum and maximum of `y` in each
+    (in their original order), along with the first and last point.
+    Since the bins are in `x` (rather than in the index), the envelope
+    that's drawn is the same as for the full data, even if `x` isn't
+    evenly spaced.
+
+    Parameters
+    ----------
+    log_x : bool
+        The x axis is logarithmic, so that the pixels (and the bins) are
+        evenly spaced in :math:`\log_{10}(x)` rather than in `x`.
+        (If `x` isn't all positive, it's binned linearly.)
+
+    Returns
+    -------
+    x, y : ndarray
+        The decimated data.
+    '''
+    if len(y) < 2*n_bins:
+        return x,y
+    x_binned = log10(x) if log_x and min(x[0],x[-1]) > 0 else x
+    x_ascending = x_binned if x_binned[0] <= x_binned[-1] else -x_binned
+    binid = searchsorted(linspace(x_ascending[0],x_ascending[-1],n_bins+1)[1:-1],
+            x_ascending,side = 'right')
+    order = lexsort((y,binid)) # by bin, and then by value
+    last = flatnonzero(r_[diff(binid[order]) != 0,True]) # the max of each bin
+    first = r_[0,last[:-1]+1] # the min of each bin
+    idx = unique(r_[order[first],order[last],0,len(y)-1])
+    return x[idx],y[idx]
+def _decimation_compatible(x,y,myformat,kwargs):
+    "check whether a trace can be min/max decimated without changing its appearance"
+    if x is None or len(shape(x)) != 1 or len(shape(y)) != 1 or len(x) != len(y):
+        return False
+    if 'marker' in kwargs.keys() or 'yerr' in kwargs.keys() or 'xerr' in kwargs.keys():
+        return False
+    if myformat is not None and not all([j in '-:bgrcmykw' for j in myformat]):
+        return False # markers (or the dot of '-.', to be safe)
+    dx = diff(x)
+    return all(dx >= 0) or all(dx <= 0)
+def _decimated_plot(ax,myplotfunc,x,y,plotargs_after,kwargs,log_x = False):
+    r'''Plot the min/max decimated version of `y` *vs.* `x` (`x` must be
+    monotonic) at the pixel width of `ax`, binning in :math:`\log_{10}(x)`
+    if `log_x` (*i.e.* `myplotfunc` gives a logarithmic x axis).
+    With an interactive backend, the visible region is decimated again
+    whenever the x limits change (*e.g.* when zooming).'''
+    n_pixels = int(ax.bbox.width)
+    if n_pixels < 1: n_pixels = 1
+    if len(x) < _decimation_oversampling*n_pixels:
+        return myplotfunc(*([x,y]+plotargs_after),**kwargs)
+    retval = myplotfunc(*(list(_minmax_decimate(x,y,n_pixels,log_x))+plotargs_after),**kwargs)
+    if matplotlib.get_backend().lower() not in _noninteractive_backends:
+        thisline = retval[0]
+        if x[0] > x[-1]:
+            x_ascending,y_ascending = x[::-1],y[::-1]
+        else:
+            x_ascending,y_ascending = x,y
+        def redecimate(thisax):
+            if thisline.axes is None:
+                return # the line was removed
+            xlims = sorted(thisax.get_xlim())
+            start = searchsorted(x_ascending,xlims[0])-1
+            if start < 0: start = 0
+            stop = searchsorted(x_ascending,xlims[1])+1
+            n_pixels = int(thisax.bbox.width)
+            if n_pixels < 1: n_pixels = 1
+            thisline.set_data(*_minmax_decimate(x_ascending[start:stop],
+                y_ascending[start:stop],n_pixels,
+                thisax.get_xscale() == 'log'))
+        ax.callbacks.connect('xlim_changed',redecimate)
+    return retval
+#}}}
 def plot(*args,**kwargs):
     global myplotfunc
     has_labels = False
     #{{{ deal with axes and some other kwargs
-    ax,human_units,label_format_string,normalize,noerr = process_kwargs([('ax',gca()),
+    ax,human_units,label_format_string,normalize,noerr,collection,decimate = process_kwargs([('ax',gca()),
         ('human_units',False),
         ('label_format_string',None),
         ('normalize',False),
         ('noerr',False),
+        ('collection',None), # None chooses automatically -- see _plot_linecollection
+        ('decimate',None), # None uses plot_decimation -- see _decimated_plot
         ],kwargs,pass_through = True)
     label_format_string = None
     #}}}
     myplotfunc = ax.plot # default
+    xscale,yscale = 'linear','linear' # track these for the collection, below
     #{{{ all possible properties
     myformat = None 
     myxlabel = None
@@ -2421,18 +2613,23 @@ def plot(*args,**kwargs):
         if (size(b)>3) and all(abs((b-b[0])/b[0])<1e-4) and not ('nosemilog' in kwargs.keys()):
             if 'plottype' not in kwargs.keys():
                 myplotfunc = ax.semilogx
+                xscale = 'log'
     if ('nosemilog' in kwargs.keys()):
         #print 'this should pop nosemilog'
         kwargs.pop('nosemilog')
     if 'plottype' in kwargs.keys():
         if kwargs['plottype'] == 'semilogy':
             myplotfunc = ax.semilogy
+            xscale,yscale = 'linear','log'
         elif kwargs['plottype'] == 'semilogx':
             myplotfunc = ax.semilogx
+            xscale,yscale = 'log','linear'
         elif kwargs['plottype'] == 'loglog':
             myplotfunc = ax.loglog
+            xscale,yscale = 'log','log'
         elif kwargs['plottype'] == 'linear':
             myplotfunc = ax.plot
+            xscale,yscale = 'linear','linear'
         else:
             raise ValueError(strm("plot type",kwargs['plottype'],"not allowed!"))
         kwargs.pop('plottype')
@@ -2462,6 +2659,38 @@ def plot(*args,**kwargs):
         myy /= myy.max()
     #{{{ hsv plots when we have multiple lines
     if len(shape(myy.squeeze()))>1 and sum(array(shape(myy))>1):
+        #{{{ decide whether we can draw all the lines as one collection
+        collection_compatible = (myformat is None
+                and len(shape(myy)) == 2
+                and myx is not None and len(shape(myx)) == 1
+                and len(myx) == myy.shape[0]
+                and all([k in _linecollection_kwargs.keys() + ['yerr','xerr']
+                    for k in kwargs.keys()])
+                and ndim(kwargs.get('xerr',None)) != 1) # 1D x errors stay with errorbar
+        if collection is None:
+            collection = (collection_compatible and not has_labels
+                    and myy.shape[1] > _linecollection_threshold)
+        elif collection and not collection_compatible:
+            raise ValueError(strm("I can't plot these traces as a single"
+                " collection -- this requires a 2D array, a 1D x axis,"
+                " no format string, and only the keyword arguments",
+                _linecollection_kwargs.keys()))
+        #}}}
+    if len(shape(myy.squeeze()))>1 and sum(array(shape(myy))>1) and collection:
+        #{{{ a single LineCollection (the labels of the individual traces are not used)
+        try:
+            retval = _plot_linecollection(ax,myx,myy,kwargs,
+                    xscale = xscale, yscale = yscale)
+        except Exception as e:
+            raise RuntimeError(strm("Error trying to plot",myy.shape[1],
+                "traces as a LineCollection with options",kwargs)
+                + explain_error(e))
+        if x_inverted:
+            these_xlims = ax.get_xlim()
+            ax.set_xlim((max(these_xlims),min(these_xlims)))
+        plotargs = [myx,myy]
+        #}}}
+    elif len(shape(myy.squeeze()))>1 and sum(array(shape(myy))>1):
         #{{{ hsv plots
         hold(True)
         retval = []
@@ -2499,9 +2728,15 @@ def plot(*args,**kwargs):
         #}}}
     else:
         plotargs = [j for j in [myx,real(myy),myformat] if j is not None]
+        if decimate is None:
+            decimate = plot_decimation
         try:
             #print 'DEBUG plotting with args',plotargs,'and kwargs',kwargs,'\n\n'
-            retval = myplotfunc(*plotargs,**kwargs)
+            if decimate and _decimation_compatible(myx,myy,myformat,kwargs):
+                retval = _decimated_plot(ax,myplotfunc,myx,real(myy),plotargs[2:],kwargs,
+                        log_x = xscale == 'log' or ax.get_xscale() == 'log')
+            else:
+                retval = myplotfunc(*plotargs,**kwargs)
         except Exception as e:
             raise RuntimeError(strm('error trying to plot',type(myplotfunc),'with value',myplotfunc,
                     '\nlength of the ndarray arguments:',['shape:'+str(shape(j)) if type(j) is ndarray else j for j in plotargs],
@@ -2530,16 +2765,82 @@ def plot(*args,**kwargs):
     return retval
 #}}}
 #{{{general functions
-def box_muller(length, return_complex=True):
-    r'''algorithm to generate normally distributed noise'''
-    s1 = rand(length)
-    s2 = rand(length)
-    n1 = sqrt(-2*log(s1))*cos(2*pi*s2)
-    if return_complex:
-        n2 = sqrt(-2*log(s1))*sin(2*pi*s2)
-        return (n1 + 1j * n2)*0.5
+def _new_noise_generator(seed = None):
+    "a new :class:`numpy.random.Generator` (or :class:`numpy.random.RandomState`, for old versions of numpy)"
+    if hasattr(np_random,'default_rng'):
+        return np_random.default_rng(seed)
     else:
-        return (n1)*0.5
+        return np_random.RandomState(seed)
+_default_noise_generator = _new_noise_generator() # used when no seed is given -- see seed_noise
+def seed_noise(seed = None):
+    r'''Reseed the generator that :func:`box_muller` and
+    :meth:`nddata.add_noise` use when they're not passed a seed, so that
+    the noise is reproducible.
+    (This generator is independent of the global state of
+    :mod:`numpy.random`, so :func:`numpy.random.seed` doesn't affect it.)
+
+    Parameters
+    ----------
+    seed : None or int
+        If None, reseed from fresh entropy from the operating system.
+    '''
+    global _default_noise_generator
+    _default_noise_generator = _new_noise_generator(seed)
+def _noise_generator(seed = None):
+    r'''Return a random number generator for the noise routines.
+
+    Parameters
+    ----------
+    seed : None, int, or generator
+        If this is already a generator (a :class:`numpy.random.Generator`, or
+        a :class:`numpy.random.RandomState`), it's returned unchanged, so that
+        several calls can draw from the same stream.
+        If it's None, the module's own generator is used (see
+        :func:`seed_noise` -- note that :func:`numpy.random.seed` doesn't
+        affect it).
+        Otherwise, it's used to seed a new :class:`numpy.random.Generator`
+        (falling back to :class:`numpy.random.RandomState` for versions of
+        numpy that don't have :func:`numpy.random.default_rng`).
+    '''
+    if hasattr(seed,'standard_normal'):
+        return seed
+    if seed is None:
+        return _default_noise_generator
+    return _new_noise_generator(seed)
+def box_muller(length, return_complex=True, seed=None, out=None):
+    r'''Generate normally distributed noise with a standard deviation of
+    0.5 (in both the real and imaginary part, if `return_complex` is set).
+
+    The name is historical -- the noise now comes from
+    :func:`_noise_generator`, which uses the ziggurat algorithm of
+    :class:`numpy.random.Generator` when it's available.
+
+    Parameters
+    ----------
+    length : int or tuple
+        The size or shape of the result (ignored if `out` is given).
+    seed : None, int, or generator
+        see :func:`_noise_generator`
+    out : ndarray
+        A C-contiguous floating point or complex array that is filled in place
+        with the noise (without allocating any temporaries, when
+        :class:`numpy.random.Generator` is available).
+    '''
+    rng = _noise_generator(seed)
+    if out is not None and not out.flags.c_contiguous:
+        raise ValueError("the array passed to out must be C-contiguous")
+    if out is None:
+        if return_complex:
+            out = empty(length,dtype = complex128)
+        else:
+            out = empty(length,dtype = float64)
+    realview = out.view(out.real.dtype).reshape(-1) # both parts of complex data are filled at once
+    if hasattr(rng,'integers') and realview.dtype in [float32,float64]:
+        rng.standard_normal(out = realview, dtype = realview.dtype)
+    else:
+        realview[:] = rng.standard_normal(realview.shape)
+    realview *= 0.5
+    return out
 #}}}
 
 #{{{nddata
@@ -2554,88 +2855,668 @@ def dp(number,decimalplaces,scientific=False):
     return fstring%number
 #}}}
 #{{{ concatenate datalist along dimname
+class _concat_buffer(object):
+    r'''Accumulates the data (and errors and coordinates) of a series of
+    nddata along `dimname` into one array.
+
+    The array is allocated once when the final length along `dimname` is
+    known (`size`), and otherwise doubles in length whenever it fills up.
+    The dimensions are ordered like those of the template -- the first
+    item appended, unless :meth:`_start` is called first -- with `dimname`
+    added at the end if the template doesn't have it, and the dtype is
+    promoted as needed to hold every item.'''
+    def __init__(self,dimname,size = None,dtype = None):
+        self.dimname = dimname
+        self.size = size
+        self.dtype = dtype
+        self.template = None
+        self.n_items = 0
+        self.index_offset = 0 # where the index along dimname starts, when there are no coordinates
+    def _start(self,template):
+        "set up the dimensions and allocate the arrays, based on the nddata `template`"
+        self.template = template
+        self.dimlabels = list(template.dimlabels)
+        if self.dimname not in self.dimlabels:
+            self.dimlabels.append(self.dimname)
+        self.concat_axis = self.dimlabels.index(self.dimname)
+        template_shape = dict(zip(template.dimlabels,template.data.shape))
+        self.shape = [template_shape.get(j,1) for j in self.dimlabels]
+        self.shape[self.concat_axis] = 0 # the length filled so far
+        self.data = empty(self._shape_with_length(self.size if self.size is not None else 1),
+                dtype = template.data.dtype if self.dtype is None else self.dtype)
+        self.error = None
+        #{{{ the coordinates (and their errors) along dimname are dropped as
+        #    soon as an item doesn't have them
+        self.coords = None
+        self.coords_error = None
+        self.has_coords = True
+        self.has_coords_error = True
+        #}}}
+        return self
+    def _n_filled(self):
+        if self.template is None:
+            return 0
+        return self.shape[self.concat_axis]
+    def __len__(self):
+        return self._n_filled()
+    def _shape_with_length(self,n):
+        retval = list(self.shape)
+        retval[self.concat_axis] = n
+        return retval
+    def _index(self,start,stop):
+        retval = [slice(None)]*len(self.shape)
+        retval[self.concat_axis] = slice(start,stop)
+        return tuple(retval)
+    def _reallocate(self,x,capacity,newdtype = None,alloc = zeros):
+        "return a copy of the filled part of `x` with room for `capacity` elements along `dimname`"
+        if x is None:
+            return None
+        filled = self._n_filled()
+        if x.ndim == 1:# the coordinates
+            retval = alloc(capacity,dtype = x.dtype if newdtype is None else newdtype)
+            retval[:filled] = x[:filled]
+        else:
+            retval = alloc(self._shape_with_length(capacity),
+                    dtype = x.dtype if newdtype is None else newdtype)
+            retval[self._index(0,filled)] = x[self._index(0,filled)]
+        return retval
+    def _make_room(self,n,newdtype):
+        "make sure there's room for `n` more elements along `dimname`, with a dtype of `newdtype`"
+        filled = self._n_filled()
+        capacity = self.data.shape[self.concat_axis]
+        if filled+n <= capacity:
+            if newdtype != self.data.dtype:
+                self.data = self._reallocate(self.data,capacity,newdtype,alloc = empty)
+            return
+        capacity = max(filled+n,2*capacity)
+        self.data = self._reallocate(self.data,capacity,newdtype,alloc = empty)
+        self.error = self._reallocate(self.error,capacity)
+        self.coords = self._reallocate(self.coords,capacity,alloc = empty)
+        self.coords_error = self._reallocate(self.coords_error,capacity,alloc = empty)
+    def _store_coords(self,attr,values,filled):
+        "store `values` as attribute `attr` (coords or coords_error) starting at `filled`"
+        current = getattr(self,attr)
+        if current is None:
+            current = empty(self.data.shape[self.concat_axis],dtype = values.dtype)
+        elif not can_cast(values.dtype,current.dtype):
+            current = current.astype(promote_types(current.dtype,values.dtype))
+        current[filled:filled+len(values)] = values
+        setattr(self,attr,current)
+    def append(self,item):
+        "append the nddata `item` -- if it doesn't have a `dimname` dimension, it adds one element along `dimname`"
+        if not isinstance(item,nddata):
+            raise TypeError(strm('You can only concat nddata, but item',
+                self.n_items,'is a',type(item)))
+        if self.template is None:
+            self._start(item)
+        if self.dimname in item.dimlabels:
+            otherdims = self.dimlabels
+        else:
+            otherdims = [j for j in self.dimlabels if j != self.dimname]
+        if sorted(item.dimlabels) != sorted(otherdims):
+            raise ValueError(strm('For item',self.n_items,'in concat, the dimensions',
+                item.dimlabels,"don't match",self.dimlabels))
+        neworder = map(item.dimlabels.index,otherdims)
+        piece = item.data.transpose(neworder)
+        piece_error = item.get_error()
+        if piece_error is not None:
+            piece_error = piece_error.transpose(neworder)
+        if self.dimname in item.dimlabels:
+            coords = item.getaxis(self.dimname)
+            coords_error = item.get_error(self.dimname) if coords is not None else None
+        else:
+            piece = expand_dims(piece,self.concat_axis)
+            if piece_error is not None:
+                piece_error = expand_dims(piece_error,self.concat_axis)
+            coords = None
+            coords_error = None
+        n = piece.shape[self.concat_axis]
+        if list(piece.shape) != self._shape_with_length(n):
+            raise ValueError(strm('For item',self.n_items,'in concat,',
+                ndshape(item),"doesn't match the shape of the items before it,",
+                ndshape(self.template)))
+        self._make_room(n,promote_types(self.data.dtype,piece.dtype))
+        filled = self._n_filled()
+        self.data[self._index(filled,filled+n)] = piece
+        if piece_error is not None:
+            if self.error is None:
+                self.error = zeros(self.data.shape,dtype = piece_error.dtype)
+            elif not can_cast(piece_error.dtype,self.error.dtype):
+                self.error = self.error.astype(promote_types(self.error.dtype,piece_error.dtype))
+            self.error[self._index(filled,filled+n)] = piece_error
+        if self.has_coords:
+            if coords is None:
+                self.has_coords = self.has_coords_error = False
+                self.coords = self.coords_error = None
+            else:
+                self._store_coords('coords',coords,filled)
+                if self.has_coords_error:
+                    if coords_error is None:
+                        self.has_coords_error = False
+                        self.coords_error = None
+                    else:
+                        self._store_coords('coords_error',coords_error,filled)
+        self.shape[self.concat_axis] += n
+        self.n_items += 1
+        return self
+    def _filled(self,copy = False):
+        "return an nddata holding the filled part -- its data is a view of the buffer, unless `copy`"
+        if self.template is None:
+            raise ValueError("There's nothing to concat!")
+        filled = self._n_filled()
+        data = self.data[self._index(0,filled)]
+        if copy:
+            data = data.copy()
+        retval = nddata(data,list(data.shape),list(self.dimlabels))
+        if self.error is not None:
+            error = self.error[self._index(0,filled)]
+            retval.set_error(error.copy() if copy else error)
+        #{{{ the coordinates of the other dimensions come from the template
+        #    -- along dimname, they're concatenated if all the items have
+        #    them, and are otherwise just the index
+        if self.has_coords:
+            concat_coords = self.coords[:filled]
+            if copy:
+                concat_coords = concat_coords.copy()
+        else:
+            concat_coords = r_[0:filled] + self.index_offset
+        if len(self.template.axis_coords) > 0 or self.has_coords:
+            retval.labels(list(self.dimlabels),
+                    [concat_coords if j == self.dimname
+                        else self.template.getaxis(j) for j in self.dimlabels])
+            if self.has_coords and self.has_coords_error:
+                retval.set_error(self.dimname,self.coords_error[:filled].copy())
+            for j in self.dimlabels:
+                if j in self.template.dimlabels:
+                    if self.template.get_units(j) is not None:
+                        retval.set_units(j,self.template.get_units(j))
+                    if j != self.dimname and self.template.get_error(j) is not None:
+                        retval.set_error(j,self.template.get_error(j))
+        #}}}
+        retval.data_units = self.template.data_units
+        retval.other_info = dict(self.template.other_info)
+        return retval
+    def result(self):
+        "return the concatenated nddata (which doesn't hold on to any unused part of the buffer)"
+        return self._filled(copy = self.data.shape[self.concat_axis] > self._n_filled())
 def concat(datalist,dimname,chop = False,verbose = False):
-    #{{{ allocate a new datalist structure  
-    newdimsize = 0
-    #print 'DEBUG: type(datalist)',type(datalist)
+    r'''Concatenate the nddata in `datalist` along the dimension `dimname`.
+
+    The result is allocated once, with a dtype that can hold all of the
+    inputs (*e.g.* real inputs give a real result), and each input is
+    copied in with a single slice assignment.
+    The errors are concatenated as well, and if all the inputs have
+    coordinates along `dimname`, so are the coordinates (otherwise, the
+    coordinates along `dimname` are just the index).
+
+    Parameters
+    ----------
+    datalist : list of nddata, or any other iterable of nddata
+        An input without a `dimname` dimension contributes one element
+        along `dimname`.
+        If this is a generator (or any iterable other than a list or
+        tuple), the inputs are consumed one at a time, and the result grows
+        as needed, so that all of the inputs never need to be held in
+        memory at once.
+    dimname : str
+        The dimension to concatenate along.
+        If the inputs don't have this dimension, it's added as the last
+        dimension of the result.
+    chop : bool
+        Deprecated, and ignored -- inputs whose shapes don't match always
+        raise an error.
+
+    Returns
+    -------
+    The concatenated nddata, whose dimensions are ordered like those of the
+    first item, and whose coordinates, units, and properties along the other
+    dimensions (as well as a copy of its `other_info`) come from that same
+    item.
+    '''
+    if chop:
+        warnings.warn("the chop argument of concat is deprecated and ignored"
+                " -- inputs whose shapes don't match always raise an error",
+                DeprecationWarning)
+    if isinstance(datalist,(list,tuple)):
+        if len(datalist) == 0:
+            raise ValueError("You passed an empty list to concat")
+        if not all([isinstance(j,nddata) for j in datalist]):
+            raise TypeError(strm('Problem with what you passed to concat, list of types,',
+                map(type,datalist)))
+        #{{{ with a list, the final size and dtype are known ahead of time
+        newdimsize = sum([j.axlen(dimname) if dimname in j.dimlabels else 1
+            for j in datalist])
+        buf = _concat_buffer(dimname,size = newdimsize,
+                dtype = result_type(*[j.data.dtype for j in datalist]))
+        buf._start(datalist[0])
+        #}}}
+        for j in datalist:
+            buf.append(j)
+        return buf.result()
     try:
-        shapes = map(ndshape,datalist)
-    except Exception as e:
-        if type(datalist) is not list:
-            raise TypeError(strm('You didn\'t pass a list, you passed a',type(datalist)))
-        raise RuntimeError(strm('Problem with what you passed to concat, list of types,',
-            map(type,datalist))+explain_error(e))
-    other_info_out = datalist[0].other_info
-    for j in range(0,len(datalist)):
-        #{{{ make list for the shape to check, which contains the dimensions we are NOT concatting along
-        if dimname in shapes[j].dimlabels:
-            newdimsize += shapes[j][dimname]
-            shapetocheck = list(shapes[j].shape)
-            shapetocheck.pop(shapes[j].axn(dimname))
-        else:
-            newdimsize += 1
-            shapetocheck = list(shapes[j].shape)
+        datalist = iter(datalist)
+    except TypeError:
+        raise TypeError(strm("You didn't pass a list (or other iterable) to concat, you passed a",type(datalist)))
+    buf = _concat_buffer(dimname)
+    for j in datalist:
+        buf.append(j)
+    if buf.n_items == 0:
+        raise ValueError("You passed an empty iterable to concat")
+    return buf.result()
+#}}}
+#{{{ growable nddata, for adding scans one at a time
+class nddata_buffer(_concat_buffer):
+    r'''A growable nddata, for adding scans one at a time along the
+    dimension `dimname` (*e.g.* during an acquisition).
+
+    Like a list, the underlying array doubles in length whenever it fills
+    up, so appending N scans copies O(N) data overall, rather than the
+    O(N²) of calling :func:`concat` after each scan.
+    Scans that don't have a `dimname` dimension each add one element
+    along it.
+    A running sum is kept, so that :meth:`mean` costs the same no matter
+    how many scans have been added.
+
+    >>> buf = nddata_buffer('scan')
+    >>> for thisscan in scans_as_they_arrive():
+    >>>     buf.append(thisscan)
+    >>>     plot(buf.mean())
+    >>> d = buf.result()
+
+    Parameters
+    ----------
+    dimname : str
+        The dimension that the scans are appended along.
+    spill_to : str or None
+        If this is given, whenever `spill_length` elements (along
+        `dimname`) are held in memory, they are written with
+        :meth:`~pyspecdata.nddata.hdf5_write` to `spill_to` (the name of
+        the HDF5 file followed by the node path, as for
+        :meth:`~pyspecdata.nddata.hdf5_write`) as nodes named ``name_0``,
+        ``name_1``, *etc.*, and the memory is reused for the scans that
+        follow.
+        In this case, every dimension of the scans needs coordinates.
+    spill_length : int
+        The number of elements along `dimname` that are held in memory
+        before they're spilled.
+    name : str
+        The name that the spilled nodes start with.
+    directory : str
+        The directory where the HDF5 file lives.
+
+    Attributes
+    ----------
+    spilled : list of str
+        The paths of the nodes that have been written so far.
+    '''
+    def __init__(self,dimname,spill_to = None,spill_length = 1024,
+            name = 'buffer',directory = '.'):
+        super(nddata_buffer,self).__init__(dimname)
+        self.spill_to = spill_to
+        self.spill_length = spill_length
+        self.name = name
+        self.directory = directory
+        self.spilled = []
+        self._sum = None
+    def __len__(self):
+        "the number of elements along `dimname`, including any that have been spilled"
+        return self.index_offset + self._n_filled()
+    def append(self,scan):
+        "append the nddata `scan`, and return the buffer"
+        before = self._n_filled()
+        super(nddata_buffer,self).append(scan)
+        #{{{ add the new part to the running sum
+        thissum = self.data[self._index(before,self._n_filled())].sum(axis = self.concat_axis)
+        if self._sum is None:
+            self._sum = thissum
+        else:
+            self._sum = self._sum + thissum # not in place, in case the dtype is promoted
+        #}}}
+        if self.spill_to is not None and self._n_filled() >= self.spill_length:
+            self.spill()
+        return self
+    def view(self):
+        r'''Return the scans held in memory as an nddata whose data is a view
+        of the buffer -- *i.e.* no data is copied, but the result is only
+        valid until the next scan is appended.
+        (This doesn't include any scans that have been spilled.)'''
+        return self._filled()
+    def spill(self):
+        "write the scans held in memory to the next HDF5 node, and free up the buffer for the scans that follow"
+        if self.spill_to is None:
+            raise ValueError("You need to set spill_to to spill the buffer to an HDF5 file")
+        if self._n_filled() == 0:
+            return self
+        thisblock = self._filled()
+        thisname = '%s_%d'%(self.name,len(self.spilled))
+        thisblock.name(thisname)
+        thisblock.hdf5_write(self.spill_to,directory = self.directory)
+        self.spilled.append(self.spill_to.rstrip('/')+'/'+thisname)
+        logger.debug(lazy_strm("spilled",self._n_filled(),"elements along",
+            self.dimname,"to",self.spilled[-1]))
+        #{{{ start filling the buffer again from the beginning
+        self.index_offset += self._n_filled()
+        self.shape[self.concat_axis] = 0
+        self.error = None
         #}}}
-        if j is 0:
-            shapetocheckagainst = shapetocheck
+        return self
+    def mean(self):
+        r'''Return the average along `dimname` of all the scans appended so
+        far (including any that have been spilled), from the running sum.'''
+        if self._sum is None:
+            raise ValueError("Nothing has been appended to the buffer yet")
+        return _labeled_like(self._sum/float(len(self)),
+                [j for j in self.dimlabels if j != self.dimname],self.template)
+    def result(self):
+        r'''Return all the scans as one nddata.
+        If any have been spilled, they're read back from the HDF5 file.'''
+        if len(self.spilled) == 0:
+            return super(nddata_buffer,self).result()
+        blocks = [nddata_hdf5(j,directory = self.directory) for j in self.spilled]
+        if self._n_filled() > 0:
+            blocks.append(self._filled())
+        return concat(blocks,self.dimname)
+#}}}
+#{{{ online statistics along one dimension
+def _labeled_like(data,dimlabels,template,template_dims = None):
+    r'''Return an nddata of `data` with dimensions `dimlabels`, whose
+    coordinates, units, and properties come from the nddata `template`.
+    `template_dims` gives the dimension of `template` that corresponds to
+    each of `dimlabels` (by default, the one with the same name).'''
+    if template_dims is None:
+        template_dims = dimlabels
+    retval = nddata(data,list(data.shape),list(dimlabels))
+    if len(template.axis_coords) > 0:
+        retval.labels(list(dimlabels),[template.getaxis(j) for j in template_dims])
+        for j,k in zip(dimlabels,template_dims):
+            if template.get_units(k) is not None:
+                retval.set_units(j,template.get_units(k))
+    retval.data_units = template.data_units
+    retval.other_info = dict(template.other_info)
+    return retval
+class running_stats(object):
+    r'''Accumulates the mean and variance (and, optionally, the
+    covariance along another dimension) of nddata along the dimension
+    `dimname`, in one pass, without holding on to the data.
+
+    It can be fed nddata that have a `dimname` dimension (a block of
+    transients), or that don't (a single transient).
+    Each block is combined with what's been accumulated so far by the
+    pairwise update of Chan, Golub, and LeVeque (Welford's update, for
+    single transients), which -- unlike summing the squares -- stays
+    accurate when the variance is small compared to the mean.
+    Accumulators that were fed different parts of the data (*e.g.* by
+    parallel workers -- they can be pickled) can be combined with
+    :meth:`merge`.
+    The errors of the data that are added are ignored.
+
+    >>> stats = running_stats('scan').feed(transients_as_they_arrive())
+    >>> d = stats.mean(return_error = False)
+    >>> d.set_error(stats.std().data/sqrt(stats.n))
+
+    Parameters
+    ----------
+    dimname : str
+        The dimension to average over.
+    covariance : str or None
+        If given, also accumulate the covariance between the points along
+        this (other) dimension -- see :meth:`covariance`.
+
+    Attributes
+    ----------
+    n : int
+        The number of elements along `dimname` accumulated so far.
+    '''
+    def __init__(self,dimname,covariance = None):
+        self.dimname = dimname
+        self.covariance_dim = covariance
+        self.n = 0
+        self.template = None
+        self._mean = None
+        self._m2 = None # the sum of the squared (absolute) deviations from the mean
+        self._comoment = None # the same, for the covariance
+    def _start(self,item):
+        "set up the dimensions, based on the first nddata that's added"
+        self.dimlabels = [j for j in item.dimlabels if j != self.dimname]
+        if self.covariance_dim is not None and self.covariance_dim not in self.dimlabels:
+            raise ValueError(strm("You asked for the covariance along",self.covariance_dim,
+                "but the data only has the dimensions",self.dimlabels,
+                "besides",self.dimname))
+        self.template = item.copy(data = False)
+        return self
+    def _covariance_last(self,x,offset = 0):
+        "move the covariance dimension of `x` to the end (`offset` counts the leading dimensions that aren't in dimlabels)"
+        return rollaxis(x,self.dimlabels.index(self.covariance_dim)+offset,x.ndim)
+    def add(self,item):
+        "add the nddata `item` (which may or may not have a `dimname` dimension), and return self"
+        if not isinstance(item,nddata):
+            raise TypeError(strm("You can only add nddata to running_stats, not",type(item)))
+        if self.template is None:
+            self._start(item)
+        if sorted([j for j in item.dimlabels if j != self.dimname]) != sorted(self.dimlabels):
+            raise ValueError(strm("The dimensions",item.dimlabels,
+                "don't match the ones that were added before,",self.dimlabels))
+        #{{{ put dimname first, and add it if it's not there
+        data = item.data
+        if self.dimname in item.dimlabels:
+            data = data.transpose(map(item.dimlabels.index,[self.dimname]+self.dimlabels))
         else:
-            if any(~(array(shapetocheck) == array(shapetocheckagainst))):
-                if chop:
-                    if verbose:
-                        print lsafen(repr(shapetocheck)),lsafen(repr(shapetocheckagainst))
-                        raise ValueError(strm('For item ',j,'in concat, ',
-                            shapetocheck,'!=',shapetocheckagainst,
-                            'where all the shapes of the things',
-                            'you\'re trying to concat are:',
-                            shapes))
-                else:
-                    raise ValueError(strm('For item ',j,'in concat, ',
-                        shapetocheck,'!=',shapetocheckagainst,
-                        'where all the shapes of the things you\'re trying to concat are:',
-                        shapes))
-    newdatalist = ndshape(datalist[-1])
-    if dimname in newdatalist.dimlabels:
-        newdatalist[dimname] = newdimsize
+            data = data.transpose(map(item.dimlabels.index,self.dimlabels))[newaxis,...]
+        #}}}
+        n = data.shape[0]
+        if n == 0:
+            return self
+        thismean = data.mean(axis = 0)
+        thiscomoment = 0
+        if n == 1:
+            thism2 = zeros(thismean.shape)
+        else:
+            deviation = data - thismean
+            thism2 = (abs(deviation)**2).sum(axis = 0)
+            if self.covariance_dim is not None:
+                deviation = self._covariance_last(deviation,1)
+                thiscomoment = einsum('s...i,s...j->...ij',deviation,deviation.conj())
+        return self._combine(n,thismean,thism2,thiscomoment)
+    def _combine(self,n,thismean,thism2,thiscomoment):
+        "fold the statistics of another group of `n` elements into these"
+        if self.n == 0:
+            self.n = n
+            self._mean = thismean.astype(result_type(thismean,float64))
+            self._m2 = thism2
+            if self.covariance_dim is not None:
+                L = thismean.shape[self.dimlabels.index(self.covariance_dim)]
+                self._comoment = zeros(self._covariance_last(thismean).shape+(L,),
+                        dtype = self._mean.dtype) + thiscomoment
+            return self
+        total = self.n + n
+        delta = thismean - self._mean
+        weight = float(self.n) * n / total
+        self._mean = self._mean + delta * (float(n) / total) # not in place, in case the dtype changes
+        self._m2 = self._m2 + thism2 + abs(delta)**2 * weight
+        if self.covariance_dim is not None:
+            delta = self._covariance_last(delta)
+            self._comoment = (self._comoment + thiscomoment
+                    + delta[...,:,newaxis] * delta.conj()[...,newaxis,:] * weight)
+        self.n = total
+        return self
+    def merge(self,other):
+        "fold the statistics accumulated by the running_stats `other` into these, and return self"
+        if other.n == 0:
+            return self
+        if self.template is None:
+            self.dimlabels = list(other.dimlabels)
+            self.template = other.template
+        elif sorted(other.dimlabels) != sorted(self.dimlabels):
+            raise ValueError(strm("You can't merge statistics for the dimensions",
+                other.dimlabels,"into ones for",self.dimlabels))
+        if other.covariance_dim != self.covariance_dim:
+            raise ValueError("You can only merge statistics that accumulate the covariance along the same dimension")
+        neworder = map(other.dimlabels.index,self.dimlabels)
+        othercomoment = 0
+        if self.covariance_dim is not None:
+            #{{{ the comoment has the covariance dimension (twice) at the end
+            reduced = [j for j in other.dimlabels if j != other.covariance_dim]
+            othercomoment = other._comoment.transpose(map(reduced.index,
+                [j for j in self.dimlabels if j != self.covariance_dim])
+                + [len(reduced),len(reduced)+1])
+            #}}}
+        return self._combine(other.n,other._mean.transpose(neworder),
+                other._m2.transpose(neworder),othercomoment)
+    def feed(self,iterable):
+        "add every nddata in `iterable` (*e.g.* a generator), and return self"
+        for j in iterable:
+            self.add(j)
+        return self
+    def _check(self,ddof = 0):
+        if self.n == 0:
+            raise ValueError("Nothing has been added yet")
+        if self.n <= ddof:
+            raise ValueError(strm("You need more than",ddof,
+                "elements to calculate the variance with ddof =",ddof))
+    def mean(self,return_error = True):
+        r'''Return the mean along `dimname`, with the error set to the standard
+        deviation (as :meth:`nddata.mean <pyspecdata.nddata.mean>` does),
+        unless `return_error` is False.'''
+        self._check()
+        retval = _labeled_like(self._mean.copy(),self.dimlabels,self.template)
+        if return_error:
+            retval.set_error(sqrt(self._m2/self.n))
+        return retval
+    def var(self,ddof = 0):
+        "return the variance along `dimname` (for complex data, the mean squared absolute deviation)"
+        self._check(ddof)
+        return _labeled_like(self._m2/(self.n-ddof),self.dimlabels,self.template)
+    def std(self,ddof = 0):
+        "return the standard deviation along `dimname`"
+        retval = self.var(ddof)
+        retval.data = sqrt(retval.data)
+        return retval
+    def covariance(self,ddof = 0):
+        r'''Return the covariance between the points along the dimension given
+        by the `covariance` argument (call it ``x``), as an nddata whose
+        last two dimensions are ``x`` and ``x_2``.
+        For complex data, this is
+        :math:`\langle (x_i-\bar{x}_i)(x_j-\bar{x}_j)^* \rangle`.'''
+        if self.covariance_dim is None:
+            raise ValueError("You need to pass the covariance argument when you create the running_stats")
+        self._check(ddof)
+        otherdims = [j for j in self.dimlabels if j != self.covariance_dim]
+        return _labeled_like(self._comoment/(self.n-ddof),
+                otherdims+[self.covariance_dim,self.covariance_dim+'_2'],
+                self.template,
+                otherdims+[self.covariance_dim,self.covariance_dim])
+#}}}
+#{{{ cached interpolation operators
+#    interpolation is linear in the data, so for a given source axis,
+#    target axis, and kind, it can be stored as a (sparse) matrix and
+#    reused for every spectrum that's resampled onto the same grid
+_interp_operator_cache = {}
+_interp_operator_order = []
+_interp_operator_cache_size = 16
+_interp_operator_blocksize = 256 # columns of the identity that are interpolated at once
+#    building the operator for a spline costs much more than interpolating
+#    once, so it's only built the second time the same interpolation is
+#    requested -- these are the keys that have been requested once
+_interp_operator_requested = []
+def _interp_key(oldaxis,newaxis,kind):
+    return (oldaxis.dtype.str,oldaxis.tostring(),
+            newaxis.dtype.str,newaxis.tostring(),kind)
+def _check_interp_bounds(sortedaxis,newaxis):
+    "raise the same error as interp1d for target values outside the axis"
+    if any(newaxis < sortedaxis[0]):
+        raise ValueError("A value in x_new is below the interpolation range.")
+    if any(newaxis > sortedaxis[-1]):
+        raise ValueError("A value in x_new is above the interpolation range.")
+def _local_interp_operator(oldaxis,newaxis,kind):
+    r'''Build the operator for ``'linear'`` or ``'nearest'`` interpolation
+    directly, from the neighbors of each target point (found the same way
+    that interp1d finds them).'''
+    n = len(oldaxis)
+    order = argsort(oldaxis,kind = 'mergesort')
+    x = oldaxis[order]
+    _check_interp_bounds(x,newaxis)
+    rows = r_[0:len(newaxis)]
+    if kind == 'nearest':
+        idx = searchsorted((x[1:]+x[:-1])/2.,newaxis,side = 'left').clip(0,n-1)
+        return sparse.csr_matrix((ones(len(newaxis)),(rows,order[idx])),
+                shape = (len(newaxis),n))
+    hi = searchsorted(x,newaxis).clip(1,n-1)
+    lo = hi-1
+    weight = (newaxis-x[lo])/(x[hi]-x[lo])
+    return sparse.csr_matrix((r_[1-weight,weight],(r_[rows,rows],r_[order[lo],order[hi]])),
+            shape = (len(newaxis),n))
+def _spline_interp_operator(oldaxis,newaxis,kind):
+    "build the operator for any other kind by interpolating blocks of the identity"
+    n = len(oldaxis)
+    blocks = []
+    for j in range(0,n,_interp_operator_blocksize):
+        thiswidth = _interp_operator_blocksize
+        if n-j < thiswidth: thiswidth = n-j
+        thisblock = zeros((n,thiswidth))
+        thisblock[j:j+thiswidth,:] = eye(thiswidth)
+        thisblock = interp1d(oldaxis,thisblock,kind = kind,axis = 0)(newaxis)
+        thisblock[abs(thisblock) < 1e-15] = 0 # the spline coefficients fall off exponentially
+        blocks.append(sparse.csr_matrix(thisblock))
+    return sparse.hstack(blocks).tocsr()
+def _interp_operator(oldaxis,newaxis,kind):
+    r'''Return a sparse matrix that, when applied to data along `oldaxis`,
+    gives the same result as
+    ``interp1d(oldaxis,data,kind=kind,axis=0)(newaxis)``,
+    or None if it's cheaper to call interp1d directly.
+
+    For ``'linear'`` and ``'nearest'``, the matrix is built directly, in
+    O(n).
+    For splines, the matrix costs O(n²) to build, so None is returned the
+    first time that a given interpolation is requested, and the matrix is
+    only built when the same interpolation is requested again.
+    The matrices are kept in a least-recently-used cache keyed by
+    (`oldaxis`, `newaxis`, `kind`).
+    '''
+    thiskey = _interp_key(oldaxis,newaxis,kind)
+    if thiskey in _interp_operator_cache:
+        _interp_operator_order.remove(thiskey)
+        _interp_operator_order.append(thiskey)
+        return _interp_operator_cache[thiskey]
+    if kind in ['linear','nearest']:
+        retval = _local_interp_operator(oldaxis,newaxis,kind)
+    elif thiskey in _interp_operator_requested:
+        _interp_operator_requested.remove(thiskey)
+        retval = _spline_interp_operator(oldaxis,newaxis,kind)
     else:
-        newdatalist += ([newdimsize],[dimname])
-    #print "DEBUG newdatalist is shaped like",newdatalist
+        _interp_operator_requested.append(thiskey)
+        while len(_interp_operator_requested) > _interp_operator_cache_size:
+            _interp_operator_requested.pop(0)
+        return None
+    _interp_operator_cache[thiskey] = retval
+    _interp_operator_order.append(thiskey)
+    while len(_interp_operator_order) > _interp_operator_cache_size:
+        del _interp_operator_cache[_interp_operator_order.pop(0)]
+    return retval
+def _apply_interp_operator(operator,data,thisaxis):
+    "apply `operator` along dimension number `thisaxis` of the ndarray `data`"
+    data = rollaxis(data,thisaxis,0)
+    newshape = (operator.shape[0],) + data.shape[1:]
+    data = operator.dot(data.reshape(data.shape[0],-1))
+    return rollaxis(data.reshape(newshape),0,thisaxis+1)
+#}}}
+#{{{ reshape the data, counting the reshapes that need a copy
+#    -- the counts are reported by :class:`~pyspecdata.profiling.profile_nddata`
+_reshape_counts = {'view':0,'copy':0}
+def _reshape(data,newshape):
+    r"""Reshape the ndarray `data` to `newshape`.
+
+    Where the strides allow it (*e.g.* when only singleton dimensions
+    are added, or when the dimensions that are merged are adjacent in
+    memory), the result is a view, and otherwise it's a copy.
+    Either way, the reshape is tallied in `_reshape_counts`."""
+    retval = data.view()
     try:
-        newdatalist = newdatalist.alloc()
-    except:
-        raise ValueError(strm("trying to alloc the newdatalist",newdatalist,
-            "created a problem") + explain_error(e))
-    if datalist[0].get_error() is not None:
-        newdatalist.set_error(zeros(shape(newdatalist.data)))
-    #}}}
-    #{{{ actually contract the datalist
-    newdimsize = 0 # now use it to track to position
-    for j in range(0,len(datalist)):
-        if dimname in shapes[j].dimlabels:
-            newdatalist[dimname,newdimsize:newdimsize+shapes[j][dimname]] = datalist[j]
-            newdimsize += shapes[j][dimname]
-        else:
-            newdatalist[dimname,newdimsize:newdimsize+1] = datalist[j]
-            newdimsize += 1
-    #}}}
-    #{{{ pull the axis labels from the last item in the list
-    if len(datalist[-1].axis_coords)>0:
-        dimlabels = list(datalist[-1].dimlabels)
-        axis_coords = list(datalist[-1].axis_coords)
-        #print "axis_coords are",axis_coords,"for",dimlabels
-        if dimname in dimlabels:
-            thisindex = dimlabels.index(dimname)
-            dimlabels.pop(thisindex)
-            axis_coords.pop(thisindex)
-        dimlabels += [dimname]
-        axis_coords += [r_[0:newdimsize]]
-        try:
-            newdatalist.labels(dimlabels,axis_coords)
-        except Exception as e:
-            raise ValueError(strm("trying to attach axes of lengths",
-                map(len,axis_coords),"to",dimlabels)+explain_error(e))
-    #}}}
-    newdatalist.other_info = other_info_out
-    return newdatalist
+        retval.shape = newshape
+    except AttributeError:# numpy can't do this without a copy
+        _reshape_counts['copy'] += 1
+        return data.reshape(newshape)
+    _reshape_counts['view'] += 1
+    return retval
 #}}}
 class nddata (object):
     """This is the detailed API reference.
@@ -3432,8 +4313,8 @@ class nddata (object):
             # error does not change
             return A
         #{{{ shape and add
-        A,B = self.aligndata(arg)
-        retval = A.copy()
+        A,B = self.aligndata(arg,views = True)
+        retval = A._copy_sharing_data()
         retval.data = A.data + B.data
         #}}}
         Aerr = A.get_error()
@@ -3525,14 +4406,14 @@ class nddata (object):
         #}}}
         #{{{ shape and multiply
         try:
-            A,B = self.aligndata(arg)
+            A,B = self.aligndata(arg,views = True)
         except Exception as e:
             if arg.name() is not None and self.name() is not None:
                 raise ValueError(strm("Error aligning right (arg)", arg.name(),
                     "with left (self)", self.name())+explain_error(e))
             else:
                 raise ValueError("Error aligning"+explain_error(e))
-        retval = A.copy()
+        retval = A._copy_sharing_data()
         retval.data = A.data * B.data
         #}}}
         #{{{ if we have error for both the sets of data, I should propagate that error
@@ -3583,8 +4464,8 @@ class nddata (object):
                 error = A.get_error()
                 error /= abs(arg)
             return A
-        A,B = self.aligndata(arg)
-        retval = A.copy()
+        A,B = self.aligndata(arg,views = True)
+        retval = A._copy_sharing_data()
         retval.data = A.data / B.data
         #{{{ if we have error for both the sets of data, I should propagate that error
         Aerr = A.get_error()
@@ -3659,7 +4540,7 @@ class nddata (object):
             self.axis_coords_units = [v for j,v in enumerate(self.axis_coords_units) if mask[j]]
         return retval
     #{{{ align data
-    def aligndata(self,arg,verbose = False):
+    def aligndata(self,arg,verbose = False,views = False):
         r'''This is a fundamental method used by all of the arithmetic operations.
         It uses the dimension labels of `self` (the current instance) and `arg` (an nddata passed to this method) to generate two corresponding output nddatas that I refer to here, respectively, as `A` and `B`.  `A` and `B` have dimensions that are "aligned" -- that is, they are identical except for singleton dimensions (note that numpy automatically tiles singleton dimensions).  Regardless of how the dimensions of `self.data` and `arg.data` (the underlying numpy data) were ordered, `A.data` and `B.data` are now ordered identically, where dimensions with the same label (`.dimlabel`) correspond to the same numpy index.  This allows you do do math.
 
@@ -3669,6 +4550,14 @@ class nddata (object):
         ==========
         arg : nddata
             the nddata that you want to align to `self`
+        views : boolean
+            Default to False, where `A` and `B` are full copies.
+            True is for internal use (*e.g.* by the arithmetic methods, which
+            only read the data):
+            `A.data` and `B.data` are then views of `self.data` and
+            `arg.data` wherever the strides allow it (transposing and adding
+            singleton dimensions never needs a copy), so they must not be
+            modified in place.
 
         Returns
         =======
@@ -3682,26 +4571,33 @@ class nddata (object):
         if verbose: print "starting aligndata"
         if isscalar(arg) or type(arg) == ndarray:
             arg = nddata(arg)
-        if ndshape(self).zero_dimensional and ndshape(arg).zero_dimensional:
+        # (the same test as ndshape's zero_dimensional, without building an ndshape)
+        self_zero_dimensional = ndim(self.data) == 0 and len(self.dimlabels) == 0
+        arg_zero_dimensional = ndim(arg.data) == 0 and len(arg.dimlabels) == 0
+        if self_zero_dimensional and arg_zero_dimensional:
             if verbose: print "(1) yes, I found something zero dimensional"
             return self.copy(),arg.copy()
         #}}}
-        elif ndshape(self).zero_dimensional:
+        elif self_zero_dimensional:
             if verbose: print "(2) yes, I found something zero dimensional"
             if verbose: print "yes, I found something zero dimensional"
             A = self.copy()
             A.dimlabels = [arg.dimlabels[0]]
             A.data = A.data.reshape(1)
-            return A.aligndata(arg)
-        elif ndshape(arg).zero_dimensional:
+            return A.aligndata(arg,views = views)
+        elif arg_zero_dimensional:
             if verbose: print "(3) yes, I found something zero dimensional"
             if verbose: print "yes, I found something zero dimensional"
             arg = arg.copy()
             arg.dimlabels = [self.dimlabels[0]]
             arg.data = arg.data.reshape(1)
-            return self.aligndata(arg)
+            return self.aligndata(arg,views = views)
         #}}}
-        selfout = self.copy() # copy self
+        if views:
+            selfout = self._copy_sharing_data() # only reshaped below, so
+            #       the data is a view of that of self wherever possible
+        else:
+            selfout = self.copy() # copy self
         assert len(selfout.data.shape) != 0 and len(arg.data.shape) != 0, ("neither"
          " self nor arg should be zero dimensional at this point (previous code"
          " should have taken care of that")
@@ -3716,7 +4612,10 @@ class nddata (object):
                 ones(len(augmentdims),dtype=uint64)) # there is no need to
         #       transpose self, since its order is preserved
         # }}}
-        argout = arg.copy()
+        if views:
+            argout = arg._copy_sharing_data()
+        else:
+            argout = arg.copy()
         # {{{ now create argshape for the reshaped argument
         new_arg_labels = [x for x in newdims if x in
                 arg.dimlabels] #  only the labels valid for arg, ordered
@@ -3740,13 +4639,13 @@ class nddata (object):
         argorder = map(argout.dimlabels.index,new_arg_labels) # for
         #          each new dimension, determine the position of the
         #          original dimension
-        selfout.data = selfout.data.reshape(int64(selfshape)) # and reshape
+        selfout.data = _reshape(selfout.data,int64(selfshape)) # and reshape
         #          to its new shape
         selfout.dimlabels = newdims
         try:
             argshape = int64(argshape)
-            argout.data = argout.data.transpose(argorder
-                    ).reshape(argshape) # and reshape the data
+            argout.data = _reshape(argout.data.transpose(argorder),
+                    argshape) # and reshape the data
         except ValueError,Argument:
             raise ValueError('the shape of the data is ' +
                     repr(argout.data.shape) + ' the transpose ' +
@@ -3758,7 +4657,7 @@ class nddata (object):
         # {{{ transpose the data errors appropriately
         if selfout.get_error() != None:
             try:
-                temp = selfout.get_error().copy().reshape(selfshape)
+                temp = _reshape(selfout.get_error(),selfshape)
             except ValueError,Argument:
                 raise ValueError("The instance (selfout) has a shape of "
                         + repr(selfout.data.shape) +
@@ -3769,7 +4668,7 @@ class nddata (object):
             selfout.set_error(temp)
         if argout.get_error() != None:
             try:
-                temp = argout.get_error().copy().transpose(argorder).reshape(argshape)
+                temp = _reshape(argout.get_error().transpose(argorder),argshape)
             except ValueError,Argument:
                 raise ValueError("The argument (argout) has a shape of "
                         + repr(argout.data.shape)
@@ -4102,7 +5001,7 @@ class nddata (object):
             raise ValueError('you can\'t pass more than one argument!!')
         axes = self._possibly_one_axis(*args)
         return_error = process_kwargs([('return_error',True)],kwargs)
-        logger.debug(strm("return error is",return_error))
+        logger.debug(lazy_strm("return error is",return_error))
         if (type(axes) is str):
             axes = [axes]
         #}}}
@@ -4110,8 +5009,8 @@ class nddata (object):
             try:
                 thisindex = self.dimlabels.index(axes[j])
             except:
-                logger.debug(strm('error, dimlabels is: ',self.dimlabels))
-                logger.debug(strm("doesn't contain: ",axes[j]))
+                logger.debug(lazy_strm('error, dimlabels is: ',self.dimlabels))
+                logger.debug(lazy_strm("doesn't contain: ",axes[j]))
                 raise
             if self.data_error is not None:
                 this_axis_length = self.data.shape[thisindex]
@@ -4120,17 +5019,22 @@ class nddata (object):
                             axis=thisindex)/(this_axis_length**2))
                 except:
                     raise ValueError(strm('shape of data',shape(self.data),'shape of data error',shape(self.data_error)))
+            thismean = mean(self.data,
+                    axis=thisindex)
             if return_error: # since I think this is causing an error
-                thiserror = std(self.data,
-                        axis=thisindex)
+                #{{{ the standard deviation, reusing the mean rather than
+                #    letting std calculate it again
+                thiserror = sqrt(mean(abs(self.data
+                    - expand_dims(thismean,thisindex))**2,
+                    axis=thisindex))
+                #}}}
                 if isscalar(thiserror):
                     thiserror = r_[thiserror]
-            self.data = mean(self.data,
-                    axis=thisindex)
+            self.data = thismean
             if return_error: # this needs to go after the data setting
                 self.set_error(thiserror) # set the error to the standard deviation
             self._pop_axis_info(thisindex)
-            logger.debug(strm("return error is",return_error))
+            logger.debug(lazy_strm("return error is",return_error))
         return self
     def mean_nopop(self,axis):
         self = self.run_nopop(mean,axis=axis)
@@ -4351,7 +5255,16 @@ class nddata (object):
             raise ValueError("should eventually support array, label pair, but doesn't yet")
     def interp(self,axis,axisvalues, past_bounds=None, verbose=False, return_func=False, **kwargs):
         '''interpolate data values given axis values
-        
+
+        The interpolation is stored as a sparse matrix (see
+        :func:`_interp_operator`) that is cached, so that repeatedly
+        interpolating data with the same axis onto the same target axis
+        only pays the cost of a matrix multiplication
+        (for splines, the matrix is only built once the same interpolation
+        is repeated).
+        Real and imaginary parts are interpolated in a single pass, and
+        real data stays real.
+
         Parameters
         ==========
         return_func : boolean
@@ -4383,45 +5296,47 @@ class nddata (object):
                 else:
                     axisvalues[axisvalues<oldaxis.min()] = past_bounds
                     axisvalues[axisvalues>oldaxis.max()] = past_bounds
-        rdata = real(self.data)
-        idata = imag(self.data)
         thiserror = self.get_error()
-        if thiserror is not None:
-            rerrvar = real(thiserror)**2
-            if thiserror[0].dtype == 'complex128':
-                ierrvar = imag(thiserror)**2
         if 'kind' in kwargs.keys():
             thiskind = kwargs.pop('kind')
         else:
             thiskind = 'cubic'
-            if len(rdata) < 4:
+            if len(oldaxis) < 4:
                 thiskind = 'quadratic'
-                if len(rdata) < 3:
+                if len(oldaxis) < 3:
                     thiskind = 'linear'
         thisaxis = self.axn(axis)
         if verbose: print 'Using %s interpolation'%thiskind
-        def local_interp_func(local_arg_data,kind = thiskind):
-            interpfunc =  interp1d(oldaxis,local_arg_data,kind = kind,axis = thisaxis)
-            try:
-                retval = interpfunc(axisvalues)
-            except:
-                raise TypeError("dtype of axis is"+repr(axisvalues.dtype))
-            return retval
         if return_func:
+            rdata = real(self.data)
+            idata = imag(self.data)
             rfunc = interp1d(oldaxis, rdata, kind=thiskind, axis=thisaxis, bounds_error=False, fill_value=tuple(rdata[r_[0,-1]].tolist()))
             ifunc = interp1d(oldaxis, idata, kind=thiskind, axis=thisaxis, bounds_error=False, fill_value=tuple(idata[r_[0,-1]].tolist()))
             return lambda x: rfunc(x) + 1j*ifunc(x)
-        rdata = local_interp_func(rdata)
-        idata = local_interp_func(idata)
-        self.data = rdata + 1j * idata
+        def local_interp_func(local_arg_data,kind = thiskind):
+            try:
+                thisoperator = _interp_operator(oldaxis,axisvalues,kind)
+                if thisoperator is None: # the first time, just interpolate
+                    if iscomplexobj(local_arg_data):
+                        return (interp1d(oldaxis,real(local_arg_data),kind = kind,axis = thisaxis)(axisvalues)
+                                + 1j*interp1d(oldaxis,imag(local_arg_data),kind = kind,axis = thisaxis)(axisvalues))
+                    return interp1d(oldaxis,local_arg_data,kind = kind,axis = thisaxis)(axisvalues)
+            except ValueError as e:
+                raise ValueError(strm("interpolating from an axis that spans",
+                    oldaxis.min(),"to",oldaxis.max(),"onto one that spans",
+                    axisvalues.min(),"to",axisvalues.max())+explain_error(e))
+            except:
+                raise TypeError("dtype of axis is"+repr(axisvalues.dtype))
+            return _apply_interp_operator(thisoperator,local_arg_data,thisaxis)
+        self.data = local_interp_func(self.data)
         self.setaxis(axis,axisvalues)
         if thiserror is not None:
-            rerrvar = local_interp_func(rerrvar,kind = 'linear') # calculate the error variance of the real part, use linear to avoid nan problems
-            if thiserror[0].dtype == 'complex128':
-                ierrvar = local_interp_func(ierrvar,kind = 'linear')
-                self.set_error(sqrt(rerrvar) + 1j * sqrt(ierrvar))
+            # calculate the error variance of the real (and imaginary) part, use linear to avoid nan problems
+            if iscomplexobj(thiserror):
+                errvar = local_interp_func(real(thiserror)**2 + 1j*imag(thiserror)**2,kind = 'linear')
+                self.set_error(sqrt(real(errvar)) + 1j * sqrt(imag(errvar)))
             else:
-                self.set_error(sqrt(rerrvar))
+                self.set_error(sqrt(local_interp_func(thiserror**2,kind = 'linear')))
             err_nanmask = isnan(self.get_error())
             self.data[err_nanmask] = nan
         return self
@@ -4479,8 +5394,9 @@ class nddata (object):
         
         this function returns the start and stop positions along the
         axis for the contiguous blocks for which lambdafunc returns
-        true
-        **Currently only supported for 1D data**
+        true.
+        For N-D data, the blocks along `axis` are found for all the other
+        indices at once (with :func:`contiguous_runs`).
         
         .. note::
             adapted from stackexchange post http://stackoverflow.com/questions/4494404/find-large-number-of-consecutive-values-fulfilling-condition-in-a-numpy-array
@@ -4506,6 +5422,11 @@ class nddata (object):
             An :math:`N\times 2` matrix, where the :math:`N` rows correspond to pairs of axis
             label that give ranges over which `lambdafunc` evaluates to `True`.
             These are ordered according to descending range width.
+            A block that runs to the end of the axis stops on the last
+            label.
+            For N-D data, this is instead an array (of dtype object) whose
+            shape is that of the other dimensions (in order), and each
+            element of which is the matrix for that slice.
 
         Examples
         --------
@@ -4536,22 +5457,129 @@ class nddata (object):
         else:
             mask = lambdafunc(self.copy(),axis).data
         if verbose: print "(contiguous) shape of mask",mask.shape
-        if axis is None:
-            idx, = np.diff(mask).nonzero() # this gives a list of indices for the boundaries between true/false
-        else:
-            idx, = np.diff(mask, axis=self.axn(axis)).nonzero() # this gives a list of indices for the boundaries between true/false
-        idx += 1 # because diff only starts on index #1 rather than #0
-        if mask[0]: # because I want to indicate the boundaries of True, if I am starting on True, I need to make 0 a boundary
-            idx = np.r_[0, idx]
-        if mask[-1]: # If the end of mask is True, then I need to add a boundary there as well
-            idx = np.r_[idx, mask.size-1] # Edit
-        idx.shape = (-1,2) # idx is 2x2 array of start,stop
+        thisaxis = self.axn(axis)
+        n = mask.shape[thisaxis]
+        index,start,stop = contiguous_runs(mask,thisaxis)
+        stop[stop == n] = n-1 # a block that runs to the end stops on the last point
+        idx = c_[start,stop] # the start,stop of each block
         if verbose: print '(contiguous) DEBUG idx is',idx
-        if verbose: print "(contiguous) diffs for blocks",diff(idx,axis=1),
-        block_order = diff(idx, axis=1).flatten().argsort()[::-1]
-        if verbose: print "(contiguous) in descending order, the blocks are therefore",idx[block_order,:]
-        #if verbose: print "yielding",idx[diff(idx,axis=1).argmax(),:],self.getaxis(axis)[idx[diff(idx,axis=1).argmax(),:]]
-        return self.getaxis(axis)[idx[block_order,:]]
+        axis_coords = self.getaxis(axis)
+        def in_descending_order(idx):
+            block_order = diff(idx, axis=1).flatten().argsort()[::-1]
+            if verbose: print "(contiguous) in descending order, the blocks are therefore",idx[block_order,:]
+            return axis_coords[idx[block_order,:]]
+        if mask.ndim == 1:
+            return in_descending_order(idx)
+        #{{{ split the blocks up by slice -- they're already ordered by slice
+        othershape = mask.shape[:thisaxis]+mask.shape[thisaxis+1:]
+        retval = empty(othershape,dtype = object)
+        boundaries = searchsorted(ravel_multi_index(index,othershape),r_[0:retval.size+1])
+        for j in range(retval.size):
+            retval.flat[j] = in_descending_order(idx[boundaries[j]:boundaries[j+1],:])
+        #}}}
+        return retval
+    def find_peaks(self,axis,smoothing = None,threshold = 0.8,minimum_points = 2,find = 'max'):
+        r"""Find the peaks along `axis`, for all the other indices at once.
+
+        The data is (optionally) smoothed along `axis`, so that the noise
+        doesn't break up the peaks, and then the blocks where the smoothed
+        data is above `threshold` times its maximum (or below `threshold`
+        times its minimum) are found with :func:`contiguous_runs`.
+        The peak of each block is the argmax (or argmin) of the original
+        (unsmoothed) data inside the block.
+
+        Parameters
+        ----------
+        axis : str
+            The axis along which to find the peaks.
+        smoothing : double or None
+            If given, the width (standard deviation, in the units of the
+            axis coordinates -- or in points, if there are no axis
+            coordinates) of the Gaussian that the data is convolved
+            with (by :meth:`convolve`) before thresholding.
+        threshold : double
+            The fraction of the maximum (or minimum) of each slice of the
+            smoothed data that a block has to exceed.
+        minimum_points : int
+            Ignore blocks with fewer points than this.
+        find : {'max','min'}
+            Whether to find the maxima or the minima.
+
+        Returns
+        -------
+        position : nddata
+            The axis coordinate (or index, if there are no axis coordinates)
+            of each peak, with the dimensions of `self`, except that `axis`
+            is replaced by ``peak``, which is as long as the largest number
+            of peaks found in any slice -- the slices with fewer peaks are
+            filled out with NaN.
+            Within each slice, the peaks are ordered along the axis.
+        value : nddata
+            The data at each peak, with the same dimensions as `position`.
+        """
+        if find not in ['max','min']:
+            raise ValueError(strm("find must be 'max' or 'min', not",find))
+        if iscomplexobj(self.data):
+            raise ValueError("find_peaks can't order complex data -- take the"
+                    " real part, the imaginary part, or the abs first")
+        thisaxis = self.axn(axis)
+        data = rollaxis(self.data,thisaxis,self.data.ndim)
+        n = data.shape[-1]
+        othershape = data.shape[:-1]
+        if smoothing is None:
+            smoothed = data
+        else:
+            smoothed = self.copy()
+            if smoothed.getaxis(axis) is None:# smooth over points
+                smoothed.setaxis(axis,r_[0.:n])
+            smoothed = rollaxis(smoothed.convolve(axis,smoothing).data,thisaxis,self.data.ndim)
+        data = data.reshape(-1,n)
+        smoothed = smoothed.reshape(-1,n)
+        if find == 'max':
+            mask = smoothed > threshold*smoothed.max(axis = -1)[:,newaxis]
+            sort_by = -data
+        else:
+            mask = smoothed < threshold*smoothed.min(axis = -1)[:,newaxis]
+            sort_by = data
+        (row,),start,stop = contiguous_runs(mask)
+        keep = stop-start >= minimum_points
+        row,start,stop = row[keep],start[keep],stop[keep]
+        #{{{ the argmax (or argmin) in every block at once: sort the points of
+        #    all the blocks by block, and then by value, and take the first
+        #    point of each block (lexsort is stable, so that ties give the
+        #    first point, like argmax does)
+        length = stop-start
+        first = cumsum(length)-length # where each block starts in the list of points
+        blockpoints = arange(length.sum())-repeat(first,length)+repeat(start,length)
+        blockrows = repeat(row,length)
+        order = lexsort((sort_by[blockrows,blockpoints],repeat(arange(len(row)),length)))
+        peak = blockpoints[order[first]]
+        #}}}
+        #{{{ number the peaks within each slice -- the blocks are already ordered by slice
+        npeaks = bincount(row,minlength = data.shape[0])
+        peak_number = arange(len(row))-repeat(cumsum(npeaks)-npeaks,npeaks)
+        #}}}
+        x = self.getaxis(axis)
+        if x is None:
+            x = r_[0:n]
+        position = nan*ones((data.shape[0],npeaks.max()))
+        position[row,peak_number] = x[peak]
+        value = nan*ones(position.shape,dtype = result_type(data,float64))
+        value[row,peak_number] = data[row,peak]
+        otherdims = [j for j in self.dimlabels if j != axis]
+        retval = []
+        for thisdata,thisunits in [(position,self.get_units(axis)),(value,self.get_units())]:
+            thisdata = thisdata.reshape(othershape+(thisdata.shape[-1],))
+            thisdata = nddata(thisdata,list(thisdata.shape),otherdims+['peak'])
+            if len(otherdims) > 0 and len(self.axis_coords) > 0:
+                thisdata.labels(list(otherdims),[None if self.getaxis(j) is None
+                    else self.getaxis(j).copy() for j in otherdims])
+                for j in otherdims:
+                    if self.get_units(j) is not None:
+                        thisdata.set_units(j,self.get_units(j))
+            thisdata.set_units(thisunits)
+            retval.append(thisdata)
+        return tuple(retval)
     def to_ppm(self):
         """Function that converts from Hz to ppm using Bruker parameters
 
@@ -4582,8 +5610,8 @@ class nddata (object):
             #}}}
     def repwlabels(self,axis):
         return None
-    def add_noise(self,intensity):
-        '''Add Gaussian (box-muller) noise to the data.
+    def add_noise(self,intensity,seed = None,realizations = None,dimname = 'realization'):
+        '''Add Gaussian noise to the data.
 
         Parameters
         ----------
@@ -4591,12 +5619,57 @@ class nddata (object):
             If a double, gives the standard deviation of the noise.
             If a function, used to calculate the standard deviation of the noise from the data:
             *e.g.* ``lambda x: max(abs(x))/10.``
-            
+        seed : None, int, or generator
+            Seed or random stream used to generate the noise
+            (see :func:`_noise_generator`),
+            so that simulations can be made reproducible.
+        realizations : int or None
+            If given, generate this many independent realizations of the
+            noise at once, stacked along a new (outermost) dimension called
+            `dimname`.
+            The result is allocated once, filled with noise in place, and
+            the data is then added to it.
+        dimname : str
+            The name of the new dimension used when `realizations` is given.
         '''
         if type(intensity) is type(emptyfunction):
-            intensity = intensity(lambda x: self.data)
-        return_complex = iscomplexobj(self.data)
-        self.data += box_muller(self.data.size, return_complex=return_complex).reshape(self.data.shape) * intensity
+            intensity = intensity(self.data)
+        if self.data.dtype.kind in 'fc':
+            noise_dtype = self.data.dtype
+        else:
+            noise_dtype = float64
+        if realizations is None:
+            noise = empty(self.data.shape,dtype = noise_dtype)
+            box_muller(None, seed=seed, out=noise)
+            noise *= intensity
+            self.data += noise
+            return self
+        if dimname in self.dimlabels:
+            raise ValueError(strm("There is already a dimension called",dimname))
+        noise = empty((realizations,)+self.data.shape,dtype = noise_dtype)
+        box_muller(None, seed=seed, out=noise)
+        noise *= intensity
+        noise += self.data
+        #{{{ if there is a list of axis coordinates, add in slots for the new axis
+        if type(self.axis_coords) is list:
+            if len(self.axis_coords) == 0:
+                self.axis_coords = [None] * len(self.dimlabels)
+            self.axis_coords.insert(0,r_[0:realizations])
+        if type(self.axis_coords_error) is list:
+            if len(self.axis_coords_error) == 0:
+                self.axis_coords_error = [None] * len(self.dimlabels)
+            self.axis_coords_error.insert(0,None)
+        if type(self.axis_coords_units) is list:
+            if len(self.axis_coords_units) == 0:
+                self.axis_coords_units = [None] * len(self.dimlabels)
+            self.axis_coords_units.insert(0,None)
+        #}}}
+        if self.data_error is not None:
+            newerror = empty(noise.shape,dtype = self.data_error.dtype)
+            newerror[:] = self.data_error
+            self.data_error = newerror
+        self.data = noise
+        self.dimlabels = [dimname] + list(self.dimlabels)
         return self
     #{{{ functions to manipulate and return the axes
     def reorder(self,*axes,**kwargs):
@@ -4635,6 +5708,8 @@ class nddata (object):
             neworder = map(self.dimlabels.index,axes)
         except ValueError as e:
             raise ValueError(strm('one of',axes,'not in',self.dimlabels))
+        if neworder == range(len(self.dimlabels)):
+            return self
         self.dimlabels = map(self.dimlabels.__getitem__,neworder)
         if len(self.axis_coords)>0:
             try:
@@ -4648,6 +5723,8 @@ class nddata (object):
                 except:
                     raise IndexError(strm('problem mapping',map(len,self.axis_coords_units),
                         'onto',neworder)+explain_error(e))
+        if self.axis_coords_error is not None and len(self.axis_coords_error)>0:
+            self.axis_coords_error = map(self.axis_coords_error.__getitem__,neworder)
         try:
             self.data = self.data.transpose(neworder)
         except ValueError as e:
@@ -4693,11 +5770,11 @@ class nddata (object):
             else:
                 #{{{ test that the axis is the right size
                 if isscalar(listofaxes[j]):#interpret as a timestep
-                    listofaxes[j] = listofaxes[j] * r_[0:ndshape(self)[listofstrings[j]]]
+                    listofaxes[j] = listofaxes[j] * r_[0:self.axlen(listofstrings[j])]
                 if type(listofaxes[j]) not in [ndarray,list]:
                     raise TypeError('You passed an axis label of type '+repr(type(listofaxes[j]))+' for the axis '+listofstrings[j]+' to the labels method, which you can\'t do --> it must be an nddata')
-                if (len(listofaxes[j]) != ndshape(self)[listofstrings[j]]) and (len(listofaxes[j])!=0):
-                    raise IndexError("You're trying to attach an axis of len %d to the '%s' dimension, which has %d data points (shape of self is %s)"%(len(listofaxes[j]),listofstrings[j],ndshape(self)[listofstrings[j]],repr(ndshape(self))))
+                if (len(listofaxes[j]) != self.axlen(listofstrings[j])) and (len(listofaxes[j])!=0):
+                    raise IndexError("You're trying to attach an axis of len %d to the '%s' dimension, which has %d data points (shape of self is %s)"%(len(listofaxes[j]),listofstrings[j],self.axlen(listofstrings[j]),repr(ndshape(self))))
                 #}}}
                 self.setaxis(listofstrings[j],listofaxes[j])
         return self
@@ -4792,7 +5869,7 @@ class nddata (object):
                 if issympy(args[0]):
                     func = args[0]
                     symbols_in_func = func.atoms(sympy.Symbol)
-                    logger.debug(strm('identified this as a sympy expression (',func,') with symbols',symbols_in_func))
+                    logger.debug(lazy_strm('identified this as a sympy expression (',func,') with symbols',symbols_in_func))
                     symbols_not_in_dimlabels = set(map(str,symbols_in_func))-set(self.dimlabels)
                     if len(symbols_not_in_dimlabels)>0:
                         raise ValueError("You passed a symbolic function, but the symbols"+str(symbols_not_in_dimlabels)+" are not axes")
@@ -4806,7 +5883,7 @@ class nddata (object):
         else:
             raise ValueError('Wrong number of arguments!! -- you passed '+repr(len(args))+' arguments!')
         if issympy(func):
-            logging.debug(strm("about to run sympy lambdify, symbols_in_func is",symbols_in_func))
+            logging.debug(lazy_strm("about to run sympy lambdify, symbols_in_func is",symbols_in_func))
             mat2array = [{'ImmutableMatrix': array}, 'numpy']# returns arrays rather than the stupid matrix class
             try:
                 lambdified_func = sympy.lambdify(list(symbols_in_func), func,
@@ -4827,7 +5904,7 @@ class nddata (object):
         retval = func(*list_of_axes)
         if issympy(retval):
             raise RuntimeError("The sympy function that you passed doesn't match the automatically generated axis variables (obtained by mapping sympy.var onto the axis variables, without any kwargs). The atoms left over are:\n"+str(func.atoms))
-        logging.debug(strm("at this point, list of axes is:",list_of_axes))
+        logging.debug(lazy_strm("at this point, list of axes is:",list_of_axes))
         if len(list_of_axes) == 0:
             return nddata(float(func()))
             #raise ValueError(strm("Doesn't seem like there are axes -- the axis names that you passed are",axisnames))
@@ -5043,7 +6120,7 @@ class nddata (object):
         return thishape
     def circshift(self,axis,amount):
         if amount!=0:
-            if abs(amount) > ndshape(self)[axis]:
+            if abs(amount) > self.axlen(axis):
                 ValueError(strm("Trying to circshift by ",amount,
                     "which is bitter than the size of",axis))
             newdata = ndshape(self).alloc(dtype=self.data.dtype)
@@ -5089,7 +6166,7 @@ class nddata (object):
         '''
         #{{{ first, put them all at the end, in order given here
         retained_dims = list(self.dimlabels)
-        logger.debug(strm("old order",retained_dims))
+        logger.debug(lazy_strm("old order",retained_dims))
         #{{{ if I'm using a dimension here, be sure to grab its current position
         if dimname is None:
             final_position = -1
@@ -5117,18 +6194,20 @@ class nddata (object):
         # this might be sub-optimal, but put the dims to collapse at the end, and move them back later if we want
         new_order = retained_dims + dimstocollapse
         self.reorder(new_order)
-        logger.debug(strm("new order",new_order))
+        logger.debug(lazy_strm("new order",new_order))
         #}}}
         #{{{ then, reshape the data (and error)
-        logger.debug(strm("old shape",self.data.shape))
+        #    -- if the dims to collapse were adjacent and in order, they stay
+        #    contiguous after the transpose above, so this is still a view
+        logger.debug(lazy_strm("old shape",self.data.shape))
         new_shape = list(self.data.shape)[:-len(dimstocollapse)]
-        logger.debug(strm("dimensions to keep",new_shape))
+        logger.debug(lazy_strm("dimensions to keep",new_shape))
         dimstocollapse_shapes = array(self.data.shape[-len(dimstocollapse):])
         new_shape += [dimstocollapse_shapes.prod()]
-        self.data = self.data.reshape(new_shape)
+        self.data = _reshape(self.data,new_shape)
         if self.get_error() is not None:
-            self.set_error(self.get_error().reshape(new_shape))
-        logger.debug(strm("new shape",self.data.shape))
+            self.set_error(_reshape(self.get_error(),new_shape))
+        logger.debug(lazy_strm("new shape",self.data.shape))
         #}}}
         #{{{ now for the tricky part -- deal with the axis labels
         #{{{ in order, make a list of the relevant axis names, dtypes, and sizes
@@ -5142,9 +6221,9 @@ class nddata (object):
                     j in axes_with_labels]# an appropriate spec. for a structured array
             axes_with_labels_size = [self.getaxis(j).size for j in axes_with_labels]
             #}}}
-            logger.debug(strm("the dtype that I want is:",axes_with_labels_dtype))
-            logger.debug(strm("the axes that have labels are:",axes_with_labels))
-            logger.debug(strm("the axes that have labels have sizes:",axes_with_labels_size))
+            logger.debug(lazy_strm("the dtype that I want is:",axes_with_labels_dtype))
+            logger.debug(lazy_strm("the axes that have labels are:",axes_with_labels))
+            logger.debug(lazy_strm("the axes that have labels have sizes:",axes_with_labels_size))
             # {{{ we construct a multidimensional axis
             multidim_axis_error = None
             if len(axes_with_labels_dtype) > 0:
@@ -5157,24 +6236,22 @@ class nddata (object):
                                 self.getaxis(axes_with_labels[j]).dtype)
                                 for j in range(len(axes_with_labels))
                                 if axes_with_labels_haserror[j]])
-                # one at a time index the relevant dimension, and load in the information
-                full_slice = [slice(None,None,None)]*len(axes_with_labels_dtype)
+                # fill each field at once, by broadcasting the axis along
+                # its own dimension
                 for this_index,thisdim in enumerate(axes_with_labels):
-                    axis_for_thisdim = self.getaxis(thisdim)
+                    broadcast_shape = ones(len(axes_with_labels),dtype = int)
+                    broadcast_shape[this_index] = axes_with_labels_size[this_index]
+                    logger.debug(lazy_strm("the axis for",thisdim,"is",self.getaxis(thisdim)))
+                    multidim_axis_label[thisdim][...] = self.getaxis(thisdim).reshape(broadcast_shape)
                     if axes_with_labels_haserror[this_index]:
-                        axis_error_for_thisdim = self.get_error(thisdim)
-                    logger.debug(strm("the axis for",thisdim,"is",axis_for_thisdim))
-                    for j in range(axes_with_labels_size[this_index]):
-                        this_slice = list(full_slice)
-                        this_slice[this_index] = j # set this element
-                        multidim_axis_label[thisdim][tuple(this_slice)] = axis_for_thisdim[j]
-                        if axes_with_labels_haserror[this_index]:
-                            multidim_axis_error[thisdim][tuple(this_slice)] = axis_error_for_thisdim[j]
-                logger.debug(strm("shape of multidim_axis_label is now",multidim_axis_label.shape,"(",axes_with_labels,")"))
-                logger.debug(strm("multidim_axis_label is:\n",repr(multidim_axis_label)))
+                        multidim_axis_error[thisdim][...] = self.get_error(thisdim).reshape(broadcast_shape)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(strm("shape of multidim_axis_label is now",multidim_axis_label.shape,"(",axes_with_labels,")"))
+                    logger.debug(strm("multidim_axis_label is:\n",repr(multidim_axis_label)))
                 multidim_axis_label = multidim_axis_label.flatten() # then flatten the axis
-                logger.debug(strm("shape of multidim_axis_label is now",multidim_axis_label.shape))
-                logger.debug(strm("multidim_axis_label is:\n",repr(multidim_axis_label)))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(strm("shape of multidim_axis_label is now",multidim_axis_label.shape))
+                    logger.debug(strm("multidim_axis_label is:\n",repr(multidim_axis_label)))
             # }}}
         #{{{ update axis dictionary with the new info
         if noaxis:
@@ -5183,17 +6260,17 @@ class nddata (object):
         else:
             axis_coords_dict[dimname] = multidim_axis_label
             axis_coords_error_dict[dimname] = multidim_axis_error
-        logger.debug(strm("end up with axis_coords_dict (%d)"%len(axis_coords_dict),axis_coords_dict))
-        logger.debug(strm("end up with axis_coords_error_dict (%d)"%len(axis_coords_error_dict),axis_coords_error_dict))
+        logger.debug(lazy_strm("end up with axis_coords_dict (%d)"%len(axis_coords_dict),axis_coords_dict))
+        logger.debug(lazy_strm("end up with axis_coords_error_dict (%d)"%len(axis_coords_error_dict),axis_coords_error_dict))
         #}}}
         #}}}
         #{{{ make new dimlabels, and where relevant, project the new dictionary onto these dimlabels
         self.dimlabels = retained_dims + [dimname]
-        logger.debug(strm("end up with dimlabels",self.dimlabels,"and shape",self.data.shape))
+        logger.debug(lazy_strm("end up with dimlabels",self.dimlabels,"and shape",self.data.shape))
         self.axis_coords = self.fld(axis_coords_dict)
         self.axis_coords_error = self.fld(axis_coords_error_dict)
-        logger.debug(strm("new axis coords (%d)"%len(self.axis_coords),self.axis_coords))
-        logger.debug(strm("new axis coords errors (%d)"%len(self.axis_coords_error),self.axis_coords_error))
+        logger.debug(lazy_strm("new axis coords (%d)"%len(self.axis_coords),self.axis_coords))
+        logger.debug(lazy_strm("new axis coords errors (%d)"%len(self.axis_coords_error),self.axis_coords_error))
         #}}}
         #{{{ then deal with the units
         #}}}
@@ -5219,13 +6296,13 @@ class nddata (object):
         elif len(otherargs) == 1:
             if type(otherargs[0]) is list:
                 axesout = otherargs[0]
-                shapesout = ndshape(self)[axisin]**(1./len(axesout))
+                shapesout = self.axlen(axisin)**(1./len(axesout))
                 if abs(shapesout-round(shapesout)) > 1e-15: # there is some kind of roundoff error here
                     raise ValueError('''In order for chunk to be called with
                             only a list of axes, the shape of the dimension you are
                             trying to split (here %s) must be an Nth root of
                             the original dimension size (here: %d), where N (here
-                            %d) is the number of dimensions you are trying to chunk into'''%(axisin,ndshape(self)[axisin],len(axesout)))
+                            %d) is the number of dimensions you are trying to chunk into'''%(axisin,self.axlen(axisin),len(axesout)))
                 else:
                     shapesout = round(shapesout)
                 shapesout = [shapesout] * len(axesout)
@@ -5238,11 +6315,11 @@ class nddata (object):
         if any([j == -1 for j in shapesout]):
             j = shapesout.index(-1)
             if j < len(shapesout)-1:
-                shapesout[j] = int(round(ndshape(self)[axisin]/prod(r_[shapesout[0:j],shapesout[j+1:]])))
+                shapesout[j] = int(round(self.axlen(axisin)/prod(r_[shapesout[0:j],shapesout[j+1:]])))
             else:
-                shapesout[j] = int(round(ndshape(self)[axisin]/prod(shapesout[0:j])))
-        if prod(shapesout) != ndshape(self)[axisin]:
-            raise ValueError("The size of the axis (%s) you're trying to split (%s) doesn't match the size of the axes you're trying to split it into (%s = %s)"%(repr(axisin),repr(ndshape(self)[axisin]),repr(axesout),repr(shapesout)))
+                shapesout[j] = int(round(self.axlen(axisin)/prod(shapesout[0:j])))
+        if prod(shapesout) != self.axlen(axisin):
+            raise ValueError("The size of the axis (%s) you're trying to split (%s) doesn't match the size of the axes you're trying to split it into (%s = %s)"%(repr(axisin),repr(self.axlen(axisin)),repr(axesout),repr(shapesout)))
         thisaxis = self.axn(axisin)
         if self.getaxis(axisin) is not None and len(self.getaxis(axisin)) > 0:
             raise ValueError("You cannot chunk data with labels! Try 'chunk_by' instead!")
@@ -5266,7 +6343,7 @@ class nddata (object):
         newshape = list(self.data.shape[0:thisaxis]) + shapesout + list(self.data.shape[thisaxis+1:])
         newshape = map(int,newshape)
         newnames = list(self.dimlabels[0:thisaxis]) + axesout + list(self.dimlabels[thisaxis+1:])
-        self.data = self.data.reshape(newshape)
+        self.data = _reshape(self.data,newshape)
         self.dimlabels = newnames
         return self
     def chunkoff(self,axisin,newaxes,newshapes):
@@ -5276,7 +6353,7 @@ class nddata (object):
         the names `newaxes` with `newshapes`.  If the shape of the
         data allows, retain `axisin` as the "outer" dimension.'''
         axesout = [axisin]+newaxes
-        shapesout = [ndshape(self)[axisin]/prod(newshapes)]+newshapes
+        shapesout = [self.axlen(axisin)/prod(newshapes)]+newshapes
         return self.chunk(axisin,axesout,shapesout)
     def chunk_auto(self,axis_name,which_field,verbose = False,dimname = None):
         r'''assuming that axis "axis_name" is currently labeled with a structured array, choose one field ("which_field") of that structured array to generate a new dimension
@@ -5398,7 +6475,7 @@ class nddata (object):
         #print "DEBUG: types of args",map(type,args)
         A = args[0]
         if type(A) is nddata:
-            _,B = self.aligndata(A)
+            _,B = self.aligndata(A,views = True)
             A = B.data # now the next part will handle this
         if type(A) is ndarray:# if selector is an ndarray
             if A.dtype is not dtype('bool'):
@@ -5551,6 +6628,21 @@ class nddata (object):
             # }}}
             retval.other_info = deepcopy(self.other_info)
             return retval
+    def _copy_sharing_data(self,*shared):
+        r"""Return a copy (of the same class) whose metadata is independent of
+        this instance, but whose `data` and `data_error` (and any other
+        attributes named in `shared`) are the *same* objects -- so, the
+        result can be transposed and reshaped (or have its data replaced)
+        freely, but not modified in place.
+
+        `self` is left alone -- the shared attributes are entered in the
+        `deepcopy` memo, which then hands them back rather than copying
+        them."""
+        memo = {}
+        for j in ('data','data_error')+shared:
+            thisattr = getattr(self,j)
+            memo[id(thisattr)] = thisattr
+        return deepcopy(self,memo)
     def __getitem__(self,args):
         if type(args) is type(emptyfunction):
             #{{{ just a lambda function operates on the data
@@ -5578,7 +6670,7 @@ class nddata (object):
                     raise ValueError("To index with an nddata, you must have only one dimension")
                 else:
                     self.setaxis(nonsingleton[0],self.getaxis(nonsingleton[0])[A.data.flatten()])
-                _,B = self.aligndata(A)
+                _,B = self.aligndata(A,views = True)
                 A = B.data # now the next part will handle this
                 if A.dtype is not dtype('bool'):
                     raise ValueError("I don't know what to do with an ndarray subscript that has dtype "+repr(A.dtype))
@@ -5975,7 +7067,7 @@ class nddata_hdf5 (nddata):
         if 'axes' in datadict.keys():
             myaxiscoords = [None]*len(mydimlabels)
             myaxiscoordserror = [None]*len(mydimlabels)
-            logger.info(strm("about to read out the various axes:",datadict['axes'].keys()))
+            logger.info(lazy_strm("about to read out the various axes:",datadict['axes'].keys()))
             for axisname in datadict['axes'].keys():
                 try:
                     axisnumber = mydimlabels.index(axisname)
@@ -5988,7 +7080,7 @@ class nddata_hdf5 (nddata):
                     myaxiscoordserror[axisnumber] = recordarrayofaxis['error']
                 datadict['axes'][axisname].pop('data')
                 for k in datadict['axes'][axisname].keys():
-                    logger.debug(strm("Warning, attribute",k,"of axis table",axisname,"remains, but the code to load this is not yet supported"))
+                    logger.debug(lazy_strm("Warning, attribute",k,"of axis table",axisname,"remains, but the code to load this is not yet supported"))
                 datadict['axes'].pop(axisname)
             kwargs.update({"axis_coords":myaxiscoords})
             kwargs.update({"axis_coords_error":myaxiscoordserror})
@@ -5999,7 +7091,7 @@ class nddata_hdf5 (nddata):
                     "data!!")
             # the reshaping this refers to is done below
         #}}}
-        logger.info(strm("about to initialize data with shape",mydata.shape,"labels",mydimlabels,"and kwargs",kwargs))
+        logger.info(lazy_strm("about to initialize data with shape",mydata.shape,"labels",mydimlabels,"and kwargs",kwargs))
         nddata.__init__(self,
                 mydata,
                 mydata.shape,
@@ -6328,6 +7420,10 @@ class fitdata(nddata):
         self.function_string = sympy.latex(self.symbolic_func).replace('$','')
         self.function_string = r'$' + self.function_name + '=' + self.function_string + r'$'
         return self
+    def _copy_sharing_data(self):
+        # like copy, share the symbolic attributes
+        return nddata._copy_sharing_data(self,
+                *[j for j in dir(self) if self._contains_symbolic(j)])
     def copy(self): # for some reason, if I don't override this with the same thing, it doesn't override
         namelist = []
         vallist = []
@@ -6830,7 +7926,7 @@ class fitdata(nddata):
 def sqrt(arg):
     if isinstance(arg,nddata):
         return arg**0.5
-    elif isinstance(arg,sympy.symbol.Symbol):
+    elif _module_imported('sympy') and isinstance(arg,sympy.symbol.Symbol):
         return sympy.sqrt(arg)
     else:
         return np_sqrt(arg)
@@ -6,6 +6,7 @@ This is controlled by the ``~/.pyspecdata`` or ``~/_pyspecdata`` config file.
 import os
 import ConfigParser
 import platform
+import json
 from .general_functions import process_kwargs, strm
 import logging
 logger = logging.getLogger('pyspecdata.datadir')
@@ -239,3 +240,40 @@ def getDATADIR(*args,**kwargs):
     if len(retval[-1]) != 0:
         retval = retval + ('',)
     return os.path.join(*retval)
+#{{{ record the data files that a script opens
+#    used by :mod:`pyspecdata.latexscripts` so that the cached output of
+#    a script is invalidated when one of its data files changes
+_inputs_record_environ = 'PYSPECDATA_INPUTS_RECORD'
+def _file_fingerprint(path):
+    r'''Return a (JSON-serializable) fingerprint of the file or directory
+    `path` -- its size and modification time, or, for a directory (*e.g.* a
+    Bruker dataset), the number of files, their total size, and the latest
+    modification time of anything inside it.
+    Returns None if `path` doesn't exist.'''
+    if not os.path.exists(path):
+        return None
+    if not os.path.isdir(path):
+        thisstat = os.stat(path)
+        return [thisstat.st_size,thisstat.st_mtime]
+    n_files,total_size,latest = 0,0,os.stat(path).st_mtime
+    for dirpath,dirnames,filenames in os.walk(path):
+        latest = max(latest,os.stat(dirpath).st_mtime)
+        for j in filenames:
+            thisstat = os.stat(os.path.join(dirpath,j))
+            n_files += 1
+            total_size += thisstat.st_size
+            latest = max(latest,thisstat.st_mtime)
+    return [n_files,total_size,latest]
+def _record_input_file(path):
+    r'''If the ``PYSPECDATA_INPUTS_RECORD`` environment variable is set,
+    append the absolute path and fingerprint of `path` (as a line of JSON)
+    to the file it names.'''
+    record_fname = os.environ.get(_inputs_record_environ,'')
+    if record_fname == '':
+        return
+    path = os.path.abspath(path)
+    logger.debug(strm("recording",path,"as an input"))
+    with open(record_fname,'a') as fp:
+        fp.write(json.dumps([path,_file_fingerprint(path)])+'\n')
+    return
+#}}}
@@ -7,6 +7,7 @@ python code is embedded in a python environment inside latex.
 import matplotlib; matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from .core import *
+from .core import _plot_linecollection
 from string import rstrip
 from scipy.io import savemat,loadmat
 from os.path import exists as path_exists
@@ -16,6 +17,17 @@ from scipy.signal import fftconvolve
 from datetime import datetime
 from time import mktime
 from PIL import Image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.axes import Axes
+from matplotlib.collections import Collection
+from matplotlib.image import AxesImage
+from matplotlib.patches import Patch
+from matplotlib.text import Text
+import multiprocessing
+import cPickle as pickle
+import hashlib
+import os
+import tempfile
 import re
 
 golden_ratio = (1.0 + sqrt(5))/2.0
@@ -52,12 +64,21 @@ class figlistl (figlist):
         ----------
         line_spacing : bool
             if false, suppress empty lines between output
+        processes : int
+            if greater than 1, pad and save the (matplotlib) figures in a
+            pool of this many worker processes (see :func:`lplot`).
+            The LaTeX is still output in the order of the figure list.
+            Defaults to the ``render_processes`` attribute, if it's set, and
+            otherwise to 1 (save the figures one at a time).
         '''
         self.basename = None # must be turned off, so it can cycle through lists, etc, on its own
         #{{{ process kwargs
         verbose = False
         if 'verbose' in kwargs.keys():
             verbose = kwargs.pop('verbose')
+        processes = getattr(self,'render_processes',1)
+        if 'processes' in kwargs.keys():
+            processes = kwargs.pop('processes')
         #}}}
         if line_spacing: print '\n\n'
         self.show_prep()
@@ -69,6 +90,10 @@ class figlistl (figlist):
                 mlab = True
         if hasattr(self,'lplot_kwargs'):
             kwargs.update(self.lplot_kwargs)
+        pool = None
+        pending = []
+        if processes > 1 and os_name == 'posix' and self.env != 'test':
+            pool = multiprocessing.Pool(processes)
         for figname in self.figurelist:
             if verbose: print "showing figure"+lsafen(figname)
             if type(figname) is dict:
@@ -99,7 +124,15 @@ class figlistl (figlist):
                     else:
                         if figname in self.twinx_list.keys():
                             kwargs.update(autopad = False)# because the autopad is done manually, since it freaks out with twinx
-                        lplot(figname.replace('.','_')+sep+string,**kwargs)
+                        pending.append(lplot(figname.replace('.','_')+sep+string,pool = pool,**kwargs))
+        if pool is not None:
+            pool.close()
+            try:
+                for j in pending:
+                    if j is not None:
+                        j.get() # re-raises any errors from the workers
+            finally:
+                pool.terminate()
         while len(self.figurelist) > 0:
             self.figurelist.pop(-1)
         return
@@ -349,18 +382,197 @@ def lrecordarray(recordlist,columnformat = True,smoosh = True,multi = True,resiz
     else:
         retval += '\n'.join(final_retval)
         return retval
+def _save_figure(fig,fname,alsosave,dpi,autopad,centered,boundaries):
+    "pad and save the (matplotlib) figure `fig` -- this does the slow part of :func:`lplot`"
+    if autopad:
+        autopad_figure(centered = centered,figname = fname,fig = fig)
+    # replaced outer_legend with appropriate modification to the "legend" option of figlist.show_prep(), same with legend option
+    if not boundaries:
+        ax = fig.gca()
+        for j in ax.spines.keys():
+            ax.spines[j].set_visible(False)
+        setp(ax.get_xticklabels(),visible = False)
+        setp(ax.get_yticklabels(),visible = False)
+        setp(ax.get_xticklines(),visible = False)
+        setp(ax.get_yticklines(),visible = False)
+        this_xlabel = ax.get_xlabel()
+        if len(this_xlabel) > 0:
+            ax.set_xlabel(this_xlabel + r" $\rightarrow$")
+        this_ylabel = ax.get_ylabel()
+        if len(this_ylabel) > 0:
+            ax.set_ylabel(this_ylabel + r" $\rightarrow$")
+    try:
+        fig.savefig(fname, dpi=dpi,
+                facecolor=(1,1,1,0),
+                bbox_inches='tight')
+    except ValueError as exc_string:
+        if str(exc_string).find('finite numbers') > -1:
+            raise ValueError("It gives this error because you're trying to do a bar graph with zero width")
+        else:
+            raise ValueError(exc_string)
+    except IOError as e:
+        raise IOError("This is giving an IOError -- check that you haven't maybe changed directories" + os.getcwd().replace('\\','/'))
+    if alsosave != None:
+        fig.savefig(alsosave,
+                dpi=dpi,
+                facecolor=(1,1,1,0))
+    return
+def _save_pickled_figure(pickled_fig,*args):
+    "run :func:`_save_figure` in a worker process, on a figure pickled by :func:`lplot`"
+    fig = pickle.loads(pickled_fig)
+    FigureCanvasAgg(fig) # give it a canvas that can render off-screen
+    try:
+        _save_figure(fig,*args)
+    finally:
+        plt.close(fig)
+    return args[0]
+#{{{ content-hash cache of the saved figures
+#    next to each file in auto_figures, a sidecar file holds a hash of the
+#    figure (its artists, their data, and the options used to save it) that
+#    was last saved there, so that unchanged figures aren't drawn and saved
+#    again -- one file per figure, so that scripts running in parallel
+#    processes never write the same file
+figure_cache = True # set to False to always save the figures
+_figure_hash_suffix = '.hash'
+def _hash_update(h,value):
+    "add `value` (an array, or anything with a stable repr) to the hash object `h`"
+    if isinstance(value,ndarray) or isinstance(value,ma.MaskedArray):
+        value = ma.getdata(value)
+        h.update(repr((value.dtype.str,value.shape)))
+        h.update(ascontiguousarray(value).tostring())
+    else:
+        h.update(repr(value))
+def _tick_labels(formatter,locs):
+    "the labels that `formatter` gives the ticks at `locs` (as they're formatted when the figure is drawn)"
+    if hasattr(formatter,'format_ticks'):
+        return formatter.format_ticks(locs)
+    formatter.set_locs(locs)
+    return [formatter(x,j) for j,x in enumerate(locs)]
+def _figure_hash(fig,save_args):
+    """return a hash of everything that determines what `fig` looks like
+    when saved with `save_args` -- *i.e.* the type, data, style, and
+    transform of each artist, and the ticks of each axis.
+    The tick labels (and the colors of collections that are colormapped)
+    aren't filled in until the figure is drawn, so the locators,
+    formatters, and colormapped arrays are hashed instead."""
+    h = hashlib.md5()
+    _hash_update(h,(matplotlib.__version__,save_args,
+        tuple(fig.get_size_inches()),fig.get_dpi()))
+    for thisartist in fig.findobj():
+        _hash_update(h,(type(thisartist).__name__,thisartist.get_visible(),
+            thisartist.get_zorder(),thisartist.get_alpha()))
+        _hash_update(h,thisartist.get_transform().get_affine().get_matrix())
+        if isinstance(thisartist,Axes):
+            _hash_update(h,(tuple(thisartist.get_position().bounds),
+                thisartist.get_xlim(),thisartist.get_ylim(),
+                thisartist.get_xscale(),thisartist.get_yscale()))
+            for thisaxis in [thisartist.xaxis,thisartist.yaxis]:
+                for locator,formatter,locs in [
+                        (thisaxis.get_major_locator(),thisaxis.get_major_formatter(),
+                            thisaxis.get_majorticklocs()),
+                        (thisaxis.get_minor_locator(),thisaxis.get_minor_formatter(),
+                            thisaxis.get_minorticklocs())]:
+                    _hash_update(h,(type(locator).__name__,type(formatter).__name__))
+                    _hash_update(h,asarray(locs))
+                    _hash_update(h,_tick_labels(formatter,locs))
+                _hash_update(h,thisaxis.get_major_formatter().get_offset())
+        elif isinstance(thisartist,Line2D):
+            _hash_update(h,thisartist.get_xydata())
+            _hash_update(h,(thisartist.get_color(),thisartist.get_linestyle(),
+                thisartist.get_linewidth(),thisartist.get_marker(),
+                thisartist.get_markersize(),thisartist.get_markerfacecolor(),
+                thisartist.get_markeredgecolor(),thisartist.get_label()))
+        elif isinstance(thisartist,Text):
+            _hash_update(h,(thisartist.get_text(),thisartist.get_position(),
+                thisartist.get_color(),thisartist.get_fontsize(),
+                thisartist.get_rotation(),thisartist.get_ha(),
+                thisartist.get_va()))
+        elif isinstance(thisartist,AxesImage):
+            _hash_update(h,thisartist.get_array())
+            _hash_update(h,(thisartist.get_extent(),thisartist.get_cmap().name,
+                thisartist.get_clim(),thisartist.get_interpolation()))
+        elif isinstance(thisartist,Collection):
+            _hash_update(h,thisartist.get_offsets())
+            for thispath in thisartist.get_paths():
+                _hash_update(h,thispath.vertices)
+            _hash_update(h,thisartist.get_facecolor())
+            _hash_update(h,thisartist.get_edgecolor())
+            _hash_update(h,thisartist.get_linewidth())
+            _hash_update(h,thisartist.get_offset_transform().get_affine().get_matrix())
+            for thistransform in thisartist.get_transforms(): # e.g. the marker sizes of scatter
+                _hash_update(h,thistransform)
+            if thisartist.get_array() is not None: # colormapped, so the colors are set when it's drawn
+                _hash_update(h,thisartist.get_array())
+                _hash_update(h,(thisartist.get_cmap().name,thisartist.get_clim()))
+        elif isinstance(thisartist,Patch):
+            _hash_update(h,thisartist.get_path().vertices)
+            _hash_update(h,thisartist.get_patch_transform().get_matrix())
+            _hash_update(h,(tuple(thisartist.get_facecolor()),
+                tuple(thisartist.get_edgecolor()),thisartist.get_linewidth(),
+                thisartist.get_fill()))
+    return h.hexdigest()
+def _load_figure_hash(fname):
+    "the hash recorded for `fname`, or None"
+    try:
+        with open(fname+_figure_hash_suffix) as fp:
+            return fp.read().strip()
+    except IOError:
+        return None
+def _figure_is_cached(fname,alsosave,thishash):
+    "True if `fname` (and `alsosave`) exist and were saved from a figure with `thishash`"
+    if not figure_cache:
+        return False
+    for j in [fname,alsosave]:
+        if j is not None and not path_exists(j):
+            return False
+    return _load_figure_hash(fname) == thishash
+def _record_figure_hash(fname,thishash):
+    "record that `fname` was saved from a figure with `thishash`"
+    if not figure_cache:
+        return
+    # write a temporary file in the same directory, and rename it into
+    # place, so that a reader never sees a half-written hash
+    fd,tempname = tempfile.mkstemp(suffix = _figure_hash_suffix,
+            prefix = os.path.basename(fname)+'.',
+            dir = os.path.dirname(fname) or '.')
+    try:
+        with os.fdopen(fd,'w') as fp:
+            fp.write(thishash+'\n')
+        if os_name != 'posix' and path_exists(fname+_figure_hash_suffix):
+            os.remove(fname+_figure_hash_suffix) # windows can't rename over an existing file
+        os.rename(tempname,fname+_figure_hash_suffix)
+    except:
+        if path_exists(tempname):
+            os.remove(tempname)
+        raise
+#}}}
 def lplot(fname, width=0.33, figure=False, dpi=72, grid=False,
         alsosave=None, gensvg=False, print_string=None, centered=False,
         equal_aspect=False, autopad=True, bytextwidth=None,
         showbox=True, boundaries=True, genpng=False, mlab=False,
-        fig=None, verbose=False):
+        fig=None, verbose=False, pool=None):
     '''
     used with python.sty instead of savefig
     
     by default, if width is less than 1, 
     it's interpreted as bytextwidth = True (i.e. width given as a fraction of the linewidth)
     if it's greater than, the width is interpreted in inches.
+
+    A hash of the (matplotlib) figure -- its artists, their data, and the
+    options that determine how it's saved -- is recorded in a ``.hash`` file
+    next to the figure (*e.g.* ``auto_figures/name.pdf.hash``), and if the
+    file for an identical
+    figure already exists, it isn't drawn and saved again.
+    Set ``pyspecdata.fornotebook.figure_cache = False`` to turn this off.
+
+    If `pool` (a :class:`multiprocessing.Pool`) is given, the (matplotlib)
+    figure is pickled and padded/saved by one of the workers of the pool,
+    and the corresponding ``AsyncResult`` is returned -- the LaTeX is still
+    printed immediately, so the order of the output doesn't depend on
+    which figure finishes first.
+    Otherwise, this returns None.
     '''
+    retval = None
     if width <= 1.0:
         bytextwidth = True
     else:
@@ -432,38 +644,19 @@ def lplot(fname, width=0.33, figure=False, dpi=72, grid=False,
         if equal_aspect:
             ax.set_aspect('equal')
         fig.autofmt_xdate()
-        if autopad:
-            autopad_figure(centered = centered,figname = fname)
-    # replaced outer_legend with appropriate modification to the "legend" option of figlist.show_prep(), same with legend option
-        if not boundaries:
-            ax = gca()
-            for j in ax.spines.keys():
-                ax.spines[j].set_visible(False)
-            setp(ax.get_xticklabels(),visible = False)
-            setp(ax.get_yticklabels(),visible = False)
-            setp(ax.get_xticklines(),visible = False)
-            setp(ax.get_yticklines(),visible = False)
-            this_xlabel = ax.get_xlabel()
-            if len(this_xlabel) > 0:
-                ax.set_xlabel(this_xlabel + r" $\rightarrow$")
-            this_ylabel = ax.get_ylabel()
-            if len(this_ylabel) > 0:
-                ax.set_ylabel(this_ylabel + r" $\rightarrow$")
-        try:
-            savefig(fname, dpi=dpi,
-                    facecolor=(1,1,1,0),
-                    bbox_inches='tight')
-        except ValueError as exc_string:
-            if exc_string.find('finite numbers') > -1:
-                raise ValueError("It gives this error because you're trying to do a bar graph with zero width")
-            else:
-                raise ValueError(exc_string)
-        except IOError as e:
-            raise IOError("This is giving an IOError -- check that you haven't maybe changed directories" + os.getcwd().replace('\\','/'))
-        if alsosave != None:
-            savefig(alsosave,
-                    dpi=dpi,
-                    facecolor=(1,1,1,0))
+        save_args = (fname,alsosave,dpi,autopad,centered,boundaries)
+        thishash = _figure_hash(fig,save_args)
+        if _figure_is_cached(fname,alsosave,thishash):
+            if verbose: print "figure",fname,"is unchanged -- not saving it again"
+        elif pool is None:
+            _save_figure(fig,*save_args)
+            _record_figure_hash(fname,thishash)
+        else:
+            # pickle now, since the figure is cleared below, and the pool
+            # only pickles its arguments once a worker is free
+            retval = pool.apply_async(_save_pickled_figure,
+                    (pickle.dumps(fig,pickle.HIGHEST_PROTOCOL),)+save_args,
+                    callback = lambda x: _record_figure_hash(x,thishash))
     if figure:
         print r"""
         \begin{figure}[h]
@@ -490,7 +683,7 @@ def lplot(fname, width=0.33, figure=False, dpi=72, grid=False,
         print r'''\end{minipage}
 }''',
     clf()
-    return
+    return retval
 def ordplot(x,y,labels,formatstring):
         order = argsort(x)
         plot(x[order],y[order],'o-')
@@ -652,86 +845,39 @@ def esr_saturation(file,powerseries,smoothing=0.2,threshold=0.8,figname = None,h
     data = load_indiv_file(file,dimname='power')
     #plot(data,'.-')
     x = data.getaxis('$B_0$').flatten()
-    k = exp(-(x-x.mean())**2/2./smoothing**2)
     nslices = ndshape(data)['power']
-    allpeaks_top = []
-    allpeaks_bottom = []
-    allpeaks_top_x = []
-    allpeaks_bottom_x = []
     imageformat = False
-    for j in range(0,nslices):
-        #{{{ make a smoothed version of this slice
-        thisslice = data['power',j].data.flatten()
-        #curvature = diff(fftconvolve(thisslice,k,mode='same'),n=2)
-        smoothed = fftconvolve(thisslice,k,mode='same') # I need this, so the noise doesn't break up my blocks
-        #}}}
-        #{{{ make lists to put the peaks in
-        top_peak_x = []
-        bottom_peak_x = []
-        top_peak = []
-        bottom_peak = []
-        #}}}
-        minind = 1
-        #{{{ find the peaks for the segments above threshold
-        peakmask = whereblocks(smoothed>smoothed.max()*threshold)
-        indeces = r_[0:len(thisslice)]
-        for peakset in peakmask: # peakset gives the indeces for a given slice
-            if len(peakset)>minind:
-                peak_ind = peakset[argmax(thisslice[peakset])]
-                top_peak_x += [x[peak_ind]]
-                top_peak += [thisslice[peak_ind]]
-        #}}}
-        #{{{ find the peaks for the segments below lower threshold
-        peakmask = whereblocks(smoothed<smoothed.min()*threshold)
-        for peakset in peakmask:
-            if len(peakset)>minind:
-                peak_ind = peakset[argmin(thisslice[peakset])]
-                bottom_peak_x += [x[peak_ind]]
-                bottom_peak += [thisslice[peak_ind]]
-        #}}}
-        if (not imageformat):
-            plot(x,thisslice,color=cm.hsv(double(j)/double(nslices)),alpha=0.5)
-            plot(bottom_peak_x,bottom_peak,'o',color=cm.hsv(double(j)/double(nslices)),alpha=0.5)
-            plot(top_peak_x,top_peak,'o',color=cm.hsv(double(j)/double(nslices)),alpha=0.5)
-        allpeaks_top += [top_peak]
-        allpeaks_top_x += [top_peak_x]
-        allpeaks_bottom += [bottom_peak]
-        allpeaks_bottom_x += [bottom_peak_x]
-    num_peaks = len(allpeaks_top_x[0])
-    try:
-        allpeaks_top_x = nddata(allpeaks_top_x,[nslices,num_peaks],['power','peak']).reorder(['power','peak'])
-    except:
-        print r'\begin{verbatim} If you have an error here, probably change smoothing (%0.2f) or threshold (%0.2f)\end{verbatim}'%(smoothing,threshold),'\n\n'
-        clf()
-        for j in range(0,nslices):
-            thisslice = data['power',j].data
-            #curvature = diff(fftconvolve(thisslice,k,mode='same'),n=2)
-            smoothed = fftconvolve(thisslice,k,mode='same') # I need this, so the noise doesn't break up my blocks
-            plot(x,smoothed,alpha=0.1)
-            peakmask = whereblocks(smoothed>smoothed.max()*threshold)
-            for peakset in peakmask:
-                plot(x[peakset],smoothed[peakset])
-        lplot('error_plot'+figname+'.png',width=6)
-        print r'lengths: ',map(len,allpeaks_top_x),''
-        return
-    try:
-        allpeaks_bottom_x = nddata(allpeaks_bottom_x,[nslices,num_peaks],['power','peak']).reorder(['power','peak'])
-    except:
-        print r'\begin{verbatim} If you have an error here, probably change smoothing (%0.2f) or threshold (%0.2f)\end{verbatim}'%(smoothing,threshold),'\n\n'
-        clf()
-        for j in range(0,nslices):
-            thisslice = data['power',j].data
-            #curvature = diff(fftconvolve(thisslice,k,mode='same'),n=2)
-            smoothed = fftconvolve(thisslice,k,mode='same') # I need this, so the noise doesn't break up my blocks
-            plot(x,smoothed,alpha=0.1)
-            peakmask = whereblocks(smoothed<smoothed.min()*threshold)
-            for peakset in peakmask:
-                plot(x[peakset],smoothed[peakset])
-        lplot('error_plot'+figname+'.png',width=6)
-        print r'\begin{verbatim}lengths: ',map(len,allpeaks_top_x),'\end{verbatim}'
-        return
-    allpeaks_top = nddata(allpeaks_top,[nslices,num_peaks],['power','peak']).reorder(['power','peak'])
-    allpeaks_bottom = nddata(allpeaks_bottom,[nslices,num_peaks],['power','peak']).reorder(['power','peak'])
+    #{{{ find the peaks for the segments above threshold and below the lower threshold, for all the slices at once
+    #    -- the smoothing is so that the noise doesn't break up the blocks
+    data.reorder('$B_0$',first = False)
+    allpeaks_top_x,allpeaks_top = data.find_peaks('$B_0$',smoothing = smoothing,threshold = threshold,find = 'max')
+    allpeaks_bottom_x,allpeaks_bottom = data.find_peaks('$B_0$',smoothing = smoothing,threshold = threshold,find = 'min')
+    #}}}
+    if (not imageformat):
+        ax = gca()
+        _plot_linecollection(ax,x,data.data.T,{'alpha':0.5})
+        peak_x = c_[allpeaks_bottom_x.data,allpeaks_top_x.data]
+        ax.scatter(peak_x.ravel(),c_[allpeaks_bottom.data,allpeaks_top.data].ravel(),
+                c = cm.hsv(repeat(r_[0:nslices]/double(nslices),peak_x.shape[1])),
+                alpha = 0.5,edgecolors = 'none')
+    for thispeaks_x,thisrelation in [(allpeaks_top_x,greater),(allpeaks_bottom_x,less)]:
+        lengths = (~isnan(thispeaks_x.data)).sum(axis = -1)
+        if any(lengths != lengths[0]):
+            print r'\begin{verbatim} If you have an error here, probably change smoothing (%0.2f) or threshold (%0.2f)\end{verbatim}'%(smoothing,threshold),'\n\n'
+            clf()
+            #{{{ show the smoothed data, and highlight the blocks beyond the threshold
+            smoothed = data.copy().convolve('$B_0$',smoothing).data
+            if thisrelation is greater:
+                mask = smoothed > smoothed.max(axis = -1)[:,newaxis]*threshold
+            else:
+                mask = smoothed < smoothed.min(axis = -1)[:,newaxis]*threshold
+            ax = gca()
+            _plot_linecollection(ax,x,smoothed.T,{'alpha':0.1})
+            _plot_linecollection(ax,x,where(mask,smoothed,nan).T,{})
+            #}}}
+            lplot('error_plot'+figname+'.png',width=6)
+            print r'\begin{verbatim}lengths: ',list(lengths),'\end{verbatim}'
+            return
     if imageformat:
         image(data.data,x=x,y=r_[0:len(powerseries)])
         plot(r_[0:len(powerseries)],allpeaks_top_x.data)
@@ -1,8 +1,100 @@
-from pylab import * 
+from ..general_functions import *
+from pylab import *
 
-def convolve(self,axisname,filterwidth,convfunc = (lambda x,y: exp(-(x**2)/(2.0*(y**2))))):
+logger = logging.getLogger('pyspecdata.fourier.convolve')
+#{{{ cache of the (normalized) kernels and their spectra
+#    keyed by (axis name, axis length, axis coordinates, filterwidth, convfunc)
+#    -- each entry holds the kernel and a dictionary of spectra keyed by
+#    (fft length, real or complex)
+_kernel_cache = {}
+_kernel_cache_order = []
+_kernel_cache_size = 32
+_direct_max_taps = 16 # kernels with this many or fewer nonzero taps are applied directly
+_support_tolerance = 1e-12 # taps smaller than this (relative to the largest) are dropped when determining the support
+def _cached_kernel(axisname,x,filterwidth,convfunc):
+    "return the cache entry for this kernel, generating it if needed"
+    thiskey = (axisname,len(x),x.tostring(),filterwidth,convfunc)
+    try:
+        retval = _kernel_cache[thiskey]
+        _kernel_cache_order.remove(thiskey)
+        _kernel_cache_order.append(thiskey)
+        logger.debug("using cached convolution kernel")
+        return retval
+    except KeyError:
+        pass
+    #{{{ make a version of x that is oriented along the correct dimension
+    x = x.copy()
+    x_centerpoint = (x[-1]+x[0])/2
+    x -= x_centerpoint # so that zero is in the center
+    x = ifftshift(x) # so that it's convolved about time 0
+    #}}}
+    myfilter = convfunc(x,filterwidth)
+    myfilter = myfilter / myfilter.sum()
+    if iscomplexobj(myfilter) and all(myfilter.imag == 0):
+        myfilter = myfilter.real
+    #{{{ determine the support in terms of signed offsets
+    n = len(myfilter)
+    taps = flatnonzero(abs(myfilter) > abs(myfilter).max()*_support_tolerance)
+    offsets = where(taps < (n+1)//2, taps, taps-n)
+    #}}}
+    retval = {'filter':myfilter,
+            'taps':taps,
+            'offsets':offsets,
+            'spectra':{}}
+    _kernel_cache[thiskey] = retval
+    _kernel_cache_order.append(thiskey)
+    while len(_kernel_cache_order) > _kernel_cache_size:
+        del _kernel_cache[_kernel_cache_order.pop(0)]
+    return retval
+def _kernel_spectrum(kernel,h,nfft,use_rfft):
+    "return (and cache) the spectrum of the (linear) kernel `h` zero-filled to `nfft`"
+    thiskey = (len(h),nfft,use_rfft)
+    if thiskey not in kernel['spectra']:
+        if use_rfft:
+            kernel['spectra'][thiskey] = rfft(h,nfft)
+        else:
+            kernel['spectra'][thiskey] = fft(h,nfft)
+    return kernel['spectra'][thiskey]
+#}}}
+#{{{ the different engines -- all of these operate along the last axis
+def _convolve_direct(data,kernel,result_dtype):
+    "sum shifted copies of the data for each nonzero tap"
+    retval = zeros(data.shape,dtype = result_dtype)
+    for j,thisoffset in zip(kernel['taps'],kernel['offsets']):
+        retval += kernel['filter'][j] * roll(data,thisoffset,axis = -1)
+    return retval
+def _convolve_fft(data,kernel,use_rfft):
+    "circular convolution with a single (r)fft of the full axis"
+    n = data.shape[-1]
+    H = _kernel_spectrum(kernel,kernel['filter'],n,use_rfft)
+    if use_rfft:
+        return irfft(rfft(data,axis = -1)*H,n,axis = -1)
+    else:
+        return ifft(fft(data,axis = -1)*H,axis = -1)
+def _convolve_overlap_add(data,kernel,use_rfft,result_dtype):
+    """circular convolution by overlap-add of short blocks -- the data
+    is wrapped around by the support of the kernel, so that the result
+    matches that of :func:`_convolve_fft`"""
+    n = data.shape[-1]
+    smin,smax = kernel['offsets'].min(),kernel['offsets'].max()
+    L = smax-smin+1
+    h = kernel['filter'][(r_[0:L]+smin) % n] # the linear kernel
+    nfft = 2**int(ceil(log2(4*L)))
+    blocksize = nfft-L+1
+    H = _kernel_spectrum(kernel,h,nfft,use_rfft)
+    x_ext = take(data,(r_[0:n+L-1]-smax) % n,axis = -1)
+    z = zeros(data.shape[:-1]+(x_ext.shape[-1]+nfft,),dtype = result_dtype)
+    for j in range(0,x_ext.shape[-1],blocksize):
+        thisblock = x_ext[...,j:j+blocksize]
+        if use_rfft:
+            z[...,j:j+nfft] += irfft(rfft(thisblock,nfft,axis = -1)*H,nfft,axis = -1)
+        else:
+            z[...,j:j+nfft] += ifft(fft(thisblock,nfft,axis = -1)*H,axis = -1)
+    return z[...,L-1:L-1+n]
+#}}}
+def convolve(self,axisname,filterwidth,convfunc = (lambda x,y: exp(-(x**2)/(2.0*(y**2)))),method = 'auto'):
     r'''Perform a convolution.
-    
+
     Parameters
     ==========
 
@@ -17,24 +109,46 @@ def convolve(self,axisname,filterwidth,convfunc = (lambda x,y: exp(-(x**2)/(2.0*
         Default is a normalized Gaussian of width (:math:`\sigma`)
         `filterwidth`
         :math:`\frac{1}{2 \sigma^2}\exp\left( - \frac{x^2}{2 \sigma^2} \right)`
-        For example if you want a complex lorentzian with `filterwidth` controlled by the rate $R$, 
+        For example if you want a complex lorentzian with `filterwidth` controlled by the rate $R$,
         *i.e.*
         :math:`\frac{-1}{-i 2 \pi f - R}`
         then ``convfunc = lambda f,R: -1./(-1j*2*pi*f-R)``
+
+    method: str
+        ``'direct'``, ``'overlap-add'``, ``'fft'``, or ``'auto'`` (the default).
+        All methods give the same (circular) convolution.
+        With ``'auto'``, kernels with only a few nonzero taps are applied
+        directly, kernels whose support is short compared to the axis
+        use overlap-add, and everything else uses a single FFT of the
+        whole axis.
+        When both the data and the kernel are real, real FFTs are used and
+        the result stays real.
+        The kernel and its spectra are cached, so that repeatedly
+        convolving with the same `convfunc` and `filterwidth` along the
+        same axis does not regenerate them.
     '''
-    #{{{ make a version of x that is oriented along the correct dimension
-    x = self.getaxis(axisname).copy()
-    x_centerpoint = (x[-1]+x[0])/2
-    x -= x_centerpoint # so that zero is in the center
-    x = ifftshift(x) # so that it's convolved about time 0
     thisaxis = self.axn(axisname)
-    #}}}
-    myfilter = convfunc(x,filterwidth)
-    myfilter /= myfilter.sum()
-    filtershape = ones_like(self.data.shape)
-    filtershape[thisaxis] = len(myfilter)
-    myfilter = myfilter.reshape(filtershape)
-    #self.data = ifftshift(ifft(fftshift(fft(self.data,axis = thisaxis),axes = thisaxis)*fftshift(fft(myfilter,axis = thisaxis),axes=thisaxis),axis = thisaxis),axes = thisaxis) # for some reason fftconvolve doesn't work!
-    self.data = ifft(fft(self.data,axis = thisaxis)*fft(myfilter,axis = thisaxis),axis = thisaxis)
-    #self.data = fftconvolve(self.data,myfilter,mode='same') # I need this, so the noise doesn't break up my blocks
+    kernel = _cached_kernel(axisname,self.getaxis(axisname),filterwidth,convfunc)
+    n = len(kernel['filter'])
+    use_rfft = isrealobj(self.data) and isrealobj(kernel['filter'])
+    result_dtype = result_type(self.data,kernel['filter'],float64)
+    if method == 'auto':
+        support = kernel['offsets'].max()-kernel['offsets'].min()+1
+        if len(kernel['taps']) <= _direct_max_taps:
+            method = 'direct'
+        elif 8*support < n:
+            method = 'overlap-add'
+        else:
+            method = 'fft'
+    logger.debug(lazy_strm("convolving along",axisname,"with method",method,"and real FFT" if use_rfft else ""))
+    data = self.data.swapaxes(thisaxis,-1)
+    if method == 'direct':
+        data = _convolve_direct(data,kernel,result_dtype)
+    elif method == 'overlap-add':
+        data = _convolve_overlap_add(data,kernel,use_rfft,result_dtype)
+    elif method == 'fft':
+        data = _convolve_fft(data,kernel,use_rfft)
+    else:
+        raise ValueError(strm("I don't understand the convolution method",method))
+    self.data = data.swapaxes(thisaxis,-1)
     return self
@@ -31,6 +31,7 @@ else:
     r_ = rclass()
     # }}}
 import logging
+import importlib
 from paramset_pyspecdata import myparams
 import re
 
@@ -117,6 +118,40 @@ def check_ascending_axis(u,tolerance = 1e-7,additional_message = []):
     assert du > 0, thismsg
     return du
 
+#{{{ deferred imports
+#    modules that are slow to import, and that most scripts never use, are
+#    only imported when they're first used
+class _lazy_module(object):
+    r'''Stands in for the module `name`, which is imported on first access
+    to one of its attributes.'''
+    def __init__(self,name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+    def _lazy_load(self):
+        if self._lazy_module is None:
+            self.__dict__['_lazy_module'] = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+    def __getattr__(self,attr):
+        return getattr(self._lazy_load(),attr)
+    def __setattr__(self,attr,value):
+        setattr(self._lazy_load(),attr,value)
+    def __repr__(self):
+        if self._lazy_module is None:
+            return "<module '%s' (not imported yet)>"%self._lazy_name
+        return repr(self._lazy_module)
+def _lazy_function(modulename,name):
+    r'''Return a function that imports `name` from the module `modulename`
+    the first time it's called, and then calls it.'''
+    def wrapper(*args,**kwargs):
+        return getattr(importlib.import_module(modulename),name)(*args,**kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = "``%s.%s`` (imported on first use)"%(modulename,name)
+    return wrapper
+def _module_imported(name):
+    r'''True if the module `name` has actually been imported -- *e.g.* if
+    sympy hasn't been imported, nothing can be a sympy object'''
+    return name in sys.modules
+#}}}
 def init_logging(level=logging.INFO, filename='pyspecdata.log'):
     "Initialize logging on pyspecdata.log -- do NOT log if run from within a notebook (it's fair to assume that you will run first before embedding)"
     if level.lower() == 'info':
@@ -139,6 +174,22 @@ def init_logging(level=logging.INFO, filename='pyspecdata.log'):
 
 def strm(*args):
     return ' '.join(map(str,args))
+class lazy_strm(object):
+    r'''Like :func:`strm`, but the string is only built when it's needed.
+
+    Pass this to the logging functions, *e.g.*
+    ``logger.debug(lazy_strm("the data is",data))``,
+    so that the arguments (which can be large arrays or nddata) are only
+    converted to strings if the message is actually logged.
+    Note that the arguments themselves are still evaluated -- if they're
+    expensive to compute, guard the call with
+    ``if logger.isEnabledFor(logging.DEBUG):``.
+    '''
+    __slots__ = ('args',)
+    def __init__(self,*args):
+        self.args = args
+    def __str__(self):
+        return strm(*self.args)
 
 exp_re = re.compile(r'(.*)e([+\-])0*([0-9]+)')
 def reformat_exp(arg):
@@ -5,6 +5,7 @@ even if the python environments are moved around.
 This makes the compilation of a Latex lab notebook extremely efficient.
 '''
 from .datadir import getDATADIR
+from .datadir import _file_fingerprint,_inputs_record_environ
 #from .datadir import get_notebook_dir
 from distutils.spawn import find_executable
 import os.path
@@ -13,6 +14,12 @@ import numpy
 import sys
 import time
 import platform
+import json
+import tempfile
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
+import Queue
 from shutil import copy2 as sh_copy2
 from subprocess import Popen,PIPE,check_output
 haswatchdog = False
@@ -201,84 +208,393 @@ def sha_string(script):
     hasharray = numpy.fromstring(s.digest(),'>u8')
     del s
     return ''.join(map(lambda x: '%016x'%x,list(hasharray)))
+#{{{ warm workers -- these import pyspecdata once, then fork a child for
+#    each script, so that every script starts from a fresh copy of the
+#    already-imported modules, rather than from a new interpreter
+_warm_modules = ['pyspecdata','pyspecdata.fornotebook']
+#    environment variables that pyspecdata reads when it's imported -- these
+#    would be read by the worker rather than by the script, so scripts that
+#    set them are run in a new interpreter
+_import_time_environ = ['PYSPECDATA_PROFILE']
+def _needs_new_interpreter(environment):
+    return any(environment.get(j,'') not in ['','0'] for j in _import_time_environ)
+class _warm_worker_crashed(Exception):
+    pass
+def _warm_worker_loop(conn):
+    "the main loop of a :class:`_warm_worker` (runs in the worker process)"
+    import matplotlib; matplotlib.use('Agg')
+    for j in _warm_modules:
+        try:
+            __import__(j)
+        except Exception:
+            pass # the script itself will report the error
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        script_fname,environment = request
+        out_fd,out_fname = tempfile.mkstemp(suffix = '.stdout')
+        err_fd,err_fname = tempfile.mkstemp(suffix = '.stderr')
+        pid = os.fork()
+        if pid == 0:
+            _run_in_forked_child(script_fname,environment,out_fd,err_fd)
+        os.close(out_fd)
+        os.close(err_fd)
+        status = os.waitpid(pid,0)[1]
+        with open(out_fname) as fp:
+            stdoutdata = fp.read()
+        with open(err_fname) as fp:
+            stderrdata = fp.read()
+        os.remove(out_fname)
+        os.remove(err_fname)
+        conn.send((stdoutdata,stderrdata,os.WIFSIGNALED(status)))
+def _run_in_forked_child(script_fname,environment,out_fd,err_fd):
+    r'''run the script in a fresh namespace, with the output going to the
+    given file descriptors, then exit -- never returns'''
+    import atexit
+    import gc
+    import runpy
+    import traceback
+    import warnings
+    exitcode = 0
+    try:
+        os.dup2(os.open(os.devnull,os.O_RDONLY),0) # like the closed stdin of a new interpreter
+        os.dup2(out_fd,1)
+        os.dup2(err_fd,2)
+        os.environ.clear()
+        os.environ.update(environment)
+        sys.argv = [script_fname]
+        sys.path[0] = os.path.dirname(os.path.abspath(script_fname))
+        warnings.simplefilter('ignore') # like ``python -W ignore``
+        runpy.run_path(script_fname,run_name = '__main__')
+    except SystemExit as e:
+        if e.code is not None and e.code != 0:
+            if not isinstance(e.code,int):
+                sys.stderr.write(str(e.code)+'\n')
+            exitcode = 1
+    except BaseException:
+        etype,value,tb = sys.exc_info()
+        # skip the frames of the worker and of runpy, like python would
+        script_tb = tb
+        while (script_tb is not None
+                and script_tb.tb_frame.f_code.co_filename != script_fname):
+            script_tb = script_tb.tb_next
+        if script_tb is None: script_tb = tb
+        traceback.print_exception(etype,value,script_tb)
+        exitcode = 1
+    finally:
+        try:
+            import matplotlib.pyplot as plt
+            plt.close('all')
+        except Exception:
+            pass
+        try:
+            atexit._run_exitfuncs() # os._exit skips these, but python wouldn't
+        except BaseException:
+            pass # _run_exitfuncs already printed the traceback
+        gc.collect() # so that files the script left open are flushed and closed
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exitcode)
+class _warm_worker(object):
+    r'''A long-lived process that has already imported pyspecdata, and runs
+    scripts (one at a time) on request -- only available on posix, since it
+    relies on ``fork``.'''
+    def __init__(self):
+        self.conn,child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target = _warm_worker_loop,
+                args = (child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+    def run(self,script_fname,environment):
+        r'''run the script and return (stdout,stderr) -- raises
+        :class:`_warm_worker_crashed` if the worker died, or the script
+        was killed by a signal'''
+        try:
+            self.conn.send((script_fname,environment))
+            stdoutdata,stderrdata,killed = self.conn.recv()
+        except (EOFError,IOError,OSError) as e:
+            raise _warm_worker_crashed("the worker died: "+str(e))
+        if killed:
+            raise _warm_worker_crashed("the script was killed by a signal")
+        return stdoutdata,stderrdata
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (IOError,OSError):
+                pass
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.conn.close()
+#}}}
+def _run_script(scriptnum_as_str,worker = None):
+    r'''run the python script numbered by scriptnum_as_str in a new interpreter, and return its (stdout,stderr,inputs)
+
+    here, inputs is a list of [path,fingerprint] for the data files that
+    the script opened through :mod:`pyspecdata.load_files`
+
+    if `worker` (a :class:`_warm_worker`) is given, the script is run by
+    the worker instead, unless the worker crashes, in which case it is run
+    again in a new interpreter'''
+    script_fname = script_filename(scriptnum_as_str)
+    temp = dict(os.environ)
+    record_fd,record_fname = tempfile.mkstemp(suffix = '.inputs')
+    os.close(record_fd)
+    temp.update({_inputs_record_environ:record_fname})
+    python_name = 'python'
+    if os.name == 'posix':
+        temp.update({'PYTHON_DATA_DIR':getDATADIR()})
+        # on mac, we frequently want to use python2
+        if find_executable('python2'):
+            python_name = 'python2'
+    else: #windows should give os.name == 'nt'
+        temp.update({'MPLCONFIGDIR':os.getcwd()+'/.matplotlib',
+                    'PYTHON_DATA_DIR':getDATADIR()})
+    stdoutdata = None
+    if worker is not None and not _needs_new_interpreter(temp):
+        try:
+            stdoutdata,stderrdata = worker.run(script_fname,temp)
+        except _warm_worker_crashed as e:
+            print "warm worker failed on script",scriptnum_as_str,"(",e,") -- running it in a new interpreter"
+            with open(record_fname,'w') as fp:
+                pass # discard anything recorded by the failed run
+    if stdoutdata is None:
+        proc = Popen([python_name,'-W','ignore',script_fname],
+                stdout = PIPE,
+                stdin = PIPE,
+                stderr = PIPE,
+                env = temp)
+        stdoutdata,stderrdata = proc.communicate()
+    if os.name != 'posix':
+        stdoutdata = stdoutdata.replace('\r','')
+        if stderrdata is not None:
+            stderrdata = stderrdata.replace('\r','')
+    #{{{ read the inputs, keeping the first fingerprint seen for each file
+    inputs = []
+    with open(record_fname) as fp:
+        for line in fp.readlines():
+            thisinput = json.loads(line)
+            if thisinput[0] not in [x[0] for x in inputs]:
+                inputs.append(thisinput)
+    os.remove(record_fname)
+    #}}}
+    return stdoutdata,stderrdata,inputs
+def inputs_filename(hashstring):
+    r'''where the list of the data files read by the script (and their
+    fingerprints) is stored, alongside :func:`cached_filename`'''
+    return cached_filename(hashstring)[:-len('.tex')] + '.inputs'
+def _cache_is_current(hashstring):
+    r'''True if the cached output for `hashstring` exists, and none of the
+    data files that the script read have changed since it was run'''
+    if not os.path.exists(cached_filename(hashstring)):
+        return False
+    if not os.path.exists(inputs_filename(hashstring)):
+        return True # cached before the inputs were recorded
+    with open(inputs_filename(hashstring)) as fp:
+        inputs = json.load(fp)
+    for path,fingerprint in inputs:
+        if _file_fingerprint(path) != fingerprint:
+            print "the data file",path,"has changed since the cached output",cached_filename(hashstring),"was generated"
+            return False
+    return True
+def _write_cached_output(scriptnum_as_str,hashstring,stdoutdata,stderrdata,inputs = [],showcode = False,show_error = True):
+    r'''write the output of the script to the cache -- this writes to
+    a temporary file, which is then renamed, so that an interrupted (or
+    concurrent) build never leaves a partial file in the cache
+
+    the list of inputs is written first, so that any output in the cache
+    has its current list of inputs'''
+    output_fname = cached_filename(hashstring)
+    if not os.path.exists(os.path.dirname(output_fname)):
+        try:
+            os.makedirs(os.path.dirname(output_fname))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(output_fname)):
+                raise # otherwise, another job just made it
+    temp_fname = output_fname + '.%d.%d.tmp'%(os.getpid(),threading.current_thread().ident)
+    with open(temp_fname,'w') as fp:
+        json.dump(inputs,fp)
+    _rename_into_place(temp_fname,inputs_filename(hashstring))
+    fp_out = open(temp_fname,'w')
+    #fp_out.write(r'{\color{red}script: %d}'%script_number+'\n')
+    if showcode:
+        fp_out.write(r'\begin{lstlisting}'+'\n')
+        fp_out.write(grab_script_string(scriptnum_as_str))
+        fp_out.write(r'\end{lstlisting}'+'\n')
+    #fp_out.write('File has not been run, output:\n\n')
+    fp_out.write("%%% Generated automatically by python for script {:s} hashstring {:s}".format(scriptnum_as_str,hashstring))
+    fp_out.write("\n")
+    fp_out.write(stdoutdata)
+    #fp_out.write('\n\n$\\Rightarrow$ end of output\n\n')
+    if show_error:
+        if stderrdata is not None and len(stderrdata) > 0:
+            fp_out.write("\\quad\\\\ {\\small {\\color{red} {\\tt ERRORS---------------------} "+r'\makeatletter\fn{scripts/\thepy@codenum.py}\makeatother'+"}}\\\\\n")
+            fp_out.write("\n\nThe current directory is \\verb|%s|\n\n"%os.getcwd())
+            fp_out.write("\n\nThe data directory was set to: \\verb|"+getDATADIR()+"|\n\n")
+            #fp_out.write("\n\nThe notebook directory was set to: \\verb|"+get_notebook_dir()+"|\n\n")
+            fp_out.write("\\begin{tiny}\n")
+            fp_out.write("\\begin{verbatim}\n")
+            #fp_out.write('...\n\t'.join(textwrap.wrap(stderrdata,80)))
+            fp_out.write(stderrdata)
+            fp_out.write("\\end{verbatim}\n")
+            fp_out.write("\\end{tiny}\n")
+            fp_out.write("{\\small {\\color{red} {\\tt ---------------------------}}}\\\\\n")
+    fp_out.close()
+    _rename_into_place(temp_fname,output_fname)
+    return
+def _rename_into_place(temp_fname,fname):
+    if os.name != 'posix' and os.path.exists(fname):
+        os.remove(fname) # windows can't rename over an existing file
+    os.rename(temp_fname,fname)
+    return
+def _script_shows_error(scriptnum_as_str):
+    r'interpret the "NOerr" directive'
+    with open(script_filename(scriptnum_as_str),'r') as fp:
+        firstline = fp.readline()
+    return not firstline.startswith('### NOerr')
 def cache_output_if_needed(scriptnum_as_str,hashstring,showcode = False,show_error = True):
     r'if needed, run the python script numbered by scriptnum_as_str that hashes to hashstring, and output the result to the cache ONLY'
     output_fname = cached_filename(hashstring)
-    script_fname = script_filename(scriptnum_as_str)
-    # {{{ interpret the "NOerr" directive
-    with open(script_fname,'r') as fp:
-        firstline = fp.readline()
-        if firstline.startswith('### NOerr'): show_error = False
-    # }}}
-    if os.path.exists(output_fname):
+    if not _script_shows_error(scriptnum_as_str): show_error = False
+    if _cache_is_current(hashstring):
         print output_fname,"already exists, so I will just use it"
     else:
-        print "no cached file"
-        if not os.path.exists(os.path.dirname(output_fname)):
-            os.makedirs(os.path.dirname(output_fname))
-        fp_out = open(output_fname,'w')
-        #fp_out.write(r'{\color{red}script: %d}'%script_number+'\n')
-        if showcode:
-            fp_out.write(r'\begin{lstlisting}'+'\n')
-            fp_out.write(''.join(script))
-            fp_out.write(r'\end{lstlisting}'+'\n')
-        temp = os.environ
+        print "no (current) cached file"
         print "about to run python"
-        python_name = 'python'
-        if os.name == 'posix':
-            temp.update({'PYTHON_DATA_DIR':getDATADIR()})
-            # on mac, we frequently want to use python2
-            if find_executable('python2'):
-                python_name = 'python2'
-            proc = Popen([python_name,'-W','ignore',script_fname],
-                    stdout = PIPE,
-                    stdin = PIPE,
-                    stderr = PIPE,
-                    env = temp)
-        else: #windows should give os.name == 'nt'
-            temp.update({'MPLCONFIGDIR':os.getcwd()+'/.matplotlib',
-                        'PYTHON_DATA_DIR':getDATADIR()})
-            proc = Popen([python_name,'-W','ignore',script_fname],
-                    stdout = PIPE,
-                    stdin = PIPE,
-                    stderr = PIPE,
-                    env = temp)
-        stdoutdata,stderrdata = proc.communicate()
+        stdoutdata,stderrdata,inputs = _run_script(scriptnum_as_str)
         print "ran python"
-        if os.name != 'posix':
-            stdoutdata = stdoutdata.replace('\r','')
-            if stderrdata is not None:
-                stderrdata = stderrdata.replace('\r','')
-        #fp_out.write('File has not been run, output:\n\n')
-        fp_out.write("%%% Generated automatically by python for script {:s} hashstring {:s}".format(scriptnum_as_str,hashstring))
-        fp_out.write("\n")
-        fp_out.write(stdoutdata)
-        #fp_out.write('\n\n$\\Rightarrow$ end of output\n\n')
-        if show_error:
-            if stderrdata is not None and len(stderrdata) > 0:
-                fp_out.write("\\quad\\\\ {\\small {\\color{red} {\\tt ERRORS---------------------} "+r'\makeatletter\fn{scripts/\thepy@codenum.py}\makeatother'+"}}\\\\\n")
-                fp_out.write("\n\nThe current directory is \\verb|%s|\n\n"%os.getcwd())
-                fp_out.write("\n\nThe data directory was set to: \\verb|"+getDATADIR()+"|\n\n")
-                #fp_out.write("\n\nThe notebook directory was set to: \\verb|"+get_notebook_dir()+"|\n\n")
-                fp_out.write("\\begin{tiny}\n")
-                fp_out.write("\\begin{verbatim}\n")
-                #fp_out.write('...\n\t'.join(textwrap.wrap(stderrdata,80)))
-                fp_out.write(stderrdata)
-                fp_out.write("\\end{verbatim}\n")
-                fp_out.write("\\end{tiny}\n")
-                fp_out.write("{\\small {\\color{red} {\\tt ---------------------------}}}\\\\\n")
-        fp_out.close()
+        _write_cached_output(scriptnum_as_str,hashstring,stdoutdata,stderrdata,
+                inputs = inputs,showcode = showcode,show_error = show_error)
         return
+def run_scripts(scriptlist,jobs = None,showcode = False,warm = None):
+    r'''Bring the cache up to date for all the scripts in `scriptlist`, and
+    copy the output of each into the scripts directory.
+
+    All the scripts are hashed up front, so that the ones that aren't
+    cached (or whose data files have changed -- see
+    :func:`inputs_filename`) can be run simultaneously, `jobs` at a time, each in a new
+    interpreter.
+    Scripts that share their code (and therefore their cache file) are
+    only run once.
+    Each output is written to the cache atomically as soon as its script
+    finishes, so an interrupted build keeps everything that finished.
+
+    Rather than paying the cost of importing pyspecdata (pylab, scipy,
+    tables, *etc.*) in every new interpreter, the scripts are (by default,
+    on posix) run by "warm" workers that have already imported it, and
+    that fork a fresh child for each script.
+    If a worker crashes, the script is run again in a new interpreter.
+    Warm workers aren't used if an environment variable that pyspecdata
+    reads on import (``PYSPECDATA_PROFILE``) is set.
+
+    Parameters
+    ----------
+    scriptlist : list of str
+        the script numbers (as strings)
+    jobs : int
+        the number of scripts to run at once.
+        Defaults to the ``PYSPECDATA_SCRIPT_JOBS`` environment variable,
+        if it's set, and otherwise to the number of CPUs.
+    warm : bool
+        whether to use warm workers.
+        Defaults to True on posix, unless the ``PYSPECDATA_SCRIPT_WARM``
+        environment variable is set to 0.
+    '''
+    if jobs is None:
+        jobs = int(os.environ.get('PYSPECDATA_SCRIPT_JOBS',multiprocessing.cpu_count()))
+    if warm is None:
+        warm = os.environ.get('PYSPECDATA_SCRIPT_WARM','1') != '0'
+    warm = warm and hasattr(os,'fork') and not _needs_new_interpreter(os.environ)
+    #{{{ discover the uncached scripts
+    hashstrings = []
+    to_run = [] # (scriptnum_as_str,hashstring), with each hash only once
+    for scriptnum_as_str in scriptlist:
+        hashstring = sha_string(grab_script_string(scriptnum_as_str))
+        print "reading script",script_filename(scriptnum_as_str),"which has hash",hashstring
+        hashstrings.append(hashstring)
+        if (hashstring not in [x[1] for x in to_run]
+                and not _cache_is_current(hashstring)):
+            to_run.append((scriptnum_as_str,hashstring))
+    print "running",len(to_run),"uncached scripts (of",len(scriptlist),"),",jobs,"at a time"
+    #}}}
+    #{{{ run them
+    progress = {'done':0}
+    progress_lock = threading.Lock()
+    start_time = time.time()
+    n_workers = max(1,min(jobs,len(to_run)))
+    idle_workers = Queue.Queue()
+    if warm and len(to_run) > 0:
+        # start these before the threads, so that we don't fork a threaded process
+        for j in range(n_workers):
+            idle_workers.put(_warm_worker())
+    else:
+        for j in range(n_workers):
+            idle_workers.put(None)
+    def run_one(thisscript):
+        scriptnum_as_str,hashstring = thisscript
+        script_start = time.time()
+        worker = idle_workers.get()
+        try:
+            stdoutdata,stderrdata,inputs = _run_script(scriptnum_as_str,worker = worker)
+        finally:
+            if worker is not None and not worker.process.is_alive():
+                # don't start a new one, since we shouldn't fork from a
+                # threaded process -- just fall back to new interpreters
+                worker.close()
+                worker = None
+            idle_workers.put(worker)
+        _write_cached_output(scriptnum_as_str,hashstring,stdoutdata,stderrdata,
+                inputs = inputs,showcode = showcode,
+                show_error = _script_shows_error(scriptnum_as_str))
+        with progress_lock:
+            progress['done'] += 1
+            print "[%d/%d] ran script %s in %0.1f s%s (%0.1f s elapsed)"%(progress['done'],
+                    len(to_run),scriptnum_as_str,time.time()-script_start,
+                    ', with errors' if stderrdata else '',
+                    time.time()-start_time)
+            sys.stdout.flush()
+        return
+    try:
+        if n_workers > 1:
+            # threads are enough, since the work is done in the child processes
+            pool = ThreadPool(n_workers)
+            try:
+                pool.map(run_one,to_run)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for j in to_run:
+                run_one(j)
+    finally:
+        while not idle_workers.empty():
+            worker = idle_workers.get()
+            if worker is not None:
+                worker.close()
+    #}}}
+    # always pull the output from the cache
+    for scriptnum_as_str,hashstring in zip(scriptlist,hashstrings):
+        sh_copy2(cached_filename(hashstring),get_scripts_dir()+scriptnum_as_str+'.tex')
+    return
 def flush_script(number):
     tex_name = os.path.normpath(os.path.join(os.getcwd(),'scripts',number+'.tex'))
     print "removing:",tex_name
     if os.path.exists(tex_name):
         os.remove(tex_name)
-    file_name = cached_filename(sha_string(grab_script_string(number)))
+    hashstring = sha_string(grab_script_string(number))
+    file_name = cached_filename(hashstring)
     print "removing:",file_name
     if os.path.exists(file_name):
         os.remove(file_name)
         print "does it still exist?",os.path.exists(file_name)
+        if os.path.exists(inputs_filename(hashstring)):
+            os.remove(inputs_filename(hashstring))
     else:
         print "there is no cache for script",number
     return
@@ -305,7 +621,9 @@ if haswatchdog:
         return
 def main():
     r'''This looks for `scripts/scriptsUsed.csv` inside the notebook directory, and checks whether or not it should be run
-    if a command line argument of "flush" is passed, it flushes that script number from the cache'''
+    if a command line argument of "flush" is passed, it flushes that script number from the cache
+    ``-j N`` runs (up to) N uncached scripts at once, and ``--cold`` runs
+    each in a new interpreter, rather than a warm worker (see :func:`run_scripts`)'''
     check_image_path()
     if len(sys.argv) > 2:
         if sys.argv[1] == 'flush':
@@ -318,13 +636,13 @@ def main():
                 exit()
             else:
                 raise RuntimeError("What did you pass me???")
+    jobs = None
+    if '-j' in sys.argv:
+        jobs = int(sys.argv[sys.argv.index('-j')+1])
+    warm = None
+    if '--cold' in sys.argv:
+        warm = False
     fp = open(get_scripts_dir() + 'scriptsUsed.csv')
-    for line in fp.readlines():
-        scriptnum_as_str = line.strip()
-        outname    = scriptnum_as_str + '.tex'
-        hashstring = sha_string(grab_script_string(scriptnum_as_str))
-        print "reading script",script_filename(scriptnum_as_str),"which has hash",hashstring
-        cache_output_if_needed(scriptnum_as_str,hashstring)
-        # always pull the  output from the cache
-        sh_copy2(cached_filename(hashstring),get_scripts_dir()+outname)
+    scriptlist = [line.strip() for line in fp.readlines()]
     fp.close()
+    run_scripts(scriptlist,jobs = jobs,warm = warm)
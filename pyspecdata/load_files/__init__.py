@@ -20,11 +20,13 @@ from . import acert
 from .open_subpath import open_subpath
 from ..datadir import getDATADIR
 from ..datadir import _my_config
-from ..general_functions import process_kwargs,strm
+from ..datadir import _record_input_file
+from ..general_functions import process_kwargs,strm,lazy_strm,_lazy_module
 from ..core import *
 from __builtin__ import any # numpy has an "any" function, which is very annoying
 from itertools import tee
-import warnings, os, h5py, re
+import warnings, os, re
+h5py = _lazy_module('h5py') # only imported when a file is opened
 from zipfile import ZipFile, is_zipfile
 logger = logging.getLogger('pyspecdata.load_files')
 
@@ -58,25 +60,25 @@ def search_filename(searchstring,exp_type,
     #{{{ actually find the files
     directory = getDATADIR(exp_type=exp_type)
     def look_inside(inp_directory):
-        logger.debug(strm("looking inside directory",inp_directory))
+        logger.debug(lazy_strm("looking inside directory",inp_directory))
         dirlist = os.listdir(inp_directory)
-        logger.debug(strm("dirlist inside",inp_directory,"is",dirlist))
+        logger.debug(lazy_strm("dirlist inside",inp_directory,"is",dirlist))
         if os.path.isdir(inp_directory):
             files = re.findall('.*' + searchstring + '.*','\n'.join(dirlist))
         else:
             raise IOError("I can't find the directory:\n%s\nin order to get a file that matches:\n%s\nYou might need to change the value associated with this exp_type in %s"%(inp_directory,searchstring,_my_config.config_location))
-        logger.debug(strm("after running findall, files is",files))
+        logger.debug(lazy_strm("after running findall, files is",files))
         if len(files) == 0:
             files = []
             directories_inside = [k for k in dirlist if os.path.isdir(inp_directory+k)]
-            logger.debug(strm("I found no matches, but I found the directories",directories_inside))
+            logger.debug(lazy_strm("I found no matches, but I found the directories",directories_inside))
             for j in directories_inside:
                 files += [j+os.path.sep+k for k in look_inside(inp_directory+j)]
             return files
         else:
             return files
     files = look_inside(directory)
-    logger.debug(strm("look_inside found the files",files))
+    logger.debug(lazy_strm("look_inside found the files",files))
     if files is None or len(files) == 0:
         exptype_msg = ""
         if exp_type is None:
@@ -165,7 +167,7 @@ def find_file(searchstring,
         :use_sweep: passed to :func:`~pyspecdata.load_files.load_indiv_file`
         :indirect_dimlabels: passed to :func:`~pyspecdata.load_files.load_indiv_file`
         '''
-    logger.info(strm("find_file sees indirect_dimlabels",
+    logger.info(lazy_strm("find_file sees indirect_dimlabels",
         indirect_dimlabels))
     # {{{ legacy warning
     if 'subdirectory' in kwargs.keys():
@@ -176,7 +178,7 @@ def find_file(searchstring,
     while data is None and len(files) > 0:
         filename = files.pop(-1)
         # {{{ file loaded here
-        logger.debug(strm("about to call load_indiv_file on",filename))
+        logger.debug(lazy_strm("about to call load_indiv_file on",filename))
         data = load_indiv_file(filename,
             dimname=dimname, return_acq=return_acq,
             add_sizes=add_sizes, add_dims=add_dims, use_sweep=use_sweep,
@@ -193,7 +195,7 @@ def find_file(searchstring,
     else:
         if postproc is None:
             postproc_type = data.get_prop('postproc_type')
-            logger.debug(strm("found postproc_type",postproc_type))
+            logger.debug(lazy_strm("found postproc_type",postproc_type))
         else:
             logger.debug("found no postproc_type")
         if postproc_type is None:
@@ -265,7 +267,7 @@ def _check_signature(filename):
             retval = file_signatures[(thiskey for thiskey in
                 file_signatures.keys() if thiskey in
                 inistring).next()]
-            logger.info(strm("Found magic signature, returning",
+            logger.info(lazy_strm("Found magic signature, returning",
                 retval))
             return retval
         else:
@@ -309,7 +311,7 @@ def load_indiv_file(filename, dimname='', return_acq=False,
         or else, `None`, indicating that this is part of a pair of
         files that should be skipped
     """
-    logger.debug(strm("load_indiv_file sees indirect_dimlabels",
+    logger.debug(lazy_strm("load_indiv_file sees indirect_dimlabels",
         indirect_dimlabels))
     #to search for kwargs when separating: \<dimname\>\|\<return_acq\>\|\<add_sizes\>\|\<add_dims\>
     if not os.path.exists(filename):
@@ -323,6 +325,7 @@ def load_indiv_file(filename, dimname='', return_acq=False,
             # }}}
         else:
             raise IOError("%s does not exist"%filename)
+    _record_input_file(filename if os.path.exists(filename) else filename+'.par')
     # {{{ first, we search for the file magic to determine the filetype
     filetype = None
     if os.path.isdir(filename) or is_zipfile(filename):# Bruker, prospa, etc, datasets are stored as directories
@@ -375,12 +378,12 @@ def load_indiv_file(filename, dimname='', return_acq=False,
             else:
                 raise RuntimeError('WARNING! unidentified file type '+file_reference)
     else:
-        logger.debug(strm("the path",filename,"is a file"))
+        logger.debug(lazy_strm("the path",filename,"is a file"))
         type_by_signature = _check_signature(filename)
         type_by_extension = _check_extension(filename)
-        logger.debug(strm("signature and extension checks are done"))
+        logger.debug(lazy_strm("signature and extension checks are done"))
         if type_by_signature:
-            logger.debug(strm("determining type by signature"))
+            logger.debug(lazy_strm("determining type by signature"))
             if type_by_signature == 'HDF5':
                 # we can have the normal ACERT Pulse experiment or the ACERT CW format
                 with h5py.File(filename,'r') as h5:
@@ -411,15 +414,15 @@ def load_indiv_file(filename, dimname='', return_acq=False,
             else:
                 raise RuntimeError("Type %s not yet supported!"%type_by_signature)
         else:
-            logger.debug(strm("determining type by extension"))
+            logger.debug(lazy_strm("determining type by extension"))
             if type_by_extension == 'SPC':
-                logger.info(strm("skipping SPC file",filename))
+                logger.info(lazy_strm("skipping SPC file",filename))
                 return None # ignore SPC, and leave the reading to the PAR file
             elif type_by_extension == 'DTA':
-                logger.info(strm("skipping DTA file",filename))
+                logger.info(lazy_strm("skipping DTA file",filename))
                 return None # ignore DTA and load the reading to the DSC file
             elif type_by_extension == 'YGF':
-                logger.info(strm("skipping YGA file",filename))
+                logger.info(lazy_strm("skipping YGA file",filename))
                 return None # ignore YGA and load the reading to the DSC file
             else:
                 raise RuntimeError("I'm not able to figure out what file type %s this is!"%filename)
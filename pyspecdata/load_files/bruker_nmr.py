@@ -98,10 +98,10 @@ def series(file_reference, *subpath, **kwargs):
         else:
             new_guess = len(data)/(td2_zf/2)
             print lsafen("WARNING!, chopping the length of the data to fit the specified td1 of ",td1,"points!\n(specified ",zip(mydimnames,mydimsizes),' td2_zf=%d)'%td2_zf)
-            logger.debug(strm("maybe this works:",size_it_might_be == len(data)))
+            logger.debug(lazy_strm("maybe this works:",size_it_might_be == len(data)))
             data = data[0:size_it_should_be]
             data = bruker_data(data,mydimsizes,mydimnames)
-    logger.debug(strm('data straight from nddata =',data))
+    logger.debug(lazy_strm('data straight from nddata =',data))
     data = data['t2',0:td2/2] # now, chop out their zero filling
     t2axis = 1./v['SW_h']*r_[1:td2/2+1]
     t1axis = r_[0:td1]
@@ -135,8 +135,8 @@ def series(file_reference, *subpath, **kwargs):
         data.set_prop('vd',
                 load_vdlist(file_reference, *subpath))
     else:
-        logger.info(strm("vdlist doesn't exist",file_reference,'vdlist'))
-    logger.debug(strm('data from bruker file =',data))
+        logger.info(lazy_strm("vdlist doesn't exist",file_reference,'vdlist'))
+    logger.debug(lazy_strm('data from bruker file =',data))
     #}}}
     return data
 def load_1D(file_reference, *subpath, **kwargs):
@@ -121,14 +121,14 @@ class ndshape_base ():
         return zip(self.shape,self.dimlabels).__repr__()
     def __getitem__(self,args):
         try:
-            mydict = dict(zip(self.dimlabels,self.shape))
+            thisindex = self.dimlabels.index(args)
+        except:
+            raise ValueError(strm("one or more of the dimensions named",args,"do not exist in",self.dimlabels))
+        try:
+            return self.shape[thisindex]
         except Exception as e:
             raise ValueError(strm("either dimlabels=",self.dimlabels,"or shape",
                 self.shape,"not in the correct format") + explain_error(e))
-        try:
-            return mydict[args]
-        except:
-            raise ValueError(strm("one or more of the dimensions named",args,"do not exist in",self.dimlabels))
     def rename(self,before,after):
         r'rename a dimension'
         thisindex = self.axn(before)
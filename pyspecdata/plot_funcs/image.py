@@ -1,5 +1,39 @@
 from ..general_functions import *
 from ..ndshape import ndshape_base as ndshape
+def _tile_nd_image(A,spacing):
+    r'''Tile the N-D array `A` into a 2D array, where the last dimension
+    gives the columns, and the direct product of all the other
+    dimensions gives the rows (the innermost index comes last).
+    Rows of NaN separate the images, with the separators growing for each
+    outer dimension.
+
+    Each image is written directly into one preallocated array (in a
+    single fancy-indexed assignment), rather than concatenating and
+    reshaping once per extra dimension.
+    '''
+    if spacing < 1.0:
+        spacing = round(prod(A.shape[0:-1])) # the length of the thing not counting the columns
+    spacing = int(spacing)
+    n_rows = A.shape[-2]
+    #{{{ offset of each image along the rows, and the total number of rows
+    offsets = r_[0]
+    blockheight = n_rows
+    linecounter = 0
+    for thisdim in A.shape[-3::-1]: # from the innermost outwards
+        thissep = 2*linecounter + spacing
+        linecounter += thissep
+        offsets = (r_[0:thisdim].reshape(-1,1)*(blockheight+thissep)
+                + offsets.reshape(1,-1)).ravel()
+        blockheight = thisdim*(blockheight+thissep)
+    total_rows = blockheight-linecounter # the trailing separators are dropped
+    #}}}
+    rows = (offsets.reshape(-1,1) + r_[0:n_rows].reshape(1,-1)).ravel()
+    retval = empty((total_rows,A.shape[-1]),dtype = result_type(A.dtype,float64))
+    retval[rows,:] = A.reshape(-1,A.shape[-1])
+    separators = ones(total_rows,dtype = bool)
+    separators[rows] = False
+    retval[separators,:] = nan
+    return retval
 def image(A,x=[],y=[],**kwargs):
     r"Please don't call image directly anymore -- use the image method of figurelist"
     x_inverted = False
@@ -7,13 +41,14 @@ def image(A,x=[],y=[],**kwargs):
     #{{{ pull out kwargs for imagehsv
     imagehsvkwargs = {}
     for k,v in kwargs.items():
-        if k in ['black','logscale']:
+        if k in ['black','logscale','lut_size']:
             imagehsvkwargs[k] = kwargs.pop(k)
     #}}}
-    spacing,ax,x_first,origin = process_kwargs([('spacing',1),
+    spacing,ax,x_first,origin,downsample = process_kwargs([('spacing',1),
         ('ax',gca()),
         ('x_first',False),
-        ('origin','lower')],kwargs,
+        ('origin','lower'),
+        ('downsample',False)],kwargs,
         pass_through = True)
     if x_first: # then the first dimension should be the column
         # dimesion (i.e. last)
@@ -64,6 +99,19 @@ def image(A,x=[],y=[],**kwargs):
         x = array(x)
     if type(y) is list:
         y = array(y)
+    if downsample:
+        #{{{ keep only about one row (of each image) and one column per pixel
+        bbox = ax.get_window_extent()
+        n_images = prod(A.shape[:-2])
+        col_step = int(A.shape[-1] // bbox.width) if bbox.width > 0 else 1
+        row_step = int(n_images*A.shape[-2] // bbox.height) if bbox.height > 0 else 1
+        if col_step > 1:
+            A = A[...,::col_step]
+            if len(x) > 2: x = x[::col_step]
+        if row_step > 1:
+            A = A[...,::row_step,:]
+            if A.ndim == 2 and len(y) > 2: y = y[::row_step]
+        #}}}
     if len(x)==0:
         x = [1,A.shape[1]]
     else:
@@ -85,29 +133,10 @@ def image(A,x=[],y=[],**kwargs):
     else:
         raise ValueError("I don't understand the value you've set for the origin keyword argument")
     kwargs['origin'] = origin# required so that imshow now displays the image correctly
-    linecounter = 0
-    origAndim = A.ndim
     if A.ndim > 2:
         setp(ax.get_yticklabels(),visible = False)
         ax.yaxis.set_ticks_position("none")
-    while A.ndim > 2:# to substitude for imagehsvm, etc., so that we just need a ersion of ft
-        # order according to how it's ordered in the memory
-        # the innermost two will form the image -- first add a line to the end of the images we're going to join up
-        tempsize = array(A.shape) # make a tuple the right shape
-        if linecounter == 0 and spacing < 1.0:
-            spacing = round(prod(tempsize[0:-1])) # find the length of the thing not counting the columns
-        tempsize[-2] = 2*linecounter + spacing # all dims are the same except the image row, to which I add an increasing number of rows
-        #print "iterate (A.ndim=%d) -- now linecounter is "%A.ndim,linecounter
-        linecounter += tempsize[-2] # keep track of the extra lines at the end
-        A = concatenate((A,nan*zeros(tempsize)),axis=(A.ndim-2)) # concatenate along the rows
-        tempsize = r_[A.shape[0:-3],A.shape[-2:]]
-        tempsize[-2] *= A.shape[-3]
-        try:
-            A = A.reshape(int64(tempsize)) # now join them up
-        except:
-            raise IndexError(strm("problem with tempsize",tempsize,
-                "of type",type(tempsize),"dtype",tempsize.dtype))
-    A = A[:A.shape[0]-linecounter,:] # really I should an extra counter besides linecounter now that I am using "spacing", but leave alone for now, to be sure I don't cute off data
+        A = _tile_nd_image(A,spacing)
     if origin == 'flip':
         # {{{ if origin is "flip", we need to manually flip the data
         A = A[::-1,:]
@@ -129,18 +158,18 @@ def image(A,x=[],y=[],**kwargs):
         ax.set_xlim((max(these_xlims),min(these_xlims)))
     return retval
 
-def imagehsv(A,logscale = False,black = False):
-    "This provides the HSV mapping used to plot complex number"
+_hsv_lut_cache = {}
+def _hsv_lut(n_intensity,n_phase,black):
+    r'''Return the (cached) lookup table used by :func:`imagehsv`:
+    a uint8 array of shape (`n_intensity` x `n_phase`, 3), where the
+    intensity (magnitude, normalized to 1) is the slow index, and the
+    phase (starting from -pi, so that red is at a phase of 0) is the fast
+    index.'''
+    thiskey = (n_intensity,n_phase,black)
+    if thiskey in _hsv_lut_cache:
+        return _hsv_lut_cache[thiskey]
     # compare to http://www.rapidtables.com/convert/color/hsv-to-rgb.htm
-    n = 256
-    mask = isnan(A)
-    A[mask] = 0
-    mask = mask.reshape(-1,1)
-    intensity = abs(A).reshape(-1,1)
-    intensity /= abs(A).max()
-    if logscale:
-        raise ValueError("logscale is deprecated, use the cropped_log function instead")
-    #theta = (n-1.)*mod(angle(A)/pi/2.0,1)# angle in 255*cycles
+    intensity = r_[0:n_intensity].reshape(-1,1)/(n_intensity-1.)
     if black:
         if black is True:
             V = intensity
@@ -150,49 +179,82 @@ def imagehsv(A,logscale = False,black = False):
     else:
         S = intensity
         V = 1.0 # always
-    C = V*S
-    H = (angle(-1*A).reshape(-1,1)+pi)/2./pi*6. # divide into 60 degree chunks -- the -1 is to rotate so red is at origin
+    C = V*S*ones((1,n_phase))
+    # divide into 60 degree chunks -- the phase bins are centered on
+    # angle(-z)+pi, which rotates so that red is at the origin
+    H = (r_[0:n_phase]+0.5).reshape(1,-1)/n_phase*6.*ones((n_intensity,1))
     X = C * (1-abs(mod(H,2)-1))
     m = V-C
-    colors = ones(list(A.shape) + [3])
-    origshape = colors.shape
-    colors = colors.reshape(-1,3)
-    rightarray = c_[C, X, zeros_like(X)]
     # http://en.wikipedia.org/wiki/HSL_and_HSV#From_HSV,
     # except that the order was messed up
-    thismask = where(H<1)[0]
-    # C X 0
-    colors[ix_(thismask,[0,1,2])] = rightarray[ix_(thismask,[0,1,2])]
-    thismask = where(logical_and(H>=1,
-        H<2))[0]
-    # X C 0
-    colors[ix_(thismask,[1,0,2])] = rightarray[ix_(thismask,[0,1,2])]
-    thismask = where(logical_and(H>=2,
-        H<3))[0]
-    # X 0 C
-    colors[ix_(thismask,[1,2,0])] = rightarray[ix_(thismask,[0,1,2])]
-    thismask = where(logical_and(H>=3,
-        H<4))[0]
-    # 0 X C
-    colors[ix_(thismask,[2,1,0])] = rightarray[thismask,:]
-    thismask = where(logical_and(H>=4,
-        H<5))[0]
-    # 0 C X
-    colors[ix_(thismask,[2,0,1])] = rightarray[thismask,:]
-    thismask = where(H>5)[0]
-    # C 0 X
-    colors[ix_(thismask,[0,2,1])] = rightarray[thismask,:]
-    colors += m
-    colors *= (n-1)
+    sector = int32(floor(H)) % 6
+    Z = zeros_like(X)
+    colors = concatenate([choose(sector,[C,X,Z,Z,X,C]).reshape(-1,1),
+        choose(sector,[X,C,C,X,Z,Z]).reshape(-1,1),
+        choose(sector,[Z,Z,X,C,C,X]).reshape(-1,1)],axis = 1)
+    colors += (m*ones((1,n_phase))).reshape(-1,1)
+    colors *= 255
+    retval = uint8(colors.round())
+    _hsv_lut_cache[thiskey] = retval
+    return retval
+def imagehsv(A,logscale = False,black = False,lut_size = 256,chunksize = 1048576):
+    r'''This provides the HSV mapping used to plot complex number
+
+    The magnitude (normalized to its maximum) and the phase are each
+    quantized into `lut_size` levels, and used to look up the color in a
+    precomputed table (see :func:`_hsv_lut`).
+    This is done `chunksize` points at a time, so that the temporary
+    arrays stay small, and `A` is never modified.
+    NaN values (*e.g.* the separators generated by :func:`image`) are
+    shown in white if `black` is set, and black otherwise.
+
+    Returns
+    -------
+    ndarray
+        uint8 array with the shape of `A`, plus a final dimension of length 3 (RGB)
+    '''
+    if logscale:
+        raise ValueError("logscale is deprecated, use the cropped_log function instead")
+    A = asarray(A)
+    flatA = A.reshape(-1)
+    lut = _hsv_lut(lut_size,lut_size,black)
+    #{{{ first pass, for the normalization
+    maxabs = 0
+    for j in range(0,len(flatA),chunksize):
+        thismax = nanmax(abs(flatA[j:j+chunksize])) if len(flatA[j:j+chunksize]) > 0 else 0
+        if thismax > maxabs:
+            maxabs = thismax
+    if maxabs > 0:
+        intensity_scale = (lut_size-1.)/maxabs
+    else:
+        intensity_scale = 0
+    #}}}
+    colors = empty((len(flatA),3),dtype = uint8)
     if black:
         # if the background is black, make the separators white
-        # here, we have to remember that we're already scaled up to a scale of 0--255
-        colors[mask * r_[True,True,True]] = 255.0
+        separator_color = 255
     else:
         # if the background is white, make the separators black
-        colors[mask * r_[True,True,True]] = 0.0
-    colors = colors.reshape(origshape)
-    return uint8(colors.round())
+        separator_color = 0
+    phase_scale = lut_size/2./pi
+    for j in range(0,len(flatA),chunksize):
+        thischunk = flatA[j:j+chunksize]
+        mask = isnan(thischunk)
+        idx = abs(thischunk)
+        idx *= intensity_scale
+        idx[mask] = 0
+        idx = rint(idx).astype(intp)
+        idx *= lut_size
+        thisphase = arctan2(-thischunk.imag,-thischunk.real) # the angle of -z, so red is at the origin
+        thisphase += pi
+        thisphase *= phase_scale
+        thisphase[mask] = 0
+        thisphase = thisphase.astype(intp)
+        thisphase[thisphase >= lut_size] = lut_size-1 # exactly +pi
+        idx += thisphase
+        take(lut,idx,axis = 0,out = colors[j:j+chunksize])
+        colors[j:j+chunksize][mask] = separator_color
+    return colors.reshape(A.shape + (3,))
 
 def fl_image(self,A,**kwargs):
     r"""Called as `fl.image()` where `fl` is the `figlist_var`
@@ -255,6 +317,11 @@ def fl_image(self,A,**kwargs):
     spacing : integer
         Determines the size of the white/black line drawn
         Defaults to 1
+    downsample : boolean
+        If `True`, keep only (about) one row and one column per pixel
+        of the axes before building the image -- useful for quickly
+        previewing large multi-dimensional datasets.
+        Defaults to `False`
     ax : matplotlib Axes
         the Axis object where the plot should go.
     all remaning :
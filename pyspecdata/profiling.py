@@ -0,0 +1,263 @@
+r"""Opt-in instrumentation of the nddata methods.
+
+This records the number of calls, the wall time, and the memory that's
+allocated and copied by the methods that usually dominate the time spent
+in a processing script (alignment, copying, slicing, Fourier
+transforms, and the file loaders).
+Nothing is instrumented unless you ask for it, so there is no cost otherwise.
+
+Use it as a context manager:
+
+>>> with profile_nddata() as p:
+>>>     d = find_file('150807_ELDOR', exp_type='test_equip')
+>>>     d.ft('t2', shift=True)
+>>> print p.summary()
+>>> p.write_chrome_trace('trace.json')
+
+The trace file can be opened with ``chrome://tracing`` (or
+https://ui.perfetto.dev), where nested calls are shown as nested bars.
+
+Alternatively, set the environment variable ``PYSPECDATA_PROFILE``
+before running a script.
+If it's set to a filename ending in ``.json``, a Chrome trace is written to
+that file when the script exits; for any other (non-empty) value, only
+the summary is printed (to standard error) when the script exits.
+
+"Bytes allocated" counts the arrays (data, error, and axis coordinates)
+held by the result (or results) that own their memory, and don't share it
+with the arguments -- so views don't count.
+"Bytes copied" counts the same thing, but only for methods that just
+move data around (*e.g.* :meth:`~pyspecdata.nddata.copy`,
+:meth:`~pyspecdata.nddata.__getitem__`,
+:meth:`~pyspecdata.nddata.aligndata`), rather than compute new values.
+Times are inclusive -- *i.e.* the time of a call includes that of the
+instrumented calls it makes.
+The summary also counts how many of the reshapes done by nddata methods
+(*e.g.* in :meth:`~pyspecdata.nddata.aligndata` or
+:meth:`~pyspecdata.nddata.smoosh`) returned a view, and how many needed
+a copy because of the memory layout.
+"""
+from .general_functions import strm
+from numpy import ndarray, may_share_memory
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+from timeit import default_timer
+logger = logging.getLogger('pyspecdata.profiling')
+
+#{{{ what gets instrumented
+#    the second element says whether the method only moves data around
+_nddata_methods = [('aligndata',True),
+        ('copy',True),
+        ('__getitem__',True),
+        ('reorder',True),
+        ('smoosh',True),
+        ('ft',False),
+        ('ift',False),
+        ('convolve',False),
+        ('interp',False),
+        ('mean',False),
+        ('sum',False),
+        ('run',False),
+        ('hdf5_write',False),
+        ]
+#    the loaders are given as (submodule of load_files, function) -- note
+#    that find_file is recorded through load_indiv_file, since
+#    ``from pyspecdata import *`` holds on to the original find_file
+_loader_functions = [(None,'load_indiv_file'),
+        ('bruker_nmr','series'),
+        ('bruker_nmr','load_1D'),
+        ('bruker_esr','xepr'),
+        ('bruker_esr','winepr'),
+        ('acert','load_pulse'),
+        ('acert','load_cw'),
+        ('prospa','load_1D'),
+        ('prospa','load_2D'),
+        ]
+#}}}
+def _arrays(obj):
+    r"""return a list of the ndarrays held by `obj` (the data, error, and axis
+    coordinates of an nddata, or an ndarray), looking inside tuples and
+    lists (*e.g.* the pair returned by aligndata)"""
+    if isinstance(obj,ndarray):
+        return [obj]
+    if isinstance(obj,(tuple,list)):
+        retval = []
+        for j in obj:
+            retval += _arrays(j)
+        return retval
+    retval = [getattr(obj,'data',None),getattr(obj,'data_error',None)]
+    axis_coords = getattr(obj,'axis_coords',None)
+    if type(axis_coords) is list:
+        retval += axis_coords
+    return [j for j in retval if isinstance(j,ndarray)]
+def _allocated_bytes(retval,inputs):
+    r"""return the number of bytes in the arrays of `retval` that were
+    allocated by the call -- *i.e.* that own their memory, and don't share
+    it with any of the arrays in `inputs` (which are held on to during the
+    call, so that their memory can't be reused)"""
+    allocated = 0
+    seen = set()
+    for j in _arrays(retval):
+        if id(j) in seen or not j.flags.owndata or j.nbytes == 0:
+            continue
+        seen.add(id(j))
+        if any(may_share_memory(j,k) for k in inputs):
+            continue
+        allocated += j.nbytes
+    return allocated
+class profile_nddata(object):
+    r'''Context manager that instruments the nddata methods and the file
+    loaders while it's active.
+
+    Parameters
+    ----------
+    methods : list of str or None
+        Names of the nddata methods to instrument.
+        Defaults to a list of the methods that usually dominate the time spent
+        in processing scripts.
+    '''
+    _active_profiler = None # only one profiler can patch the methods at a time
+    def __init__(self,methods = None):
+        if methods is None:
+            self.methods = list(_nddata_methods)
+        else:
+            only_moves = dict(_nddata_methods)
+            self.methods = [(j,only_moves.get(j,False)) for j in methods]
+        self.stats = {}
+        self.events = []
+        self._originals = []
+        self._lock = threading.Lock()
+        self._start = None
+        self._reshape_counts_start = None
+        self.reshape_counts = {'view':0,'copy':0}
+    def __enter__(self):
+        return self.start()
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.stop()
+        return False
+    def start(self):
+        "start instrumenting (called by ``__enter__``)"
+        if profile_nddata._active_profiler is not None:
+            raise RuntimeError("another profile_nddata is already active -- stop it first")
+        from .core import nddata,_reshape_counts
+        from . import load_files
+        self._start = default_timer()
+        self._reshape_counts_start = dict(_reshape_counts)
+        for thismethod,only_moves in self.methods:
+            self._patch(nddata,thismethod,'nddata.'+thismethod,only_moves)
+        for thismodule,thisfunction in _loader_functions:
+            if thismodule is None:
+                self._patch(load_files,thisfunction,'load_files.'+thisfunction,False)
+            else:
+                self._patch(getattr(load_files,thismodule),thisfunction,
+                        'load_files.'+thismodule+'.'+thisfunction,False)
+        profile_nddata._active_profiler = self
+        return self
+    def stop(self):
+        "stop instrumenting, and restore the original methods (called by ``__exit__``)"
+        self._update_reshape_counts()
+        self._reshape_counts_start = None
+        for owner,name,original,was_own_attribute in reversed(self._originals):
+            if was_own_attribute:
+                setattr(owner,name,original)
+            else:
+                delattr(owner,name)
+        self._originals = []
+        if profile_nddata._active_profiler is self:
+            profile_nddata._active_profiler = None
+        return self
+    def _update_reshape_counts(self):
+        "tally the reshapes since :meth:`start`"
+        if self._reshape_counts_start is None:
+            return
+        from .core import _reshape_counts
+        self.reshape_counts = dict((k,_reshape_counts[k]-v)
+                for k,v in self._reshape_counts_start.iteritems())
+    def _patch(self,owner,name,label,only_moves):
+        if not hasattr(owner,name):
+            logger.debug(strm("can't instrument",label,"-- it doesn't exist"))
+            return
+        if isinstance(owner,type):
+            original = owner.__dict__.get(name,None)
+            was_own_attribute = original is not None
+            function = getattr(owner,name).__func__
+        else:
+            original = getattr(owner,name)
+            was_own_attribute = True
+            function = original
+        profiler = self
+        def wrapper(*args,**kwargs):
+            inputs = _arrays(list(args)+kwargs.values())
+            start = default_timer()
+            try:
+                retval = function(*args,**kwargs)
+            finally:
+                stop = default_timer()
+            allocated = _allocated_bytes(retval,inputs)
+            profiler._record(label,start,stop,allocated,only_moves)
+            return retval
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        self._originals.append((owner,name,original,was_own_attribute))
+        setattr(owner,name,wrapper)
+    def _record(self,label,start,stop,allocated,only_moves):
+        with self._lock:
+            if label not in self.stats:
+                self.stats[label] = {'calls':0,
+                        'time':0.,
+                        'bytes_allocated':0,
+                        'bytes_copied':0}
+            thisstat = self.stats[label]
+            thisstat['calls'] += 1
+            thisstat['time'] += stop-start
+            thisstat['bytes_allocated'] += allocated
+            if only_moves:
+                thisstat['bytes_copied'] += allocated
+            self.events.append({'name':label,
+                'ph':'X',
+                'ts':(start-self._start)*1e6,
+                'dur':(stop-start)*1e6,
+                'pid':os.getpid(),
+                'tid':threading.current_thread().ident,
+                'args':{'bytes_allocated':allocated,
+                    'bytes_copied':allocated if only_moves else 0}})
+    def summary(self):
+        "return a table (as a string) of the statistics for each method, sorted by total time"
+        retval = ['%-28s %8s %12s %12s %14s %14s'%('method','calls',
+            'total (s)','mean (ms)','allocated (MB)','copied (MB)')]
+        for label,thisstat in sorted(self.stats.iteritems(),
+                key = lambda x: -x[1]['time']):
+            retval.append('%-28s %8d %12.4f %12.4f %14.2f %14.2f'%(label,
+                thisstat['calls'],thisstat['time'],
+                1e3*thisstat['time']/thisstat['calls'],
+                thisstat['bytes_allocated']/1048576.,
+                thisstat['bytes_copied']/1048576.))
+        self._update_reshape_counts()
+        retval.append('reshapes: %d returned a view, %d needed a copy'%(
+            self.reshape_counts['view'],self.reshape_counts['copy']))
+        return '\n'.join(retval)
+    def write_chrome_trace(self,filename):
+        "write the recorded calls to `filename` in the Chrome trace event format"
+        with open(filename,'w') as fp:
+            json.dump({'traceEvents':self.events,
+                'displayTimeUnit':'ms'},fp)
+        return self
+def _profile_from_environment():
+    r'''If the ``PYSPECDATA_PROFILE`` environment variable is set, start
+    a :class:`profile_nddata` that reports when the interpreter exits.'''
+    setting = os.environ.get('PYSPECDATA_PROFILE','')
+    if setting in ['','0']:
+        return None
+    profiler = profile_nddata().start()
+    def report():
+        profiler.stop()
+        sys.stderr.write(profiler.summary()+'\n')
+        if setting.lower().endswith('.json'):
+            profiler.write_chrome_trace(setting)
+            sys.stderr.write('wrote chrome trace to '+setting+'\n')
+    atexit.register(report)
+    return profiler
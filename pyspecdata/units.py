@@ -14,6 +14,76 @@ unicode_superscript = {
 for j in range(4,10):
     unicode_superscript.update({str(j):(u'\\u207'+str(j)).decode('unicode_escape')})
 
+#{{{ shared by all instances -- nothing here depends on the instance, so
+#    it's built once, rather than every time a units object is created
+base_dtype = dtype(map(lambda x: (str(x), float16), ['m', 'g', 's', 'A',# str is needed because it doesn't understand unicode
+    'K', 'mol', 'cd', 'rad']))
+oom_names =   ['T' , 'G' , 'M' , 'k' , 'c' , 'm' , u'\u03bc' , 'n' , 'p']
+oom_values =      r_[12 , 9   , 6   , 3   , -2  , -3  , -6     , -9  , -12]
+oom_dict = dict(zip(oom_names,oom_values))
+_base_units = eye(len(base_dtype.names),dtype=float16).view(base_dtype)
+_base_units_oom = zeros((len(base_dtype.names),1),dtype=base_dtype)
+_base_units.flags.writeable = False
+_base_units_oom.flags.writeable = False
+_derived_definitions = [('T','kg/A*s^2')]#, ('N','kg*m/s^2'), ('C','A*s'),]
+_derived_matrices = {} # keyed by the tuple of definitions
+_mu_re = re.compile(r'\bu|\\mu ')
+_split_regexps = map(re.compile,[r'\bsqrt\((.*)\)',
+    r'(?:\*| *)',
+    r'/',
+    r'(?:\^|\*\*)([\-\.0-9]+)', ])# the first in the order of operations are actually inside
+_oom_regexps = {} # keyed by the names of the derived dtype
+#}}}
+#{{{ caches of parsed strings and of the results of unit algebra
+#    -- the values are read-only (unit_vec, prefix_vec) pairs
+_parse_cache = {} # keyed by (string, names of the derived dtype)
+_parse_cache_order = []
+_parse_cache_size = 256
+_algebra_cache = {} # keyed by (operation, key of the first operand, key or number of the second)
+_algebra_cache_order = []
+_algebra_cache_size = 256
+def _cache_get(cache,cache_order,thiskey):
+    "return the cached value for `thiskey` (or None), and mark it as most recently used"
+    retval = cache.get(thiskey,None)
+    if retval is not None:
+        cache_order.remove(thiskey)
+        cache_order.append(thiskey)
+    return retval
+def _cache_put(cache,cache_order,cache_size,thiskey,unit_vec,prefix_vec):
+    "store read-only copies of `unit_vec` and `prefix_vec` under `thiskey`, dropping the least recently used entries"
+    unit_vec = unit_vec.copy()
+    prefix_vec = prefix_vec.copy()
+    unit_vec.flags.writeable = False
+    prefix_vec.flags.writeable = False
+    cache[thiskey] = (unit_vec,prefix_vec)
+    cache_order.append(thiskey)
+    while len(cache_order) > cache_size:
+        del cache[cache_order.pop(0)]
+def _memoized_algebra(opname):
+    """decorator that caches the result of a binary operation on units --
+    the second operand is either another units object or a number"""
+    def decorator(operation):
+        def wrapper(self,arg):
+            if isinstance(arg,units):
+                thiskey = (opname,self._key(),arg._key())
+            else:
+                thiskey = (opname,self._key(),arg)
+            try:
+                cached = _cache_get(_algebra_cache,_algebra_cache_order,thiskey)
+            except TypeError:# unhashable argument
+                return operation(self,arg)
+            if cached is None:
+                retval = operation(self,arg)
+                _cache_put(_algebra_cache,_algebra_cache_order,_algebra_cache_size,
+                        thiskey,retval.unit_vec,retval.prefix_vec)
+                return retval
+            return units._from_vectors(*cached)
+        wrapper.__name__ = operation.__name__
+        wrapper.__doc__ = operation.__doc__
+        return wrapper
+    return decorator
+#}}}
+
 class units (object):
     r"""Each instance of this object stores a numerical representation of a single set of units, and there are routines to set units by
     (*i.e.* :func:`parsing <pyspecdata.units.parse>`) strings to units
@@ -29,28 +99,44 @@ class units (object):
     vector with ``.view((float16,len(base_dtype.names)))``.
     "Base Units" here are the same as SI base units **except** that it uses g instead of kg (so we can do  the prefixes correctly), and we have added rad.
     """
+    base_dtype = base_dtype
+    oom_names = oom_names
+    oom_dict = oom_dict
+    derived_units = _base_units
+    derived_units_oom = _base_units_oom
+    derived_dtype = base_dtype
     def __init__(self,*args):
         "If an argument is passed, it's passed to :func:`parse <pyspecdata.units.parse>`"
-        self.base_dtype = dtype(map(lambda x: (str(x), float16), ['m', 'g', 's', 'A',# str is needed because it doesn't understand unicode
-            'K', 'mol', 'cd', 'rad']))
-        self.oom_names =   ['T' , 'G' , 'M' , 'k' , 'c' , 'm' , u'\u03bc' , 'n' , 'p']
-        oom_values =      r_[12 , 9   , 6   , 3   , -2  , -3  , -6     , -9  , -12]
-        self.oom_dict = dict(zip(self.oom_names,oom_values))
         self.unit_vec = zeros(1,dtype = self.base_dtype)
         self.prefix_vec = zeros(1,dtype = self.base_dtype)
-        # {{{ load the base units into the derived units matrix
-        identity_matrix = eye(len(self.base_dtype.names),dtype=float16).view(self.base_dtype)
-        zero_matrix = zeros((len(self.base_dtype.names),1),dtype=self.base_dtype)
-        self.derived_units = identity_matrix
-        self.derived_units_oom = zero_matrix
-        # }}}
-        self.derived_dtype = self.base_dtype
         if len(args) > 0:
             self.load_derived()
             if len(args) > 1:
                 raise ValueError("only one argument allowed")
             self.parse(args[0])
         return
+    @classmethod
+    def _from_vectors(cls,unit_vec,prefix_vec):
+        "make a new instance from (copies of) the given unit and prefix vectors"
+        retval = cls()
+        retval.unit_vec = unit_vec.copy()
+        retval.prefix_vec = prefix_vec.copy()
+        return retval
+    def _key(self):
+        "a hashable representation of the units (adding 0 turns -0 into 0)"
+        return ((self.unit_vec.view(float16)+float16(0)).tostring(),
+                (self.prefix_vec.view(float16)+float16(0)).tostring())
+    def __hash__(self):
+        return hash(self._key())
+    def __eq__(self,arg):
+        if not isinstance(arg,units):
+            return NotImplemented
+        return self._key() == arg._key()
+    def __ne__(self,arg):
+        retval = self.__eq__(arg)
+        if retval is NotImplemented:
+            return retval
+        return not retval
     def load_derived(self):
         r"""Parses and loads a series of definitions for derived units.
 
@@ -59,37 +145,45 @@ class units (object):
 
         Then, (not yet done), based on the dictionary that this generates, it
         will generate a matrix that converts from the derived dtype vector to
-        the base dtype vector."""
-        definition_list = [('T','kg/A*s^2')]#, ('N','kg*m/s^2'), ('C','A*s'),]
-        self.derived_dtype = dtype(map(lambda x: (x, float16),
-            list(self.base_dtype.names) + map(lambda y:
-                str(y[0]),definition_list)))
-        new_derived_units = zeros((len(self.base_dtype.names) +
-                len(definition_list),1),self.base_dtype)
-        new_derived_units[:len(self.derived_units)] = self.derived_units
-        self.derived_units = new_derived_units
-        # at this point, base units are along the rows and derived
-        # units along the columns
-        self.derived_units = ascontiguousarray(
-                self.derived_units.view(float16).T) # transpose maps
-        print "shape of derived units",self.derived_units.shape
-        #        from derived to base, and ascontiguousarray is needed
-        #        to allow the subsequent view command
-        self.derived_units = self.derived_units.view(
-                self.derived_dtype) # the view converts this into a
-        #       structured array
-        self.derived_units_oom = zeros((len(self.base_dtype.names),1),self.derived_dtype)# just re-use the dtype
-        # {{{ this is a lot of calculation that can be saved in the future by loading from a file
-        temp = units()
-        for j in definition_list:
-            thisunit,thismath = j
-            temp.parse(thismath)
-            self.derived_units[thisunit] = temp.unit_vec.view(float16).reshape(-1,1)
-            print "for",thisunit,"prefix vector is",temp.prefix_vec
-            self.derived_units_oom[thisunit] = temp.prefix_vec.view(float16).reshape(-1,1)
-        # }}}
-        print self.derived_units_oom.dtype.names
-        print self.derived_units_oom
+        the base dtype vector.
+
+        The result is the same for every instance, so it's only calculated
+        the first time, and the (read-only) matrices are shared after that."""
+        thiskey = tuple(_derived_definitions)
+        if thiskey not in _derived_matrices:
+            definition_list = _derived_definitions
+            derived_dtype = dtype(map(lambda x: (x, float16),
+                list(base_dtype.names) + map(lambda y:
+                    str(y[0]),definition_list)))
+            derived_units = zeros((len(base_dtype.names) +
+                    len(definition_list),1),base_dtype)
+            derived_units[:len(_base_units)] = _base_units
+            # at this point, base units are along the rows and derived
+            # units along the columns
+            derived_units = ascontiguousarray(
+                    derived_units.view(float16).T) # transpose maps
+            print "shape of derived units",derived_units.shape
+            #        from derived to base, and ascontiguousarray is needed
+            #        to allow the subsequent view command
+            derived_units = derived_units.view(
+                    derived_dtype) # the view converts this into a
+            #       structured array
+            derived_units_oom = zeros((len(base_dtype.names),1),derived_dtype)# just re-use the dtype
+            # {{{ this is a lot of calculation that can be saved in the future by loading from a file
+            temp = units()
+            for j in definition_list:
+                thisunit,thismath = j
+                temp.parse(thismath)
+                derived_units[thisunit] = temp.unit_vec.view(float16).reshape(-1,1)
+                print "for",thisunit,"prefix vector is",temp.prefix_vec
+                derived_units_oom[thisunit] = temp.prefix_vec.view(float16).reshape(-1,1)
+            # }}}
+            print derived_units_oom.dtype.names
+            print derived_units_oom
+            derived_units.flags.writeable = False
+            derived_units_oom.flags.writeable = False
+            _derived_matrices[thiskey] = (derived_dtype,derived_units,derived_units_oom)
+        self.derived_dtype,self.derived_units,self.derived_units_oom = _derived_matrices[thiskey]
         return self
     def parse(self,in_str, verbose=True):
         u"""Take `in_str` and parse it as a unit or series of units, and set the units associated with the current instance to the result.
@@ -106,22 +200,29 @@ class units (object):
         
         At this point, I use split to break up according to the order of operations, assign powers to each, and determine the prefix.
         However, I'm currently only using base units, and I will eventually want to use derived units as well.
+
+        The result is cached (by string, for the current set of derived
+        units), so parsing a string that's already been seen just copies
+        the cached unit and prefix vectors (and doesn't print anything,
+        even with `verbose`).
         """
         in_str = unicode(in_str)
-        mu_re = re.compile(r'\bu|\\mu ')
-        in_str = mu_re.sub(u'\u03bc',in_str)
+        in_str = _mu_re.sub(u'\u03bc',in_str)
+        cache_key = (in_str,self.derived_dtype.names)
+        cached = _cache_get(_parse_cache,_parse_cache_order,cache_key)
+        if cached is not None:
+            self.unit_vec = cached[0].copy()
+            self.prefix_vec = cached[1].copy()
+            return self
         working_list = [in_str]
         unit_powers = [1]
-        for op_num,this_regexp in enumerate([r'\bsqrt\((.*)\)',
-            r'(?:\*| *)',
-            r'/',
-            r'(?:\^|\*\*)([\-\.0-9]+)', ]):# the first in the order of operations are actually inside
+        for op_num,this_regexp in enumerate(_split_regexps):
             last_len = 0
             while len(working_list) > last_len:
                 last_len = len(working_list)
-                working_list = map(lambda x: re.split(this_regexp,x,maxsplit = 1),
+                working_list = map(lambda x: this_regexp.split(x,maxsplit = 1),
                         working_list)
-                if verbose: print "broken according to",this_regexp
+                if verbose: print "broken according to",this_regexp.pattern
                 new_unit_powers = [[unit_powers[j]]*len(working_list[j]) for j
                         in range(len(working_list))]
                 for j,v in enumerate(new_unit_powers):
@@ -158,9 +259,10 @@ class units (object):
                 unit_powers = list(chain(*unit_powers))
         if verbose: print "Final result:"
         if verbose: print unit_powers
-        oom_regexp = r'^('+'|'.join(self.oom_names)+'){0,1}'+'('+'|'.join(self.derived_dtype.names)+r')$'
-        if verbose: print "oom_regexp",repr(oom_regexp)
-        oom_regexp = re.compile(oom_regexp)
+        if self.derived_dtype.names not in _oom_regexps:
+            _oom_regexps[self.derived_dtype.names] = re.compile(r'^('+'|'.join(self.oom_names)+'){0,1}'+'('+'|'.join(self.derived_dtype.names)+r')$')
+        oom_regexp = _oom_regexps[self.derived_dtype.names]
+        if verbose: print "oom_regexp",repr(oom_regexp.pattern)
         if verbose: print working_list
         if verbose: print "breaks into:"
         self.unit_vec = zeros(1,dtype = self.base_dtype)
@@ -214,6 +316,8 @@ class units (object):
         if verbose: print "leading to:"
         if verbose: print self.unit_vec.dtype.names
         if verbose: print r_[self.unit_vec,self.prefix_vec] 
+        _cache_put(_parse_cache,_parse_cache_order,_parse_cache_size,
+                cache_key,self.unit_vec,self.prefix_vec)
         return self
     def __unicode__(self):# like __str__
         return self.str(1,using_unicode = True)# might not work, because some characters not included
@@ -277,6 +381,7 @@ class units (object):
             retval = render_string([j for j in self.unit_vec.dtype.names if self.unit_vec[j] < 0])
         # }}}
         return retval
+    @_memoized_algebra('mul')
     def __mul__(self,arg):
         r"""Multiply units.
 
@@ -293,6 +398,7 @@ class units (object):
         retval_net_prefix[nonzero_mask] /= retval_unitvec[nonzero_mask]
         retval.prefix_vec.view(float16)[:] = retval_net_prefix
         return retval
+    @_memoized_algebra('div')
     def __div__(self,arg):
         r"""Divide units.
 
@@ -309,6 +415,7 @@ class units (object):
         retval_net_prefix[nonzero_mask] /= retval_unitvec[nonzero_mask]
         retval.prefix_vec.view(float16)[:] = retval_net_prefix
         return retval
+    @_memoized_algebra('pow')
     def __pow__(self,thisnumber):
         retval = units()
         retval.unit_vec.view(float16)[:] = self.unit_vec.view(float16) * thisnumber
@@ -318,6 +425,7 @@ class units (object):
         if arg != 1:
             raise ValueError("left division of units only supported with 1")
         return self**-1
+    @_memoized_algebra('div')
     def __div__(self,arg):
         retval = units()
         retval.unit_vec.view(float16)[:] = self.unit_vec.view(float16) - arg.unit_vec.view(float16)